@@ -1,4 +1,4 @@
 
 from .data import ChatContext, ChatResponse
 from .functions import GLOBAL_FUNCTIONS_REGISTRY
-from .proxy import CompletionsProxy, AssistantProxy, EmbeddingProxy, ProxyRegistry, GLOBAL_PROXIES_REGISTRY
+from .proxy import CompletionsProxy, AsyncCompletionsProxy, AssistantProxy, EmbeddingProxy, ProxyRegistry, GLOBAL_PROXIES_REGISTRY
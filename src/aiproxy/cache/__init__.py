@@ -0,0 +1,5 @@
+from ..interfaces.abstract_response_cache import ResponseCache, NoOpResponseCache
+from .memory_response_cache import MemoryResponseCache
+from .sqlite_response_cache import SqliteResponseCache
+from .completion_cache import load_response_cache, get_response_cache_stats
+from .semantic_cache import SemanticCache, get_semantic_cache, get_semantic_cache_stats
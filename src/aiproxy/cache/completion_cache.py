@@ -0,0 +1,176 @@
+import os
+import asyncio
+import json
+from hashlib import sha256
+from threading import Lock
+
+from openai.types.chat import ChatCompletion
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from aiproxy.data.chat_config import ChatConfig
+from ..interfaces.abstract_response_cache import ResponseCache
+
+DEFAULT_RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', './.cache/response-cache.db')
+
+## NB. A response that asks for tools to be called isn't cached, as replaying it would call the (possibly side-effecting) tools again, with arguments generated for another time
+_CACHEABLE_FINISH_REASONS = ['stop']
+_KEY_ARGS = ['model', 'messages', 'tools', 'tool_choice', 'temperature', 'top_p', 'max_tokens', 'response_format', 'seed']
+
+_RESPONSE_CACHES:dict[tuple, ResponseCache] = {}
+_RESPONSE_CACHES_LOCK = Lock()
+
+def load_response_cache(config:ChatConfig) -> ResponseCache:
+    """
+    Load the response cache configured for the config (or None if the config doesn't opt in to response caching)
+
+    Configs that specify the same cache settings share the one cache
+    """
+    cache_type = config.get('response-cache')
+    if cache_type is None or cache_type is False: return None
+    if type(cache_type) is str:
+        cache_type = cache_type.lower()
+        if cache_type in ['false', '0', 'n', 'f', 'off', 'no', 'disabled', 'none']: return None
+        if cache_type in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']: cache_type = 'memory'
+    else:
+        cache_type = 'memory'
+
+    ttl_secs = float(config.get('response-cache-ttl-secs', 3600))
+    max_entries = int(config.get('response-cache-max-entries', 1000))
+    path = config.get('response-cache-path', DEFAULT_RESPONSE_CACHE_PATH) if cache_type == 'sqlite' else None
+    key = (cache_type, path, ttl_secs, max_entries)
+
+    with _RESPONSE_CACHES_LOCK:
+        cache = _RESPONSE_CACHES.get(key)
+        if cache is None:
+            if cache_type == 'memory':
+                from .memory_response_cache import MemoryResponseCache
+                cache = MemoryResponseCache(max_entries=max_entries, ttl_secs=ttl_secs)
+            elif cache_type == 'sqlite':
+                from .sqlite_response_cache import SqliteResponseCache
+                cache = SqliteResponseCache(path, max_entries=max_entries, ttl_secs=ttl_secs)
+            else:
+                raise ValueError(f"Unknown response cache type: {cache_type} (expected 'memory' or 'sqlite')")
+            _RESPONSE_CACHES[key] = cache
+    return cache
+
+def get_response_cache_stats() -> list[dict[str,any]]:
+    """
+    Returns the hit/miss counters of all the response caches that have been loaded
+    """
+    return [ cache.stats() for cache in list(_RESPONSE_CACHES.values()) ]
+
+def completion_cache_key(args:dict[str,any], endpoint:str = None, api_version:str = None) -> str:
+    """
+    Builds the cache key for a call to the Chat Completions API (a hash of the endpoint, model, messages, tools + the sampling parameters)
+
+    The endpoint is part of the key, as the same deployment name (the `model`) can be a different model on each resource
+    """
+    key_data = { k: args.get(k) for k in _KEY_ARGS if args.get(k) is not None }
+    if endpoint is not None: key_data['_endpoint'] = endpoint.rstrip('/').lower()
+    if api_version is not None: key_data['_api_version'] = api_version
+    return sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+
+def cacheable_completion(result:ChatCompletion) -> dict[str,any]:
+    """
+    Extract the response to cache from a (non-streamed) completion, or None if it shouldn't be cached
+    """
+    if result.choices is None or len(result.choices) != 1: return None
+    choice = result.choices[0]
+    if choice.finish_reason not in _CACHEABLE_FINISH_REASONS or choice.message is None: return None
+    tool_calls = None
+    if choice.message.tool_calls is not None and len(choice.message.tool_calls) > 0:
+        tool_calls = [ { 'id': tool.id, 'type': tool.type, 'function': { 'name': tool.function.name, 'arguments': tool.function.arguments } } for tool in choice.message.tool_calls ]
+    return { 'content': choice.message.content, 'tool_calls': tool_calls, 'finish_reason': choice.finish_reason }
+
+def is_replayable(cached:dict[str,any]) -> bool:
+    """
+    Whether a cached response can be replayed (eg. not a response asking for tools to be called, cached before those stopped being cached)
+    """
+    return cached.get('finish_reason') in _CACHEABLE_FINISH_REASONS
+
+def replay_completion(cached:dict[str,any], model:str, stream:bool) -> ChatCompletion|list[ChatCompletionChunk]:
+    """
+    Rebuild a cached response in the same shape as the API would have returned it (a completion, or a list of chunks when streaming)
+    """
+    if not stream:
+        return ChatCompletion.model_validate({
+            'id': 'cached', 'object': 'chat.completion', 'created': 0, 'model': model,
+            'choices': [ { 'index': 0, 'finish_reason': cached.get('finish_reason'), 'message': { 'role': 'assistant', 'content': cached.get('content'), 'tool_calls': cached.get('tool_calls') } } ]
+        })
+
+    delta = { 'role': 'assistant' }
+    if cached.get('content') is not None:
+        delta['content'] = cached.get('content')
+    if cached.get('tool_calls') is not None:
+        delta['tool_calls'] = [ dict(tool, index=idx) for idx, tool in enumerate(cached.get('tool_calls')) ]
+    return [
+        ChatCompletionChunk.model_validate({ 'id': 'cached', 'object': 'chat.completion.chunk', 'created': 0, 'model': model, 'choices': [ { 'index': 0, 'delta': delta, 'finish_reason': None } ] }),
+        ChatCompletionChunk.model_validate({ 'id': 'cached', 'object': 'chat.completion.chunk', 'created': 0, 'model': model, 'choices': [ { 'index': 0, 'delta': {}, 'finish_reason': cached.get('finish_reason') } ] }),
+    ]
+
+
+class _StreamCapture:
+    """
+    Accumulates the chunks of a streamed completion into the response to cache
+    """
+    def __init__(self, cache:ResponseCache, key:str):
+        self._cache = cache
+        self._key = key
+        self._content = None
+        self._tool_calls = {}
+        self._finish_reason = None
+        self._cacheable = True
+
+    def add(self, chunk:ChatCompletionChunk):
+        if not self._cacheable or chunk.choices is None: return
+        for choice in chunk.choices:
+            if choice.index is not None and choice.index > 0:
+                self._cacheable = False     ## Only single choice responses are cached
+                return
+            if choice.delta is not None:
+                if choice.delta.content is not None:
+                    self._content = choice.delta.content if self._content is None else self._content + choice.delta.content
+                for tool in choice.delta.tool_calls or []:
+                    tool_call = self._tool_calls.setdefault(tool.index, { 'id': None, 'type': 'function', 'function': { 'name': None, 'arguments': '' } })
+                    if tool.id is not None: tool_call['id'] = tool.id
+                    if tool.type is not None: tool_call['type'] = tool.type
+                    if tool.function is not None:
+                        if tool.function.name is not None: tool_call['function']['name'] = tool.function.name
+                        if tool.function.arguments is not None: tool_call['function']['arguments'] += tool.function.arguments
+            if choice.finish_reason is not None:
+                self._finish_reason = choice.finish_reason
+
+    def complete(self):
+        if not self._cacheable or self._finish_reason not in _CACHEABLE_FINISH_REASONS: return
+        tool_calls = [ self._tool_calls[idx] for idx in sorted(self._tool_calls.keys()) ] if len(self._tool_calls) > 0 else None
+        self._cache.set(self._key, { 'content': self._content, 'tool_calls': tool_calls, 'finish_reason': self._finish_reason })
+
+
+class CachingStream:
+    """
+    Wraps a streamed completion, passing the chunks through as they arrive and caching the response once the stream completes
+    """
+    def __init__(self, stream, cache:ResponseCache, key:str):
+        self._stream = stream
+        self._capture = _StreamCapture(cache, key)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._capture.add(chunk)
+            yield chunk
+        self._capture.complete()
+
+
+class AsyncCachingStream:
+    """
+    The asyncio equivalent of the `CachingStream`
+    """
+    def __init__(self, stream, cache:ResponseCache, key:str):
+        self._stream = stream
+        self._capture = _StreamCapture(cache, key)
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._capture.add(chunk)
+            yield chunk
+        await asyncio.to_thread(self._capture.complete)     ## (Writing to the cache may block, eg. on a SQLite database)
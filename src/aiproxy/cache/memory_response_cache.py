@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from ..interfaces.abstract_response_cache import ResponseCache
+
+class MemoryResponseCache(ResponseCache):
+    """
+    An in-process LRU cache of responses, with each entry expiring after a TTL
+    """
+    _entries:OrderedDict[str, tuple[float, dict[str,any]]]
+    _max_entries:int
+    _ttl_secs:float
+    _lock:Lock
+
+    def __init__(self, max_entries:int = 1000, ttl_secs:float = 3600):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl_secs = ttl_secs
+        self._lock = Lock()
+
+    def get(self, key:str) -> dict[str,any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > 0 and entry[0] < time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            self._record_lookup(entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key:str, value:dict[str,any], ttl_secs:float = None):
+        ttl = ttl_secs if ttl_secs is not None else self._ttl_secs
+        expires_at = time() + ttl if ttl is not None and ttl > 0 else 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while self._max_entries > 0 and len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str,any]:
+        stats = super().stats()
+        stats['entries'] = len(self._entries)
+        return stats
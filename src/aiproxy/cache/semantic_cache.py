@@ -0,0 +1,158 @@
+import os
+import hashlib
+from threading import Lock
+from time import time
+
+import numpy as np
+
+DEFAULT_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))
+
+_SEMANTIC_CACHES:dict[str, 'SemanticCache'] = {}
+_SEMANTIC_CACHES_LOCK = Lock()
+
+class SemanticCacheEntry:
+    prompt:str = None
+    response:dict[str,any] = None
+    scope:str = None
+
+    def __init__(self, prompt:str, response:dict[str,any], scope:str = None):
+        self.prompt = prompt
+        self.response = response
+        self.scope = scope
+
+
+class SemanticCache:
+    """
+    An in-memory cache of responses, looked up by the (cosine) similarity of the embedding of the prompt
+
+    The embeddings are held (normalised) in a single NumPy matrix, so a lookup is one matrix-vector product.
+    Once the cache is full, the oldest entries are overwritten.
+
+    Each entry can be added under a scope (eg. a hash of the system prompt it was answered with), and is then only returned by lookups in the same scope.
+    """
+    threshold:float = DEFAULT_SEMANTIC_CACHE_THRESHOLD
+    hits:int = 0
+    misses:int = 0
+    _max_entries:int
+    _ttl_secs:float
+    _vectors:np.ndarray = None
+    _expires:np.ndarray = None
+    _scopes:np.ndarray = None
+    _entries:list[SemanticCacheEntry] = None
+    _count:int = 0
+    _next:int = 0
+    _lock:Lock
+
+    def __init__(self, threshold:float = DEFAULT_SEMANTIC_CACHE_THRESHOLD, max_entries:int = 1000, ttl_secs:float = 3600):
+        self.threshold = threshold
+        self._max_entries = max(max_entries, 1)
+        self._ttl_secs = ttl_secs
+        self._entries = []
+        self._lock = Lock()
+
+    def lookup(self, embedding:list[float], scope:str = None) -> tuple[SemanticCacheEntry, float]:
+        """
+        Find the most similar cached prompt (in the scope), returning the entry (or None if it's not similar enough) and the similarity
+        """
+        vector = _normalise(embedding)
+        scope_hash = _scope_hash(scope)
+        with self._lock:
+            if self._count == 0 or vector is None or vector.shape[0] != self._vectors.shape[1]:
+                self.misses += 1
+                return None, 0.0
+            similarities = self._vectors[:self._count] @ vector
+            expires = self._expires[:self._count]
+            similarities = np.where((expires <= 0) | (expires > time()), similarities, -1.0)    ## Ignore any expired entries
+            similarities = np.where(self._scopes[:self._count] == scope_hash, similarities, -1.0)     ## + any entries from other scopes
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity >= self.threshold and self._entries[best].scope == scope:
+                self.hits += 1
+                return self._entries[best], similarity
+            self.misses += 1
+            return None, max(similarity, 0.0)
+
+    def add(self, embedding:list[float], prompt:str, response:dict[str,any], scope:str = None):
+        vector = _normalise(embedding)
+        if vector is None: return
+        entry = SemanticCacheEntry(prompt, response, scope)
+        expires_at = time() + self._ttl_secs if self._ttl_secs is not None and self._ttl_secs > 0 else 0
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                ## First entry (or the embedding model has changed), so (re)start the index
+                self._vectors = np.zeros((min(64, self._max_entries), vector.shape[0]), dtype=np.float32)
+                self._expires = np.zeros(self._vectors.shape[0], dtype=np.float64)
+                self._scopes = np.zeros(self._vectors.shape[0], dtype=np.int64)
+                self._entries = []
+                self._count = 0
+                self._next = 0
+            elif self._next >= self._vectors.shape[0] and self._vectors.shape[0] < self._max_entries:
+                ## Grow the index (doubling it, up to the max number of entries)
+                grown = np.zeros((min(self._vectors.shape[0] * 2, self._max_entries), self._vectors.shape[1]), dtype=np.float32)
+                grown[:self._count] = self._vectors[:self._count]
+                self._vectors = grown
+                self._expires = np.concatenate([self._expires, np.zeros(grown.shape[0] - self._expires.shape[0], dtype=np.float64)])
+                self._scopes = np.concatenate([self._scopes, np.zeros(grown.shape[0] - self._scopes.shape[0], dtype=np.int64)])
+
+            if self._next >= self._vectors.shape[0]:
+                self._next = 0      ## The cache is full, so overwrite the oldest entry
+            self._vectors[self._next] = vector
+            self._expires[self._next] = expires_at
+            self._scopes[self._next] = _scope_hash(scope)
+            if self._next < len(self._entries):
+                self._entries[self._next] = entry
+            else:
+                self._entries.append(entry)
+            self._next += 1
+            self._count = max(self._count, self._next)
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._expires = None
+            self._scopes = None
+            self._entries = []
+            self._count = 0
+            self._next = 0
+
+    def stats(self) -> dict[str,any]:
+        lookups = self.hits + self.misses
+        return {
+            'type': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit-ratio': self.hits / lookups if lookups > 0 else 0.0,
+            'entries': self._count,
+        }
+
+
+def _normalise(embedding:list[float]) -> np.ndarray:
+    if embedding is None: return None
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if vector.ndim != 1 or norm == 0: return None
+    return vector / norm
+
+def _scope_hash(scope:str) -> int:
+    ## (The scopes are compared as 64 bit hashes, so the lookup stays a single pass over the arrays, the scope of the best match is then checked in full)
+    if scope is None: return 0
+    return int.from_bytes(hashlib.blake2b(scope.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def get_semantic_cache(scope:str, threshold:float = DEFAULT_SEMANTIC_CACHE_THRESHOLD, max_entries:int = 1000, ttl_secs:float = 3600) -> SemanticCache:
+    """
+    Get the semantic cache for the scope (usually the name of the config), creating it if needed
+    """
+    cache = _SEMANTIC_CACHES.get(scope)
+    if cache is None:
+        with _SEMANTIC_CACHES_LOCK:
+            cache = _SEMANTIC_CACHES.get(scope)
+            if cache is None:
+                cache = SemanticCache(threshold=threshold, max_entries=max_entries, ttl_secs=ttl_secs)
+                _SEMANTIC_CACHES[scope] = cache
+    return cache
+
+def get_semantic_cache_stats() -> dict[str, dict[str,any]]:
+    """
+    Returns the hit/miss counters of each of the semantic caches (by scope)
+    """
+    return { scope: cache.stats() for scope, cache in list(_SEMANTIC_CACHES.items()) }
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from ..interfaces.abstract_response_cache import ResponseCache
+
+## The last used times of the entries that are read are written in batches of this many (rather than a write per hit), so the LRU order is approximate
+TOUCH_BATCH_SIZE = 100
+## The entries beyond `max_entries` are evicted once there are this much more than it (as a fraction of `max_entries`), rather than on every set
+EVICTION_HEADROOM = 0.1
+
+class SqliteResponseCache(ResponseCache):
+    """
+    A response cache persisted to a SQLite database file (so it survives restarts + can be shared by multiple processes on the same host)
+
+    Entries expire after a TTL, and the least recently used entries are evicted once there are more than `max_entries`
+
+    To keep lookups cheap, a hit doesn't write to the database, the last used times are written in batches (with the next set, or every `TOUCH_BATCH_SIZE` hits),
+    and the entries are only counted + evicted once this process has added enough of them to go past `max_entries` by the `EVICTION_HEADROOM` (along with the expired ones)
+    """
+    _db_path:str
+    _max_entries:int
+    _ttl_secs:float
+    _conn:sqlite3.Connection
+    _lock:Lock
+
+    def __init__(self, db_path:str, max_entries:int = 10000, ttl_secs:float = 86400):
+        self._db_path = db_path
+        self._max_entries = max_entries
+        self._ttl_secs = ttl_secs
+        self._lock = Lock()
+        self._touched:dict[str, float] = {}
+        """The last used times of the entries that have been read since they were last written"""
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)")
+            self._count = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            """The (estimated) number of entries, counted at each eviction + incremented by each set"""
+
+    def get(self, key:str) -> dict[str,any]:
+        now = time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] > 0 and row[1] < now:
+                row = None  ## (Expired, it's deleted by the next eviction)
+            if row is not None:
+                self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    with self._conn:
+                        self._write_touched()
+            self._record_lookup(row is not None)
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key:str, value:dict[str,any], ttl_secs:float = None):
+        now = time()
+        ttl = ttl_secs if ttl_secs is not None else self._ttl_secs
+        expires_at = now + ttl if ttl is not None and ttl > 0 else 0
+        data = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)", (key, data, expires_at, now))
+            self._touched.pop(key, None)
+            self._write_touched()
+            self._count += 1
+            if self._max_entries > 0 and self._count > self._max_entries + max(1, int(self._max_entries * EVICTION_HEADROOM)):
+                self._evict(now)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache")
+            self._touched.clear()
+            self._count = 0
+
+    def stats(self) -> dict[str,any]:
+        stats = super().stats()
+        with self._lock:
+            stats['entries'] = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        return stats
+
+    def _write_touched(self):
+        ## NB. Must be called with the lock held, in a transaction
+        if len(self._touched) == 0: return
+        self._conn.executemany("UPDATE response_cache SET last_used = ? WHERE key = ?", [ (last_used, key) for key, last_used in self._touched.items() ])
+        self._touched.clear()
+
+    def _evict(self, now:float):
+        ## Delete the expired entries, then the least recently used entries beyond the max size
+        ## NB. Must be called with the lock held, in a transaction
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at > 0 AND expires_at < ?", (now,))
+        cur = self._conn.execute("DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self._max_entries,))
+        self.evictions += max(cur.rowcount, 0)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]     ## (Including the entries added by any other processes sharing the database)
@@ -2,6 +2,8 @@ from .chat_message import ChatMessage
 from .chat_chunk import ChunkData
 from .chat_config import ChatConfig
 from .chat_response import ChatResponse, ChatCitation
+from .token_usage import TokenUsage, UsageTracker, TokenBudgetExceededError
+from .lazy_history import LazyHistory, StaleHistoryError
 from .azure_search_config import AzureSearchConfig, AzureSearchVectorFieldConfig
 from .cosmosdb_config import CosmosDBConfig
 from .chat_context import ChatContext
\ No newline at end of file
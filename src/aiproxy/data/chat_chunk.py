@@ -4,31 +4,124 @@ from uuid import uuid4
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk, Choice as StreamChoice, ChoiceDelta, ChoiceDeltaFunctionCall, ChoiceDeltaToolCall, ChoiceDeltaToolCallFunction
 from .chat_response import ChatCitation
 
+class _TextParts:
+    """
+    The fragments of a streamed string, which are only joined (once) when the string is read, rather than copying the whole string as each fragment arrives
+    """
+    __slots__ = ('parts', 'length')
+
+    def __init__(self):
+        self.parts:list[str] = []
+        self.length = 0
+
+    def append(self, text:str):
+        self.parts.append(text)
+        self.length += len(text)
+
+    def value(self) -> str:
+        if len(self.parts) == 0: return None
+        if len(self.parts) > 1: self.parts[:] = [ "".join(self.parts) ]    ## (Keep the joined string, so reading it again doesn't join it again)
+        return self.parts[0]
+
+    def set(self, text:str):
+        self.parts.clear()
+        self.length = 0
+        if text is not None: self.append(text)
+
+    def take(self) -> str:
+        value = self.value()
+        self.set(None)
+        return value
+
+
 class ChunkToolCallFunction:
-    name:str = None
-    arguments:str = None
+    __slots__ = ('name', '_arguments')
+
+    def __init__(self):
+        self.name:str = None
+        self._arguments = _TextParts()
+
+    @property
+    def arguments(self) -> str:
+        return self._arguments.value()
+
+    @arguments.setter
+    def arguments(self, arguments:str):
+        self._arguments.set(arguments)
 
 class ChunkToolCallData:
-    index:int = 0
-    id:str = None
-    type:str = None
-    function:ChunkToolCallFunction = None
+    __slots__ = ('index', 'id', 'type', 'function')
 
-    def __init__(self):
+    def __init__(self, index:int = 0):
+        self.index = index
+        self.id:str = None
+        self.type = "function"      ## (Only the first delta of a tool call has its type, and functions are the only type of tool that's streamed)
         self.function = ChunkToolCallFunction()
 
 class ChunkData:
-    assigned_id:str = None
-    content:str = None
-    role:str = None
-    tool_calls:list[ChunkToolCallData] = None
-    accumulated_delta:str = None
-    last_stream_publish:int = 0
+    """
+    Accumulates the deltas of a streamed response (the content, the tool calls, and the content that hasn't been published to the stream yet)
 
-    tool_content = None
+    The fragments are collected in lists and only joined when read, so accumulating a long response takes linear time (rather than copying the content so far on every delta)
+    """
+    __slots__ = ('assigned_id', 'role', 'last_stream_publish', 'publish_cadence', '_content', '_accumulated_delta', '_tool_content', '_tool_calls')
 
     def __init__(self, id:str = None):
         self.assigned_id = id or uuid4().hex
+        self.role:str = None
+        self.last_stream_publish:float = 0
+        self.publish_cadence:'PublishCadence' = None    ## (When the accumulated deltas are published, which adapts to the stream over the steps of the response)
+        self._content = _TextParts()
+        self._accumulated_delta = _TextParts()
+        """The content that hasn't been published to the stream yet"""
+        self._tool_content = _TextParts()
+        self._tool_calls:dict[int, ChunkToolCallData] = {}
+
+    @property
+    def content(self) -> str:
+        return self._content.value()
+
+    @content.setter
+    def content(self, content:str):
+        self._content.set(content)
+
+    @property
+    def accumulated_delta(self) -> str:
+        return self._accumulated_delta.value()
+
+    @accumulated_delta.setter
+    def accumulated_delta(self, delta:str):
+        self._accumulated_delta.set(delta)
+
+    @property
+    def accumulated_delta_length(self) -> int:
+        return self._accumulated_delta.length
+
+    def take_accumulated_delta(self) -> str:
+        """
+        Returns the content accumulated since the last time it was taken (eg. to publish it to the stream), or None if there isn't any
+        """
+        return self._accumulated_delta.take()
+
+    @property
+    def tool_content(self) -> str:
+        return self._tool_content.value()
+
+    @tool_content.setter
+    def tool_content(self, content:str):
+        self._tool_content.set(content)
+
+    @property
+    def tool_calls(self) -> list[ChunkToolCallData]:
+        """
+        The tool calls in the order of their index (or None if there aren't any)
+        """
+        if len(self._tool_calls) == 0: return None
+        return [ self._tool_calls[index] for index in sorted(self._tool_calls) ]
+
+    @tool_calls.setter
+    def tool_calls(self, tool_calls:list[ChunkToolCallData]):
+        self._tool_calls = { tool_call.index: tool_call for tool_call in tool_calls or [] }
 
     def has_tool_citations(self) -> bool:
         if self.tool_content is not None: 
@@ -70,13 +163,13 @@ class ChunkData:
                 ## Receiving content
                 content = delta.get('content', None)
                 if content is None: continue
-                self.content = content if self.content is None else self.content + content
-                self.accumulated_delta = content if self.accumulated_delta is None else self.accumulated_delta + content
+                self._content.append(content)
+                self._accumulated_delta.append(content)
                 content_accumulated = True
             elif role == 'tool':
                 content = delta.get('content', None)
                 if content is None: continue
-                self.tool_content = content if self.tool_content is None else self.tool_content + content
+                self._tool_content.append(content)
             elif role == 'assistant': 
                 print("Assistant Delta:", delta)
             else: 
@@ -92,29 +185,20 @@ class ChunkData:
             self.role = delta.role
         
         if delta.content is not None:
-            self.content = delta.content if self.content is None else self.content + delta.content
-            self.accumulated_delta = delta.content if self.accumulated_delta is None else self.accumulated_delta + delta.content
+            self._content.append(delta.content)
+            self._accumulated_delta.append(delta.content)
         
         if delta.tool_calls is not None: 
-            if self.tool_calls is None: self.tool_calls = []
             for delta_tool in delta.tool_calls:
-                ## Find the matching tool call in the tool_calls list
-                tool_call = None
-                for self_tool_call in self.tool_calls:
-                    if self_tool_call.index == delta_tool.index:
-                        tool_call = self_tool_call                            
-                        break
-                
+                ## The deltas of a tool call are matched up by its index (only the first one has its id, type + name, the rest are fragments of its arguments)
+                tool_call = self._tool_calls.get(delta_tool.index)
                 if tool_call is None: 
-                    tool_call = ChunkToolCallData()
-                    self.tool_calls.append(tool_call)
+                    tool_call = self._tool_calls[delta_tool.index] = ChunkToolCallData(delta_tool.index)
 
-                if tool_call.type == "function" or delta_tool.type == "function":
-                    tool_call.index = delta_tool.index
-                    if delta_tool.id is not None: tool_call.id = delta_tool.id
-                    if delta_tool.type is not None: tool_call.type = delta_tool.type
+                if delta_tool.type is not None:
+                    if delta_tool.type != "function": raise ValueError(f"Unknown tool call type: {delta_tool.type}")
+                    tool_call.type = delta_tool.type
+                if delta_tool.id is not None: tool_call.id = delta_tool.id
+                if delta_tool.function is not None:
                     if delta_tool.function.name is not None: tool_call.function.name = delta_tool.function.name
-                    if delta_tool.function.arguments is not None: tool_call.function.arguments = delta_tool.function.arguments if tool_call.function.arguments is None else tool_call.function.arguments + delta_tool.function.arguments
-                else: 
-                    raise ValueError(f"Unknown tool call type: {delta_tool.type}")
-            
\ No newline at end of file
+                    if delta_tool.function.arguments is not None: tool_call.function._arguments.append(delta_tool.function.arguments)
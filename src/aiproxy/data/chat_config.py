@@ -1,5 +1,7 @@
 import os
 
+MAX_CACHED_PROMPT_TEMPLATES = int(os.environ.get('MAX_CACHED_PROMPT_TEMPLATES', 32))
+
 class ChatConfig:
     name:str
 
@@ -23,9 +25,19 @@ class ChatConfig:
 
     timeout_secs:int = None
     interim_result_publish_frequency_secs:float = 0.032
+    adaptive_publishing:bool = True
+    min_publish_frequency_secs:float = 0.016
+    max_publish_frequency_secs:float = 0.5
+    min_publish_batch_chars:int = 1
+    max_publish_batch_chars:int = 256
 
     max_steps:int = None
     max_history:int = None
+    use_history_window:bool = False
+    max_history_tokens:int = 0
+    summarise_history:bool = False
+    summarise_history_async:bool = True
+    max_parallel_tools:int = 1
 
     use_data_source_config:bool = False
     data_source_config:str = None
@@ -36,6 +48,8 @@ class ChatConfig:
 
     prompt_vars:dict[str, any]
 
+    _prompt_templates:dict[str, 'PromptTemplate'] = None
+
     def __init__(self, name:str):
         import os
         self.name = name
@@ -52,12 +66,22 @@ class ChatConfig:
         self.use_functions = os.environ.get('AI_USE_FUNCTIONS', 'true').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
         self.timeout_secs = int(os.environ.get('AI_TIMEOUT_SECS', 300))
         self.interim_result_publish_frequency_secs = float(os.environ.get('INTERIM_RESULT_PUBLISH_FREQUENCY_SECS', 0.064))
+        self.adaptive_publishing = os.environ.get('INTERIM_RESULT_ADAPTIVE_PUBLISHING', 'true').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+        self.min_publish_frequency_secs = float(os.environ.get('INTERIM_RESULT_MIN_PUBLISH_FREQUENCY_SECS', 0.016))
+        self.max_publish_frequency_secs = float(os.environ.get('INTERIM_RESULT_MAX_PUBLISH_FREQUENCY_SECS', 0.5))
+        self.min_publish_batch_chars = int(os.environ.get('INTERIM_RESULT_MIN_BATCH_CHARS', 1))
+        self.max_publish_batch_chars = int(os.environ.get('INTERIM_RESULT_MAX_BATCH_CHARS', 256))
         self.temperature = float(os.environ.get('AI_TEMPERATURE', 0.35))
         self.use_data_source_config = os.environ.get('AI_USE_DATA_SOURCE_CONFIG', 'false').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
         self.data_source_config = os.environ.get('AI_DATA_SOURCE_CONFIG', None)
         self.data_source_api_version = os.environ.get('AZURE_OAI_DATA_SOURCES_API_VERSION', None)
         self.max_steps = int(os.environ.get('AI_MAX_STEPS', 12))
         self.max_history = int(os.environ.get('AI_MAX_HISTORY', 25))
+        self.use_history_window = os.environ.get('AI_USE_HISTORY_WINDOW', 'false').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+        self.max_history_tokens = int(os.environ.get('AI_MAX_HISTORY_TOKENS', 0))
+        self.summarise_history = os.environ.get('AI_SUMMARISE_HISTORY', 'false').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+        self.summarise_history_async = os.environ.get('AI_SUMMARISE_HISTORY_ASYNC', 'true').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+        self.max_parallel_tools = int(os.environ.get('AI_MAX_PARALLEL_TOOLS', 1))
         self.top_p = float(os.environ.get('AI_TOP_P', 1.0))
         self.max_tokens = int(os.environ.get('AI_MAX_TOKENS', 2500))
         self.parse_ai_response = os.environ.get('AI_PARSE_RESPONSE', 'false').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
@@ -100,6 +124,21 @@ class ChatConfig:
             return self[k2]
         return default_val
 
+    def get_prompt_template(self, prompt:str) -> 'PromptTemplate':
+        """
+        Returns the compiled template for the prompt (compiling the prompt the first time it is seen)
+        """
+        if self._prompt_templates is None: 
+            self._prompt_templates = {}
+        template = self._prompt_templates.get(prompt)
+        if template is None:
+            from aiproxy.utils.prompt_template import PromptTemplate
+            if len(self._prompt_templates) >= MAX_CACHED_PROMPT_TEMPLATES:     ## Drop the oldest template, so that prompts that change on every request can't grow the cache forever
+                self._prompt_templates.pop(next(iter(self._prompt_templates)), None)
+            template = PromptTemplate(prompt)
+            self._prompt_templates[prompt] = template
+        return template
+
     def load(name:str|dict, raise_if_not_found:bool = False) -> 'ChatConfig':
         if type(name) is ChatConfig:    ## Catch for when the config has already been loaded and it was passed to another class that expected to have to load the config itself
             return name
@@ -129,12 +168,22 @@ class ChatConfig:
             "use_functions": (bool, ["use-functions", "ai-use-functions"]),
             "timeout_secs": (int, ["timeout", "timeout-secs", "ai-timeout"]),
             "interim_result_publish_frequency_secs": (float, [ "publish-frequency", "interim-result-publish-frequency", "interim-result-publish-frequency-secs"]),
+            "adaptive_publishing": (bool, ["adaptive-publishing", "adaptive-publish-frequency"]),
+            "min_publish_frequency_secs": (float, ["min-publish-frequency", "min-publish-frequency-secs"]),
+            "max_publish_frequency_secs": (float, ["max-publish-frequency", "max-publish-frequency-secs"]),
+            "min_publish_batch_chars": (int, ["min-publish-batch", "min-publish-batch-chars"]),
+            "max_publish_batch_chars": (int, ["max-publish-batch", "max-publish-batch-chars"]),
             "temperature": (float, ["temperature", "ai-temperature"]),
             "use_data_source_config": (bool, ["use-data-source-config", "use-data-source-extensions"]),
             "data_source_config": (str, ["data-source-config", "ai-source-config"]),
             "data_source_api_version": (str, ["data-source-oai-version", "ai-source-config-api-version"]),
             "max_steps": (int, ["max-steps", "ai-max-steps"]),
             "max_history": (int, ["max-history", "ai-max-history"]),
+            "use_history_window": (bool, ["use-history-window", "history-window"]),
+            "max_history_tokens": (int, ["max-history-tokens", "ai-max-history-tokens"]),
+            "summarise_history": (bool, ["summarise-history", "summarize-history", "ai-summarise-history"]),
+            "summarise_history_async": (bool, ["summarise-history-async", "summarize-history-async", "ai-summarise-history-async"]),
+            "max_parallel_tools": (int, ["max-parallel-tools", "ai-max-parallel-tools"]),
             "top_p": (float, ["top-p", "top_p"]),
             "max_tokens": (int, ["max-tokens", "max-tokens-generated"]),
             "parse_ai_response": (bool, ["parse-ai-response", "parse-response", 'ai-response-is-message-and-metadata']),
@@ -1,8 +1,16 @@
+import os
 from typing import Callable
+from time import perf_counter
 
 from aiproxy.interfaces import StreamWriter, SimpleStreamMessage, HistoryProvider, NoOpHistoryProvider, FunctionDef
+from aiproxy.telemetry.trace import RequestTrace, NULL_SPAN_SCOPE
 from .chat_message import ChatMessage
 from .chat_response import ChatResponse
+from .token_usage import TokenUsage, UsageTracker
+from .lazy_history import LazyHistory
+
+## The number of (most recent) messages to load when a thread is loaded, the older messages are then loaded (a page of this size at a time) only if they're needed (0 = load the whole thread)
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 0))
 
 class ChatContext:
     thread_id:str = None
@@ -15,6 +23,19 @@ class ChatContext:
     metadata_transient_keys:list[str] = None
     current_msg_id:str = None
     stream_paused:bool = False
+    trace:RequestTrace = None
+    usage_tracker:UsageTracker = None
+    history_page_size:int = 0
+
+    _openai_messages:list[dict] = None
+    _openai_messages_history:list[ChatMessage] = None
+    _openai_messages_last:ChatMessage = None
+    _openai_messages_from:int = 0
+    _saved_history:list[ChatMessage] = None
+    _saved_count:int = 0
+    _saved_last:ChatMessage = None
+    _owns_usage_tracker:bool = False
+    _usage_saved:TokenUsage = None
 
     def __init__(self, 
                  thread_id:str = None, 
@@ -23,7 +44,8 @@ class ChatContext:
                  function_args_preprocessor:Callable[[dict, FunctionDef, 'ChatContext'], dict] = None, 
                  function_filter:Callable[[str,str], bool] = None,
                  metadata:dict[str,any] = None, 
-                 metadata_transient_keys:list[str] = None
+                 metadata_transient_keys:list[str] = None,
+                 history_page_size:int = None
                  ):
         self.history = None
         self.thread_id = thread_id
@@ -33,9 +55,10 @@ class ChatContext:
         self.function_filter = function_filter
         self.metadata = metadata
         self.metadata_transient_keys = metadata_transient_keys
+        self.history_page_size = history_page_size if history_page_size is not None else HISTORY_PAGE_SIZE
 
     def clone_for_single_shot(self, with_streamer:bool = False) -> 'ChatContext':
-        return ChatContext(
+        clone = ChatContext(
             history_provider=None,  ## Don't need to clone the history provider 
             stream=self.stream_writer if with_streamer else None,
             function_args_preprocessor=self.function_args_preprocessor,
@@ -43,9 +66,12 @@ class ChatContext:
             metadata=self.metadata.copy() if self.metadata is not None else None, 
             metadata_transient_keys=self.metadata_transient_keys, 
         )
+        clone.trace = self.trace    ## Requests made with the clone are recorded as part of this request's trace
+        clone.usage_tracker = self.get_usage_tracker()  ## + the tokens used by the clone count towards this request's usage
+        return clone
     
     def clone_for_thread_isolation(self, thread_id_to_use:str = None, with_streamer:bool = False) -> 'ChatContext':
-        return ChatContext(
+        clone = ChatContext(
             stream=self.stream_writer if with_streamer else None,
             history_provider=self.history_provider,
             function_args_preprocessor=self.function_args_preprocessor,
@@ -53,7 +79,11 @@ class ChatContext:
             thread_id=thread_id_to_use,
             metadata=self.metadata.copy() if self.metadata is not None else None, 
             metadata_transient_keys=self.metadata_transient_keys, 
+            history_page_size=self.history_page_size,
         )
+        clone.trace = self.trace    ## Requests made with the clone are recorded as part of this request's trace
+        clone.usage_tracker = self.get_usage_tracker()  ## + the tokens used by the clone count towards this request's usage
+        return clone
 
     def init_history(self, thread_id:str = None, system_prompt:str = None):
         if thread_id is None and self.thread_id is None:
@@ -68,8 +98,18 @@ class ChatContext:
             self.history_provider = NoOpHistoryProvider()
         
         ## Load the history from the provider if it exists
-        history, metadata = self.history_provider.load_history(self.thread_id)
+        with self.span('history.load', provider=type(self.history_provider).__name__) as span:
+            if self.history_page_size > 0:
+                ## Only load the most recent messages (the older ones are loaded if + when they're accessed)
+                history, metadata, count = self.history_provider.load_history_tail(self.thread_id, self.history_page_size)
+                if history is not None and count > len(history):
+                    provider, thread_id = self.history_provider, self.thread_id
+                    history = LazyHistory(history, count, lambda start, end, stored_count: provider.load_history_range(thread_id, start, end, stored_count), self.history_page_size)
+                span.set_attribute('messages', count)
+            else: 
+                history, metadata = self.history_provider.load_history(self.thread_id)
         self.history = history or []
+        self._mark_history_saved()
         if self.metadata is None:
             self.metadata = metadata or {}
         elif metadata is not None: 
@@ -81,9 +121,11 @@ class ChatContext:
     def has_stream(self) -> bool: 
         return self.stream_writer is not None
     
-    def push_stream_update(self, message:dict|str, message_type:str = None):
+    def push_stream_update(self, message:dict|str, message_type:str = None, block:bool = True):
         """
         Pushes the provided stream update to the stream referenced by this context (if there is one, otherwise it does nothing)
+
+        With `block=False` the push never waits for room in a full stream queue (eg. when pushing from the thread reading the model's stream)
         """
         if self.stream_writer is not None:
             if self.stream_paused: return
@@ -94,7 +136,12 @@ class ChatContext:
                 else: 
                     message = SimpleStreamMessage(message, message_type).to_dict()
 
-            self.stream_writer.push_message(message)
+            if self.trace is None:
+                self.stream_writer.push_message(message, block=block)
+            else: 
+                start = perf_counter()
+                self.stream_writer.push_message(message, block=block)
+                self.trace.record('stream.push', (perf_counter() - start) * 1000)
 
     def add_prompt_to_history(self, message:str, role:str):
         msg = ChatMessage()
@@ -127,13 +174,109 @@ class ChatContext:
                 import uuid
                 self.thread_id = uuid.uuid4().hex
                 
+            self._update_thread_usage()
             metadata = self.metadata.copy() if self.metadata is not None else None
             if metadata is not None and self.metadata_transient_keys is not None:
                 for key in self.metadata_transient_keys:
                     if key in metadata:
                         metadata.pop(key)
 
-            self.history_provider.save_history(self.thread_id, self.history, metadata=metadata)
+            ## If the history has only been appended to since it was loaded (or last saved), then the provider only needs to persist the new messages
+            new_from = self._unsaved_from()
+            with self.span('history.save', provider=type(self.history_provider).__name__, messages=len(self.history), new_messages=len(self.history) - (new_from or 0)):
+                if new_from is not None:
+                    self.history_provider.append_history(self.thread_id, self.history, new_from, metadata=metadata)
+                else:
+                    self.history_provider.save_history(self.thread_id, self.history, metadata=metadata)
+            self._mark_history_saved()
+
+    def _mark_history_saved(self):
+        self._saved_history = self.history
+        self._saved_count = len(self.history) if self.history is not None else 0
+        self._saved_last = self.history[-1] if self._saved_count > 0 else None
+        if type(self.history) is LazyHistory:
+            self.history.mark_stored(self._saved_count)     ## (The stored thread now has the messages that were saved, so the older ones can still be loaded)
+
+    def _unsaved_from(self) -> int:
+        ## Returns the index of the first message added since the history was loaded/saved, or None if the history has been replaced (eg. folded into a summary) since then
+        if self._saved_history is None or self.history is not self._saved_history or len(self.history) < self._saved_count: return None
+        if self._saved_count > 0 and self.history[self._saved_count - 1] is not self._saved_last: return None
+        return self._saved_count
+
+    def get_usage_tracker(self) -> UsageTracker:
+        """
+        Returns the tracker of the tokens used while handling requests with this context (and its clones)
+        """
+        if self.usage_tracker is None:
+            self.usage_tracker = UsageTracker()
+            self._owns_usage_tracker = True
+        return self.usage_tracker
+
+    def get_thread_usage(self) -> TokenUsage:
+        """
+        Returns the total tokens used by the thread (across all its turns, as at the last time the history was saved)
+        """
+        return TokenUsage.from_dict(self.get_metadata('_token-usage'))
+
+    def _update_thread_usage(self):
+        ## Add the tokens used since the history was last saved to the running total for the thread
+        ## (Only the context that the tracker was created for does this, as clones are either single-shot or for a different thread)
+        if not self._owns_usage_tracker or self.usage_tracker is None: return
+        snapshot = self.usage_tracker.snapshot()
+        used = snapshot.subtract(self._usage_saved) if self._usage_saved is not None else snapshot
+        self._usage_saved = snapshot
+        if used.calls == 0: return
+        thread_usage = self.get_thread_usage()
+        thread_usage.add(used)
+        self.set_metadata('_token-usage', thread_usage.to_dict())
+
+    def span(self, name:str, **attributes):
+        """
+        Returns a context manager that times the enclosed block as a span of the request's trace (it does nothing if the request isn't being traced)
+        """
+        return self.trace.span(name, **attributes) if self.trace is not None else NULL_SPAN_SCOPE
+
+    def get_openai_messages(self, start:int = 0) -> list[dict]:
+        """
+        Returns the history (from the `start` index onwards) as a list of messages in the format expected by the OpenAI API
+
+        The list is cached, and only the messages appended to the history since the last call are converted, 
+        so treat the returned list as read-only (it will continue to grow as the history grows)
+        """
+        if self.history is None: return []
+
+        ## Rebuild the cache if the history has been changed other than by appending to it
+        count = len(self.history)
+        cached_end = self._openai_messages_from + len(self._openai_messages) if self._openai_messages is not None else 0
+        if self._openai_messages is None \
+                or self._openai_messages_history is not self.history \
+                or cached_end > count \
+                or (cached_end > self._openai_messages_from and self.history[cached_end - 1] is not self._openai_messages_last):
+            self.invalidate_openai_messages()
+            self._openai_messages = []
+            self._openai_messages_history = self.history
+            self._openai_messages_from = cached_end = min(start, count)
+
+        ## Convert any earlier messages that are now needed (only the messages from the start of the history window are converted, so a lazily loaded history doesn't need to load its older messages)
+        if start < self._openai_messages_from:
+            self._openai_messages[0:0] = [ history_item.to_openid_message() for history_item in self.history[start:self._openai_messages_from] ]
+            self._openai_messages_from = start
+
+        ## Convert the newly appended messages
+        if cached_end < count:
+            for history_item in self.history[cached_end:]:
+                self._openai_messages.append(history_item.to_openid_message())
+            self._openai_messages_last = self.history[-1]
+        return self._openai_messages if start == self._openai_messages_from else self._openai_messages[start - self._openai_messages_from:]
+
+    def invalidate_openai_messages(self):
+        """
+        Drops the cached OpenAI formatted messages, call this after modifying (rather than appending to) the history
+        """
+        self._openai_messages = None
+        self._openai_messages_history = None
+        self._openai_messages_last = None
+        self._openai_messages_from = 0
 
     def get_metadata(self, key:str, default: any = None) -> any:
         return self.metadata.get(key, default) if self.metadata is not None else default
@@ -13,6 +13,8 @@ class ChatMessage:
     run_id:str
     metadata:dict
 
+    _token_count:int = None     ## Cached count of the tokens in this message (not persisted)
+
     def __init__(self, message:str = None, role:str = None, timestamp:str = None, content:dict = None, id:str = None, tool_calls:dict = None, citations:list = None, tool_call_id:str = None, tool_name:str = None, assistant_id:str = None, run_id:str = None, metadata:dict = None) -> None:
         self.message = message
         self.role = role
@@ -1,3 +1,5 @@
+from .token_usage import TokenUsage
+
 
 class ChatCitation: 
     id: str|None = None
@@ -70,6 +72,9 @@ class ChatResponse:
     """Whether the response has been filtered by the content moderation filters."""
     filter_reason:str|None = None
 
+    usage:TokenUsage|None = None
+    """The tokens used to generate the response (across all the calls made to the AI Model)."""
+
     def add_metadata(self, key:str, value:any):
         if self.metadata is None: self.metadata = dict()
         self.metadata[key] = value
@@ -85,6 +90,7 @@ class ChatResponse:
         if self.filter_reason is not None: out["filter-reason"] = self.filter_reason
         if self.failed: out["failed"] = True
         if self.error is not None: out["error"] = self.error
+        if self.usage is not None: out["usage"] = self.usage.to_dict()
         
         if self.metadata is not None: 
             for k,v in self.metadata.items(): 
@@ -0,0 +1,191 @@
+from collections.abc import MutableSequence
+from typing import Callable, Iterator
+
+from .chat_message import ChatMessage
+
+class StaleHistoryError(ValueError):
+    """
+    Raised when the older messages of a lazily loaded history are accessed, but the stored thread has changed since it was loaded (eg. another worker has saved it)
+    """
+    pass
+
+
+class LazyHistory(MutableSequence):
+    """
+    The history of a thread, where only the most recent messages have been loaded (the older messages are loaded a page at a time, when they're first accessed)
+
+    It behaves like a list of all the messages in the thread, so appending + reading the recent messages (eg. building the history window) never touches the
+    older messages, while anything that needs the whole thread (eg. iterating over it) transparently loads the older messages (in a single read). Reading a single
+    older message (eg. the system prompt at the start of the thread) only loads the page it's in.
+
+    It isn't a `list` though (eg. for `isinstance` checks, or serialising it to JSON), so use `as_list` where a plain list of the whole thread is needed.
+
+    The older messages are only loaded while the stored thread still has the number of messages it had when the history was loaded (or last saved, see `mark_stored`),
+    if it has changed since, accessing them raises a `StaleHistoryError` (rather than mixing the changed thread's messages into this history).
+    """
+    def __init__(self, messages:list[ChatMessage], total_count:int, load_range:Callable[[int, int, int], list[ChatMessage]], page_size:int = 50):
+        """
+        `messages` are the last messages of the thread (of `total_count` messages), and `load_range(start, end, count)` loads the messages in the range [start, end),
+        as long as the stored thread still has `count` messages (returning None if it doesn't)
+        """
+        self._messages = messages
+        self._offset = total_count - len(messages)
+        self._stored_count = total_count
+        self._load_range = load_range
+        self._page_size = max(1, page_size)
+        self._pages:dict[int, list[ChatMessage]] = {}
+        """Pages older than the loaded messages, that have been read individually (keyed by the index of their first message)"""
+
+    @property
+    def loaded_from(self) -> int:
+        """The index of the oldest message that has been loaded"""
+        return self._offset
+
+    def loaded_messages(self) -> list[ChatMessage]:
+        """The messages that have been loaded so far (from `loaded_from` to the end)"""
+        return self._messages
+
+    def mark_stored(self, count:int):
+        """
+        Records that the stored thread now has `count` messages (eg. once this history has been saved), so its older messages can still be loaded
+        """
+        self._stored_count = count
+
+    def load_all(self):
+        """
+        Loads all the older messages (in a single read, rather than a page at a time)
+        """
+        self._load_to(0)
+
+    def _load_to(self, index:int):
+        ## Load the older messages from the start of the index's page, in a single read of the range that hasn't been loaded yet
+        if self._offset <= index: return
+        start = self._page_start(index)
+        messages = self._load_older(start, self._offset)
+        self._messages = messages + self._messages
+        self._offset = start
+        self._pages = { page_start: page for page_start, page in self._pages.items() if page_start < start }
+
+    def _page_start(self, index:int) -> int:
+        return index - index % self._page_size
+
+    def _page(self, start:int, pop:bool = False) -> list[ChatMessage]:
+        ## Returns the page (that is older than the loaded messages) starting at the index, loading it if it hasn't been read already
+        page = self._pages.pop(start, None) if pop else self._pages.get(start)
+        if page is None:
+            page = self._load_older(start, min(start + self._page_size, self._offset))
+            if not pop: self._pages[start] = page
+        return page
+
+    def _load_older(self, start:int, end:int) -> list[ChatMessage]:
+        messages = self._load_range(start, end, self._stored_count)
+        if messages is None:
+            raise StaleHistoryError(f"The thread has changed since it was loaded (it no longer has {self._stored_count} messages), so its older messages can't be loaded")
+        if len(messages) != end - start:
+            raise ValueError(f"Failed to load the messages {start} to {end} of the history")
+        return messages
+
+    def _index(self, index:int) -> int:
+        if index < 0: index += len(self)
+        if index < 0 or index >= len(self): raise IndexError("history index out of range")
+        return index
+
+    def __len__(self) -> int:
+        return self._offset + len(self._messages)
+
+    def __getitem__(self, index:int|slice) -> ChatMessage|list[ChatMessage]:
+        if type(index) is slice:
+            indexes = range(*index.indices(len(self)))
+            if len(indexes) == 0: return []
+            self._load_to(min(indexes[0], indexes[-1]))
+            return [ self._messages[idx - self._offset] for idx in indexes ]
+        index = self._index(index)
+        if index < self._offset:
+            start = self._page_start(index)
+            return self._page(start)[index - start]
+        return self._messages[index - self._offset]
+
+    def __setitem__(self, index:int, value:ChatMessage):
+        if type(index) is slice:
+            self.load_all()
+            self._messages[index] = value
+            return
+        index = self._index(index)
+        if index < self._offset: self._load_to(index)
+        self._messages[index - self._offset] = value
+
+    def __delitem__(self, index:int):
+        ## Deleting shifts every later message, so it's simplest to have everything loaded
+        self.load_all()
+        del self._messages[index]
+
+    def insert(self, index:int, value:ChatMessage):
+        if index >= len(self):
+            self._messages.append(value)
+            return
+        self.load_all()
+        self._messages.insert(index, value)
+
+    def append(self, value:ChatMessage):
+        self._messages.append(value)
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        ## Iterating goes through the whole thread, so load the older messages up front (rather than a read per page on the way through)
+        self.load_all()
+        idx = 0
+        while idx < len(self):
+            yield self[idx]
+            idx += 1
+
+    def __reversed__(self) -> Iterator[ChatMessage]:
+        ## (Going backwards usually stops at a recent message, so the older pages are only loaded as they're reached)
+        idx = len(self) - 1
+        while idx >= 0:
+            yield self[idx]
+            idx -= 1
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __add__(self, other:list[ChatMessage]) -> list[ChatMessage]:
+        return self[:] + list(other)
+
+    def __radd__(self, other:list[ChatMessage]) -> list[ChatMessage]:
+        return list(other) + self[:]
+
+    def __eq__(self, other) -> bool:
+        return self is other or (isinstance(other, (list, LazyHistory)) and len(self) == len(other) and all(a is b or a == b for a, b in zip(self, other)))
+
+    def __repr__(self) -> str:
+        return f"LazyHistory(count={len(self)}, loaded_from={self._offset})"
+
+    def copy(self) -> 'LazyHistory':
+        """
+        Returns a (shallow) copy of the history, that shares the messages loaded so far (without loading the older messages)
+        """
+        clone = LazyHistory(list(self._messages), len(self), self._load_range, self._page_size)
+        clone._stored_count = self._stored_count
+        clone._pages = { start: list(page) for start, page in self._pages.items() }
+        return clone
+
+
+def loaded_from(history:list[ChatMessage]) -> int:
+    """
+    The index of the oldest message of the history that has been loaded (always 0 for a plain list)
+    """
+    return history.loaded_from if type(history) is LazyHistory else 0
+
+def loaded_messages(history:list[ChatMessage]) -> list[ChatMessage]:
+    """
+    The messages of the history that have been loaded (without loading any more)
+    """
+    return history.loaded_messages() if type(history) is LazyHistory else history
+
+def as_list(history:list[ChatMessage]) -> list[ChatMessage]:
+    """
+    The whole history as a plain list (loading any older messages that haven't been loaded yet), eg. to pass to code that expects a `list`
+    """
+    if type(history) is LazyHistory:
+        history.load_all()
+        return list(history.loaded_messages())
+    return history
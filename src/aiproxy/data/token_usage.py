@@ -0,0 +1,133 @@
+from threading import Lock
+
+class TokenBudgetExceededError(Exception):
+    """
+    Raised when a request has used up the token budget it was given (see the `token-budget` config)
+    """
+    pass
+
+
+class TokenUsage:
+    """
+    The number of tokens used by one or more calls to the AI Model (and their cost, if the config specifies the token prices)
+    """
+    prompt_tokens:int = 0
+    completion_tokens:int = 0
+    calls:int = 0
+    cost:float = 0.0
+    estimated:bool = False
+    """Whether any of the token counts were estimated (because the model didn't report its usage)"""
+    breakdown:dict[str, 'TokenUsage'] = None
+    """The usage broken down by step (for a proxy) or by the agent/config that made the calls (for an orchestrator)"""
+
+    def __init__(self, prompt_tokens:int = 0, completion_tokens:int = 0, calls:int = 0, cost:float = 0.0, estimated:bool = False):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.calls = calls
+        self.cost = cost
+        self.estimated = estimated
+        self.breakdown = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, usage:'TokenUsage', breakdown_key:str = None):
+        """
+        Add the usage to this usage (and to the breakdown under the specified key, if one is given)
+        """
+        if usage is None: return
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.calls += usage.calls
+        self.cost += usage.cost
+        self.estimated = self.estimated or usage.estimated
+        if breakdown_key is not None:
+            if self.breakdown is None: self.breakdown = {}
+            item = self.breakdown.get(breakdown_key)
+            if item is None:
+                item = TokenUsage()
+                self.breakdown[breakdown_key] = item
+            item.add(usage)
+
+    def copy(self) -> 'TokenUsage':
+        usage = TokenUsage(self.prompt_tokens, self.completion_tokens, self.calls, self.cost, self.estimated)
+        if self.breakdown is not None:
+            usage.breakdown = { key: item.copy() for key, item in self.breakdown.items() }
+        return usage
+
+    def subtract(self, usage:'TokenUsage') -> 'TokenUsage':
+        """
+        Returns the usage that has been added to this usage since the specified (earlier) copy of it was taken
+        """
+        diff = TokenUsage(self.prompt_tokens - usage.prompt_tokens, self.completion_tokens - usage.completion_tokens, self.calls - usage.calls, self.cost - usage.cost, self.estimated)
+        if self.breakdown is not None:
+            for key, item in self.breakdown.items():
+                earlier = usage.breakdown.get(key) if usage.breakdown is not None else None
+                item_diff = item.subtract(earlier) if earlier is not None else item.copy()
+                if item_diff.calls > 0:
+                    if diff.breakdown is None: diff.breakdown = {}
+                    diff.breakdown[key] = item_diff
+        return diff
+
+    def to_dict(self) -> dict:
+        out = { "prompt-tokens": self.prompt_tokens, "completion-tokens": self.completion_tokens, "total-tokens": self.total_tokens, "calls": self.calls }
+        if self.cost > 0: out["cost"] = round(self.cost, 6)
+        if self.estimated: out["estimated"] = True
+        if self.breakdown is not None: out["breakdown"] = { key: item.to_dict() for key, item in self.breakdown.items() }
+        return out
+
+    def from_dict(data:dict) -> 'TokenUsage':
+        if data is None: return TokenUsage()
+        usage = TokenUsage(data.get("prompt-tokens", 0), data.get("completion-tokens", 0), data.get("calls", 0), data.get("cost", 0.0), data.get("estimated", False))
+        if data.get("breakdown") is not None:
+            usage.breakdown = { key: TokenUsage.from_dict(item) for key, item in data["breakdown"].items() }
+        return usage
+
+
+class UsageTracker:
+    """
+    Accumulates the token usage of every call to the AI Model made while handling a request, including the calls made by agents with cloned contexts (the tracker is shared with clones)
+
+    Orchestrators (and proxies) can also place a limit on the total number of tokens used (see `add_limit`), once reached, no further calls are made to the model
+    """
+    usage:TokenUsage = None
+
+    def __init__(self):
+        self.usage = TokenUsage()
+        self._limits:dict[int, int] = {}
+        self._next_limit_id = 0
+        self._lock = Lock()
+
+    def record(self, source:str, usage:TokenUsage):
+        with self._lock:
+            self.usage.add(usage, source)
+
+    def snapshot(self) -> TokenUsage:
+        with self._lock:
+            return self.usage.copy()
+
+    def usage_since(self, snapshot:TokenUsage) -> TokenUsage:
+        with self._lock:
+            return self.usage.subtract(snapshot)
+
+    def add_limit(self, max_tokens:int) -> int:
+        """
+        Limit the number of tokens that can be used from now on, returning an id for the limit (so it can be removed later)
+        """
+        with self._lock:
+            self._next_limit_id += 1
+            self._limits[self._next_limit_id] = self.usage.total_tokens + max_tokens
+            return self._next_limit_id
+
+    def remove_limit(self, limit_id:int):
+        with self._lock:
+            self._limits.pop(limit_id, None)
+
+    def budget_exceeded(self) -> bool:
+        with self._lock:
+            return any(self.usage.total_tokens >= limit for limit in self._limits.values())
+
+    def check_budget(self):
+        if self.budget_exceeded():
+            raise TokenBudgetExceededError("The token budget for this request has been used up")
@@ -2,3 +2,6 @@ from ..interfaces.abstract_history_provider import HistoryProvider, NoOpHistoryP
 from .cosmos_history_provider import CosmosHistoryProvider
 from .file_history_provider import FileHistoryProvider
 from .map_history_provider import MapHistoryProvider
+from .caching_history_provider import CachingHistoryProvider
+from .write_behind_buffer import WriteBehindBuffer
+from .sqlite_history_provider import SqliteHistoryProvider
@@ -0,0 +1,168 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Tuple
+from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.lazy_history import loaded_from, loaded_messages
+
+from ..interfaces.abstract_history_provider import HistoryProvider
+
+class _CachedThread:
+    __slots__ = ('messages', 'metadata', 'version', 'expires_at', 'size')
+
+    def __init__(self, messages:list[ChatMessage], metadata:dict[str,any], version:str, expires_at:float, size:int):
+        self.messages = messages
+        self.metadata = metadata
+        self.version = version
+        self.expires_at = expires_at
+        self.size = size
+
+
+class CachingHistoryProvider(HistoryProvider):
+    """
+    Keeps the recently used threads of another history provider in memory, so that a hot conversation doesn't need to be re-loaded (eg. from CosmosDB) on every request
+
+    The cache is an LRU bounded by both the number of threads and their (approximate) size, and each thread expires after a TTL. Saves are written through to the wrapped provider + update the cache.
+
+    When `validate` is set, a cached thread is only used if its version (eg. the CosmosDB etag, see `HistoryProvider.get_version`) hasn't changed, so that the
+    changes made by other processes are picked up. NB. If the wrapped provider writes its saves in the background, the version of a thread saved by this process
+    isn't known until it's next validated, so a change made by another process before then isn't detected until the cache entry expires.
+    """
+    _provider:HistoryProvider
+    _threads:OrderedDict[str, _CachedThread]
+
+    def __init__(self,
+                 provider:HistoryProvider,
+                 max_entries:int = None,
+                 max_bytes:int = None,
+                 ttl_secs:float = None,
+                 validate:bool = False):
+        self._provider = provider
+        self._max_entries = max_entries if max_entries is not None else int(os.environ.get('HISTORY_CACHE_MAX_ENTRIES', 1000))
+        self._max_bytes = max_bytes if max_bytes is not None else int(os.environ.get('HISTORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        self._ttl_secs = ttl_secs if ttl_secs is not None else float(os.environ.get('HISTORY_CACHE_TTL_SECS', 300))
+        self._validate = validate
+        self._threads = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def load_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
+        entry = self._get_valid(thread_id)
+        if entry is not None:
+            with self._lock: self.hits += 1
+            return entry.messages[:], (entry.metadata.copy() if entry.metadata is not None else None)
+
+        with self._lock: self.misses += 1
+        version = self._provider.get_version(thread_id) if self._validate else None    ## (Read before the history, so a change made in between is seen as stale next time)
+        messages, metadata = self._provider.load_history(thread_id)
+        if messages is not None:
+            self._set(thread_id, messages, metadata, version)
+            return list(messages), (metadata.copy() if metadata is not None else None)
+        return messages, metadata
+
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[ChatMessage], dict[str,any], int]:
+        entry = self._get_valid(thread_id)
+        if entry is not None:
+            with self._lock: self.hits += 1
+            ## (The tail of the messages that are cached, which may be fewer than asked for if the thread was cached with only its last messages loaded)
+            tail = loaded_messages(entry.messages)[-count:] if count > 0 else []
+            return tail, (entry.metadata.copy() if entry.metadata is not None else None), len(entry.messages)
+
+        ## (Only part of the thread is loaded, so it's not cached until it's saved)
+        with self._lock: self.misses += 1
+        return self._provider.load_history_tail(thread_id, count)
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        entry = self._get(thread_id)
+        if entry is not None and start >= loaded_from(entry.messages) and (count is None or len(entry.messages) == count):
+            return entry.messages[start:end]
+        return self._provider.load_history_range(thread_id, start, end, count)
+
+    def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
+        self._provider.save_history(thread_id, history, metadata=metadata)
+        version = self._provider.get_version(thread_id) if self._validate else None     ## (None if the save is still to be written)
+        self._set(thread_id, history, metadata, version)
+
+    def append_history(self, thread_id:str, history:list[ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        self._provider.append_history(thread_id, history, new_from, metadata=metadata)
+        version = self._provider.get_version(thread_id) if self._validate else None
+        self._set(thread_id, history, metadata, version)
+
+    def get_version(self, thread_id:str) -> str:
+        return self._provider.get_version(thread_id)
+
+    def flush(self, timeout_secs:float = None) -> bool:
+        return self._provider.flush(timeout_secs)
+
+    def invalidate(self, thread_id:str = None):
+        """
+        Remove the thread from the cache (or every thread, if no thread id is given)
+        """
+        with self._lock:
+            if thread_id is None:
+                self._threads.clear()
+                self._size = 0
+            else:
+                self._remove(thread_id)
+
+    def stats(self) -> dict[str,any]:
+        with self._lock:
+            return { 'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'evictions': self.evictions, 'entries': len(self._threads), 'bytes': self._size }
+
+    def _get(self, thread_id:str) -> _CachedThread:
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is None: return None
+            if entry.expires_at > 0 and entry.expires_at < time():
+                self._remove(thread_id)
+                return None
+            self._threads.move_to_end(thread_id)
+            return entry
+
+    def _get_valid(self, thread_id:str) -> _CachedThread:
+        ## Returns the cached thread, if it hasn't changed since it was cached
+        entry = self._get(thread_id)
+        if entry is not None and self._validate:
+            version = self._provider.get_version(thread_id)
+            if entry.version is None:
+                entry.version = version     ## (The first version seen after this process saved the thread)
+            elif version is not None and version != entry.version:
+                with self._lock:
+                    self.stale += 1
+                    self._remove(thread_id)
+                entry = None
+        return entry
+
+    def _set(self, thread_id:str, messages:list[ChatMessage], metadata:dict[str,any], version:str):
+        ## Keep copies, so that changes made to the context's lists after the load/save don't leak into the cache
+        ## (A lazily loaded history is copied without loading its older messages)
+        entry = _CachedThread(messages.copy(), metadata.copy() if metadata is not None else None, version, time() + self._ttl_secs if self._ttl_secs > 0 else 0, _estimate_size(messages))
+        with self._lock:
+            self._remove(thread_id)
+            if self._max_bytes > 0 and entry.size > self._max_bytes: return    ## Too big to cache
+            self._threads[thread_id] = entry
+            self._size += entry.size
+            while len(self._threads) > 0 and ((self._max_entries > 0 and len(self._threads) > self._max_entries) or (self._max_bytes > 0 and self._size > self._max_bytes)):
+                _, evicted = self._threads.popitem(last=False)
+                self._size -= evicted.size
+                self.evictions += 1
+
+    def _remove(self, thread_id:str):
+        ## NB. Must be called with the lock held
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+
+def _estimate_size(messages:list[ChatMessage]) -> int:
+    ## A rough estimate of the memory used by the messages (the text + a fixed overhead per message), good enough for bounding the cache
+    size = 0
+    for msg in loaded_messages(messages):
+        size += 256 + (len(msg.message) * 2 if type(msg.message) is str else 0)
+        if msg.tool_calls is not None: size += 512
+    return size
@@ -3,9 +3,15 @@ import logging
 from typing import Tuple
 from ..interfaces.abstract_history_provider import HistoryProvider
 from aiproxy.data.chat_message import ChatMessage
-from concurrent.futures import ThreadPoolExecutor
+from aiproxy.data.lazy_history import loaded_from, as_list
 
-from aiproxy.functions.cosmosdb import get_item, upsert_item, ROOT_CONFIG_NAME
+from azure.cosmos.errors import CosmosResourceNotFoundError, CosmosAccessConditionFailedError
+from aiproxy.functions.cosmosdb import get_item, upsert_item, connect_to_cosmos_container, ROOT_CONFIG_NAME
+from .write_behind_buffer import WriteBehindBuffer
+
+## Cosmos DB allows up to 10 operations in a single patch, one is used to set the metadata, so a save of a fully loaded thread that adds more messages than this rewrites the whole document
+## (while a save of a lazily loaded thread, which doesn't hold the older messages, is appended in several patches)
+MAX_PATCH_MESSAGES = 9
 
 def do_upsert(item:dict[str,any], config_name:str = None):
         try:
@@ -16,18 +22,75 @@ def do_upsert(item:dict[str,any], config_name:str = None):
             logging.error(traceback.format_exc())
             # print(f"Error upserting item {item['id']}: {e}")
             # raise e
-        
+
+
+class _ThreadSave:
+    """
+    A save of a thread, that is yet to be written to Cosmos DB
+
+    The messages are held already serialised (as the dicts that are written to the document), from the index `start` to the end of the thread, so writing
+    the save never needs to read the thread (eg. the older messages of a lazily loaded history, which would be read from the document as it is by then)
+    """
+    __slots__ = ('rows', 'start', 'metadata', 'new_from')
+
+    def __init__(self, rows:list[dict], start:int, metadata:dict[str,any], new_from:int = None):
+        self.rows = rows
+        self.start = start
+        """The index of the first message in `rows` (0 if it holds the whole thread, otherwise it only holds the messages that were loaded + added)"""
+        self.metadata = metadata
+        self.new_from = new_from
+        """The index of the first message that isn't in the document yet (or None if the whole document needs to be written)"""
+
+    @property
+    def count(self) -> int:
+        return self.start + len(self.rows)
+
+    def messages(self, start:int = None, end:int = None) -> list[ChatMessage]:
+        ## The held messages in the range [start, end) of the thread (the range must start at or after `self.start`)
+        start = self.start if start is None else start
+        end = self.count if end is None else min(end, self.count)
+        return [ ChatMessage.from_dict(row) for row in self.rows[start - self.start:end - self.start] ]
+
+def _merge_saves(pending:_ThreadSave, save:_ThreadSave) -> _ThreadSave:
+    ## A newer save of a thread that's still waiting to be written only needs to add the messages that the pending save would have added too
+    new_from = min(pending.new_from, save.new_from) if pending.new_from is not None and save.new_from is not None else None
+    if pending.start < save.start <= pending.count:
+        ## The newer save only holds the messages from part way through the pending one, so join them (eg. an append to a thread with a full save pending)
+        return _ThreadSave(pending.rows[:save.start - pending.start] + save.rows, pending.start, save.metadata, new_from)
+    if save.start <= pending.start:
+        return _ThreadSave(save.rows, save.start, save.metadata, new_from)
+    return save     ## (The saves can't be joined, so the newer one wins)
+
+
 class CosmosHistoryProvider(HistoryProvider):
+    """
+    Stores each thread as a document in a Cosmos DB container
+
+    A save that only adds messages to the thread is written as a patch (appending the new messages to the document's history), rather than rewriting the whole document
+    """
     _config_name:str
-    _executor:ThreadPoolExecutor
+    _buffer:WriteBehindBuffer = None
     def __init__(self, config_name:str = ROOT_CONFIG_NAME):
         self._config_name = config_name
         self._work_async = os.environ.get('COSMOS_HISTORY_ASYNC', 'true').lower() == 'true'
         if self._work_async:
-            max_workers = int(os.environ.get('COSMOS_HISTORY_MAX_WORKERS', 4))
-            self._executor = ThreadPoolExecutor(thread_name_prefix="history-",max_workers = max_workers)
+            ## Saves are buffered + written in the background, only the latest version of a thread is written if it's saved again before the buffer is flushed
+            self._buffer = WriteBehindBuffer(
+                self._write_save,
+                flush_interval_secs=float(os.environ.get('COSMOS_HISTORY_FLUSH_INTERVAL_SECS', 0.5)),
+                flush_threshold=int(os.environ.get('COSMOS_HISTORY_FLUSH_THRESHOLD', 50)),
+                max_pending=int(os.environ.get('COSMOS_HISTORY_MAX_PENDING', 1000)),
+                max_workers=int(os.environ.get('COSMOS_HISTORY_MAX_WORKERS', 4)),
+                name="history",
+                merge_fn=_merge_saves,
+            )
 
     def load_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
+        ## A save that hasn't been written yet is newer than what's in the container
+        pending:_ThreadSave = self._buffer.get(thread_id) if self._buffer is not None else None
+        if pending is not None:
+            return self._pending_range(thread_id, pending, 0, pending.count), (pending.metadata.copy() if pending.metadata is not None else None)
+
         item = get_item(thread_id, source=self._config_name)
         if item is None: return None, None
 
@@ -35,29 +98,147 @@ class CosmosHistoryProvider(HistoryProvider):
         metadata = item.get('metadata', None)
         return messages, metadata
 
-    
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[ChatMessage], dict[str,any], int]:
+        pending:_ThreadSave = self._buffer.get(thread_id) if self._buffer is not None else None
+        if pending is not None:
+            messages = self._pending_range(thread_id, pending, max(0, pending.count - count), pending.count) if count > 0 else []
+            return messages, (pending.metadata.copy() if pending.metadata is not None else None), pending.count
+
+        ## (Only the last messages of the thread are read from the document)
+        items = self._query(thread_id, f"SELECT c.metadata, ARRAY_LENGTH(c.history) AS count, ARRAY_SLICE(c.history, -{int(count)}) AS history FROM c WHERE c.id = @id" if count > 0 \
+                                        else "SELECT c.metadata, ARRAY_LENGTH(c.history) AS count FROM c WHERE c.id = @id")
+        if len(items) == 0: return None, None, 0
+        item = items[0]
+        messages = [ ChatMessage.from_dict(msg) for msg in item.get('history', []) ]
+        return messages, item.get('metadata', None), item.get('count', len(messages))
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        pending:_ThreadSave = self._buffer.get(thread_id) if self._buffer is not None else None
+        if pending is not None:
+            if count is not None and pending.count != count: return None
+            return self._pending_range(thread_id, pending, start, end)
+        return self._load_document_range(thread_id, start, end, count)
 
     def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
+        ## NB. The whole thread is rewritten, so the older messages of a lazily loaded history are loaded + serialised now (rather than when the save is written, by which time the document may have changed)
+        self._save(thread_id, _ThreadSave(_to_rows(as_list(history)), 0, _item_metadata(metadata)))
+
+    def append_history(self, thread_id:str, history:list[ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        start = loaded_from(history)
+        if start == 0 and not _can_patch(len(history), new_from):
+            self.save_history(thread_id, history, metadata=metadata)
+            return
+        ## (Only the messages that have been loaded are held, so the save of a lazily loaded history never needs to read the older messages)
+        self._save(thread_id, _ThreadSave(_to_rows(history[start:]), start, _item_metadata(metadata), new_from))
+
+    def get_version(self, thread_id:str) -> str:
+        """
+        Returns the etag of the thread's document (None if it doesn't exist, or has a save that is yet to be written)
+        """
+        if self._buffer is not None and self._buffer.get(thread_id) is not None: return None
+        ## (A query for just the etag is much cheaper than reading the whole thread document)
+        etags = self._query(thread_id, "SELECT VALUE c._etag FROM c WHERE c.id = @id")
+        return etags[0] if len(etags) > 0 else None
+
+    def flush(self, timeout_secs:float = None) -> bool:
+        """
+        Write any saves that are still waiting in the write-behind buffer (eg. before shutting down)
+        """
+        if self._buffer is None: return True
+        return self._buffer.flush(timeout_secs)
+
+    def _query(self, thread_id:str, query:str) -> list:
+        return list(connect_to_cosmos_container(self._config_name).query_items(
+            query=query,
+            parameters=[ { "name": "@id", "value": thread_id } ],
+            partition_key=thread_id,
+        ))
+
+    def _load_document_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        if count is not None:
+            ## (The document's message count is read in the same query, so the messages can't come from a save made after the check)
+            items = self._query(thread_id, f"SELECT ARRAY_LENGTH(c.history) AS count, ARRAY_SLICE(c.history, {int(start)}, {int(max(0, end - start))}) AS history FROM c WHERE c.id = @id")
+            if len(items) == 0 or items[0].get('count') != count: return None
+            return [ ChatMessage.from_dict(msg) for msg in items[0].get('history', []) ]
+        if end <= start: return []
+        items = self._query(thread_id, f"SELECT VALUE ARRAY_SLICE(c.history, {int(start)}, {int(end - start)}) FROM c WHERE c.id = @id")
+        return [ ChatMessage.from_dict(msg) for msg in items[0] ] if len(items) > 0 else []
+
+    def _pending_range(self, thread_id:str, pending:_ThreadSave, start:int, end:int) -> list[ChatMessage]:
+        ## (A pending save only holds the messages that were loaded into its history, the older messages are read from the document)
+        if start >= pending.start:
+            return pending.messages(start, end)
+        return self._load_document_range(thread_id, start, min(end, pending.start)) + (pending.messages(pending.start, end) if end > pending.start else [])
+
+    def _save(self, thread_id:str, save:_ThreadSave):
+        if self._buffer is not None:
+            self._buffer.put(thread_id, save)
+        else:
+            self._write_save(thread_id, save)
+
+    def _write_save(self, thread_id:str, save:_ThreadSave):
+        ## NB. The save holds the serialised messages, so writing it never reads the thread (the older messages of a save that doesn't hold the whole thread are already in the document)
+        if save.new_from is not None and (save.start > 0 or _can_patch(save.count, save.new_from)):
+            try:
+                ## Only the new messages (+ the metadata) need to be written
+                self._patch_history(thread_id, save.rows[save.new_from - save.start:], save.metadata, save.new_from, append_to_changed=save.start > 0)
+                return
+            except CosmosResourceNotFoundError:
+                pass    ## The document hasn't been written yet (or has expired), so write the whole thread
+            except CosmosAccessConditionFailedError:
+                pass    ## The document has changed since this save's history was loaded, so write the whole thread (the last save wins, as it did before)
+            except Exception as e:
+                if save.start > 0: raise    ## (Rewriting the document with only the messages that were loaded would drop the older ones)
+                logging.warning(f"Failed to patch the history of thread {thread_id}, rewriting the whole thread: {e}")
+
+        if save.start > 0:
+            logging.warning(f"The document of thread {thread_id} no longer exists, and only its last {len(save.rows)} messages were loaded, so it is written with just those")
         item = {
             'id': thread_id,
-            'history': [ item.to_dict() for item in history ]
+            'history': save.rows
         }
-        if metadata is not None:
-            item_meta = {}
-            for k,v in metadata.items():
-                if k not in ('id', 'history'):
-                    ## If v has a to_dict method, use it
-                    if hasattr(v, 'to_dict'):
-                        item_meta[k] = v.to_dict()
-                    elif hasattr(v, 'to_api_response'):
-                        item_meta[k] = v.to_api_response()
-                    elif hasattr(v, '__dict__'):
-                        item_meta[k] = v.__dict__
-                    else:
-                        item_meta[k] = v
-                    item_meta[k] = v
-            item['metadata'] = item_meta
-        if self._work_async:
-            self._executor.submit(do_upsert, item, self._config_name)
-        else:
-            do_upsert(item, self._config_name)
\ No newline at end of file
+        if save.metadata is not None:
+            item['metadata'] = save.metadata
+        do_upsert(item, self._config_name)
+
+    def _patch_history(self, thread_id:str, rows:list[dict], metadata:dict[str,any], new_from:int, append_to_changed:bool = False):
+        ## Appends the rows to the document's history (a patch per MAX_PATCH_MESSAGES rows), as long as it still has the `new_from` messages they follow on from
+        ## With `append_to_changed`, they're added to the document as it is instead (for a save that doesn't hold the older messages, which would otherwise be mixed with the changed document's)
+        container = connect_to_cosmos_container(self._config_name)
+        for idx in range(0, max(1, len(rows)), MAX_PATCH_MESSAGES):
+            operations = [ { "op": "add", "path": "/history/-", "value": row } for row in rows[idx:idx + MAX_PATCH_MESSAGES] ]
+            if metadata is not None and idx + MAX_PATCH_MESSAGES >= len(rows):
+                operations.append({ "op": "set", "path": "/metadata", "value": metadata })
+            if len(operations) == 0: return
+            try:
+                ## (The patch is only applied if the document still has the messages this save was based on, eg. it hasn't been saved by another process since)
+                container.patch_item(item=thread_id, partition_key=thread_id, patch_operations=operations,
+                                     filter_predicate=f"from c where ARRAY_LENGTH(c.history) = {new_from + idx}" if new_from is not None else None)
+            except CosmosAccessConditionFailedError:
+                if not append_to_changed or new_from is None: raise
+                new_from = None
+                container.patch_item(item=thread_id, partition_key=thread_id, patch_operations=operations)
+
+
+def _can_patch(count:int, new_from:int) -> bool:
+    return new_from > 0 and count - new_from <= MAX_PATCH_MESSAGES
+
+def _to_rows(messages:list[ChatMessage]) -> list[dict]:
+    return [ msg.to_dict() for msg in messages ]
+
+def _item_metadata(metadata:dict[str,any]) -> dict[str,any]:
+    if metadata is None: return None
+    item_meta = {}
+    for k,v in metadata.items():
+        if k not in ('id', 'history'):
+            ## If v has a to_dict method, use it
+            if hasattr(v, 'to_dict'):
+                item_meta[k] = v.to_dict()
+            elif hasattr(v, 'to_api_response'):
+                item_meta[k] = v.to_api_response()
+            elif hasattr(v, '__dict__'):
+                item_meta[k] = v.__dict__
+            else:
+                item_meta[k] = v
+            item_meta[k] = v
+    return item_meta
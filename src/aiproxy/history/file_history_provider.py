@@ -1,40 +1,248 @@
 from typing import Tuple
 from pathlib import Path
+import os
+import gzip
 import json
 from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.lazy_history import loaded_from
 
 from ..interfaces.abstract_history_provider import HistoryProvider
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    ## (Not available on Windows, where the threads aren't locked)
+
+FILE_HISTORY_FSYNC = os.environ.get('FILE_HISTORY_FSYNC', 'false').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+FILE_HISTORY_COMPRESS = os.environ.get('FILE_HISTORY_COMPRESS', 'none').lower()
+
+COMPRESSION_FORMATS = ['none', 'gzip']
+
 class FileHistoryProvider(HistoryProvider):
+    """
+    Stores each thread in a JSON Lines file (`thread_id.jsonl`) in the directory, with a line per message + a line for the metadata as at each save
+
+    Saves that only add messages to the thread append the new messages to the file, rather than rewriting it (the file is only rewritten when the history has been
+    re-arranged, eg. folded into a summary). Threads saved in the original format (a single `thread_id.json` document) can still be loaded, and are converted the next time they're saved.
+
+    * A rewrite goes to a temp file that then replaces the thread's file, so a crash mid-write never leaves a half written thread
+    * Each thread is locked (with an advisory lock on `thread_id.lock`) while it's being read or written, so workers sharing the directory don't interleave their writes.
+      The lock files are left in the directory (a thread's lock file can't safely be removed while another worker may have it open, waiting for the lock), so remove them along with the thread's file when clearing out old threads
+    * With `fsync` set, each save is flushed to disk before it returns (surviving a power loss, at the cost of slower saves)
+    * With `compress='gzip'`, the threads are stored gzipped (`thread_id.jsonl.gz`, with each append written as a new gzip member), threads stored in the other format are converted the next time they're rewritten
+    """
     _dir_path:str
 
-    def __init__(self, dir_path:str):
+    def __init__(self, dir_path:str, fsync:bool = None, compress:str = None):
         self._dir_path = dir_path
+        self._fsync = fsync if fsync is not None else FILE_HISTORY_FSYNC
+        self._compress = (compress or FILE_HISTORY_COMPRESS).lower()
+        if self._compress not in COMPRESSION_FORMATS:
+            raise ValueError(f"Unknown compression format '{self._compress}', expected one of {COMPRESSION_FORMATS}")
 
     def load_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
-        ## If file with thread_id name does not exist in dir_path, return None
-        ## Otherwise, read the file and return the list of ChatMessage objects
+        with self._lock(thread_id, shared=True):
+            ## If there's no file for the thread in the dir_path, return None
+            file_path = self._existing_file_path(thread_id)
+            if file_path is None:
+                return self._load_legacy_history(thread_id)
+
+            messages = []
+            metadata = None
+            for line in self._read_file(file_path):
+                if len(line) == 0 or line.isspace(): continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue    ## A partially written line (eg. the process died mid-append)
+                if 'message' in record:
+                    messages.append(ChatMessage.from_dict(record['message']))
+                elif 'metadata' in record:
+                    metadata = record['metadata']    ## (The latest metadata wins)
+            return messages, metadata
+
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[ChatMessage], dict[str,any], int]:
+        if self._existing_file_path(thread_id) is None:
+            return super().load_history_tail(thread_id, count)
+        with self._lock(thread_id, shared=True):
+            message_lines, metadata_line = self._read_lines(self._existing_file_path(thread_id))
+
+        messages = _parse_messages(message_lines[-count:] if count > 0 else [])
+        metadata = json.loads(metadata_line)['metadata'] if metadata_line is not None else None
+        return messages, metadata, len(message_lines)
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        if self._existing_file_path(thread_id) is None:
+            return super().load_history_range(thread_id, start, end, count)
+        with self._lock(thread_id, shared=True):
+            message_lines, _ = self._read_lines(self._existing_file_path(thread_id))
+        if count is not None and len(message_lines) != count: return None
+        return _parse_messages(message_lines[start:end])
+
+    def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
+        lines = _to_lines(history, metadata).encode()
+        with self._lock(thread_id):
+            self._write_file(thread_id, lines)
+
+    def append_history(self, thread_id:str, history:list[ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        ## NB. The lines are built before the thread is locked, as building them may load the older messages of a lazily loaded history (which locks the thread too)
+        lines = _to_lines(history[new_from:], metadata)
+        last_line = _to_lines(history[new_from - 1:new_from], None) if new_from > 0 else None
+        ## (If the older messages of a lazily loaded history haven't been loaded, they'd be read from the changed thread when rewriting it, mixing its messages with these,
+        ##  so the new messages are added to the thread as it is instead)
+        append_to_changed = loaded_from(history) > 0
+        with self._lock(thread_id):
+            if self._append_lines(thread_id, lines, new_from, last_line, append_to_changed): return
+
+        ## The stored thread isn't the one the messages were added to (eg. another worker has rewritten it since it was loaded), or it's in another format, so rewrite it in full
+        self.save_history(thread_id, history, metadata=metadata)
+
+    def _append_lines(self, thread_id:str, lines:str, new_from:int, last_line:str, append_to_changed:bool = False) -> bool:
+        ## Appends the lines to the thread's file, as long as it still holds the `new_from` messages they follow on from, ending with the `last_line` message
+        ## (or whatever it holds, with `append_to_changed`), returns False if the thread needs to be rewritten instead
+        ## NB. Must be called with the thread locked
+        file_path = self._existing_file_path(thread_id)
+        created = file_path is None
+        if created:
+            if new_from > 0: return False
+            file_path = self._file_path(thread_id)
+        elif file_path != self._file_path(thread_id):
+            return False
+        elif not append_to_changed:
+            message_lines, _ = self._read_lines(file_path)
+            if len(message_lines) != new_from or (new_from > 0 and message_lines[-1] != last_line): return False
+
+        if self._compress == 'gzip':
+            ## (A gzip file can hold a series of members, which are read back as a single stream)
+            with open(file_path, 'ab') as f:
+                f.write(gzip.compress(lines.encode()))
+                self._sync(f)
+            if created and self._fsync: self._sync_dir()
+            return True
+
+        with open(file_path, 'a+b') as f:
+            if f.tell() > 0:
+                ## If the last append was cut short (eg. the process died mid-write), then start on a fresh line (the partial line is skipped when loading)
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n": lines = "\n" + lines
+            f.write(lines.encode())     ## (A single write, so the messages + metadata of a save are appended together)
+            self._sync(f)
+        if created and self._fsync: self._sync_dir()
+        return True
+
+    def _write_file(self, thread_id:str, data:bytes):
+        ## Rewrite the whole thread (to a temp file first, so a reader never sees a half written thread)
+        ## NB. Must be called with the thread locked
+        file_path = self._file_path(thread_id)
+        tmp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(data) if self._compress == 'gzip' else data)
+            self._sync(f)
+        os.replace(tmp_path, file_path)
+        if self._fsync: self._sync_dir()
 
-        file_path = Path(self._dir_path) / f"{thread_id}.json"
-        if not file_path.exists(): return None
+        ## Remove the thread's files in any other format
+        for other_path in [ self._plain_file_path(thread_id), self._gzip_file_path(thread_id), self._legacy_file_path(thread_id) ]:
+            if other_path != file_path and other_path.exists(): other_path.unlink()
 
+    def _read_file(self, file_path:Path):
+        if file_path.suffix == '.gz':
+            with gzip.open(file_path, 'rt') as f:
+                try:
+                    for line in f:
+                        yield line
+                except (EOFError, gzip.BadGzipFile):
+                    pass    ## The last append was cut short (eg. the process died mid-write)
+        else:
+            with open(file_path, 'r') as f:
+                for line in f:
+                    yield line
+
+    def _read_lines(self, file_path:Path) -> Tuple[list[str], str]:
+        ## Splits the file into the message lines + the latest metadata line, without parsing the messages (so only the messages that are needed are parsed)
+        message_lines = []
+        metadata_line = None
+        for line in self._read_file(file_path):
+            if not line.endswith("}\n"): continue    ## (A partially written line)
+            if line.startswith('{"message"'):
+                message_lines.append(line)
+            elif line.startswith('{"metadata"'):
+                metadata_line = line
+        return message_lines, metadata_line
+
+    def _sync(self, f):
+        if self._fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync_dir(self):
+        ## (So the rename of the temp file, or a newly created file, is on disk too)
+        if not hasattr(os, 'O_DIRECTORY'): return
+        dir_fd = os.open(self._dir_path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _lock(self, thread_id:str, shared:bool = False) -> '_ThreadLock':
+        return _ThreadLock(Path(self._dir_path) / f"{thread_id}.lock", shared)
+
+    def _file_path(self, thread_id:str) -> Path:
+        return self._gzip_file_path(thread_id) if self._compress == 'gzip' else self._plain_file_path(thread_id)
+
+    def _existing_file_path(self, thread_id:str) -> Path:
+        ## Returns the thread's file (in the configured format if it exists, otherwise in the other format), or None if the thread hasn't been saved as JSON Lines
+        file_path = self._file_path(thread_id)
+        if file_path.exists(): return file_path
+        other_path = self._plain_file_path(thread_id) if self._compress == 'gzip' else self._gzip_file_path(thread_id)
+        return other_path if other_path.exists() else None
+
+    def _plain_file_path(self, thread_id:str) -> Path:
+        return Path(self._dir_path) / f"{thread_id}.jsonl"
+
+    def _gzip_file_path(self, thread_id:str) -> Path:
+        return Path(self._dir_path) / f"{thread_id}.jsonl.gz"
+
+    def _legacy_file_path(self, thread_id:str) -> Path:
+        return Path(self._dir_path) / f"{thread_id}.json"
+
+    def _load_legacy_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
+        file_path = self._legacy_file_path(thread_id)
+        if not file_path.exists(): return None, None
 
         with open(file_path, 'r') as f:
             data = json.load(f)
             messages = [ChatMessage.from_dict(msg) for msg in data.get('messages')]
             metadata = data.get('metadata', None)
             return messages, metadata
-        
-        
 
-    def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
-        ## Save the provided list of ChatMessage objects to a file named thread_id.json in dir_path
-        ## If ttl is provided, set the file to expire in ttl seconds
-        file_path = Path(self._dir_path) / f"{thread_id}.json"
-        with open(file_path, 'w') as f:
-            data = {
-                'messages': [msg.to_dict() for msg in history]
-            }
-            if metadata is not None:
-                data['metadata'] = metadata
-            json.dump(data, f)
\ No newline at end of file
+
+class _ThreadLock:
+    ## An advisory lock on the thread's lock file (shared for reads, exclusive for writes), held for the duration of the `with` block
+    def __init__(self, lock_path:Path, shared:bool):
+        self._lock_path = lock_path
+        self._shared = shared
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is None: return self
+        self._fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_SH if self._shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+
+
+def _parse_messages(lines:list[str]) -> list[ChatMessage]:
+    return [ ChatMessage.from_dict(json.loads(line)['message']) for line in lines ]
+
+def _to_lines(messages:list[ChatMessage], metadata:dict[str,any]) -> str:
+    lines = [ json.dumps({ 'message': msg.to_dict() }) for msg in messages ]
+    if metadata is not None:
+        lines.append(json.dumps({ 'metadata': metadata }))
+    return "".join(line + "\n" for line in lines)
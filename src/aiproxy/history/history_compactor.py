@@ -0,0 +1,251 @@
+import os
+import logging
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from aiproxy.data.chat_context import ChatContext
+from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.token_usage import TokenUsage
+from aiproxy.utils.tokens import TokenCounter, get_token_counter
+
+HISTORY_SUMMARY_KEY = "history-summary"
+
+DEFAULT_SUMMARY_PROMPT = """You are summarising the earlier part of a conversation between a user and an AI assistant, so that the conversation can continue without needing the full transcript.
+
+The transcript is provided as the user prompt, with each message formatted as: "[role] message".
+It may start with a summary of an even earlier part of the conversation, if so, fold that summary into your new summary.
+
+Write a concise summary that retains:
+* the facts, preferences and details the user has provided about themselves
+* any decisions, answers or commitments the assistant has made
+* any important data that was retrieved by function calls and is likely to be needed again
+* any open questions or tasks that have not been completed yet
+
+Respond with only the summary, written in the third person, do not add any additional commentary.
+"""
+
+MAX_PENDING_SUMMARIES = int(os.environ.get('HISTORY_MAX_PENDING_SUMMARIES', 1000))
+
+_SUMMARY_EXECUTOR:ThreadPoolExecutor = ThreadPoolExecutor(thread_name_prefix="history-summary-", max_workers=int(os.environ.get('HISTORY_SUMMARY_MAX_WORKERS', 2)))
+
+class HistoryCompactor:
+    """
+    Keeps the conversation sent to the model within a message count and/or token budget
+
+    The window always keeps the leading system messages (the system prompt + any summary of earlier turns),
+    the whole of the current turn, and never separates a tool call from its tool results.
+    Older turns that fall outside of the window can optionally be folded into a single summary message.
+    The history is only ever changed on the thread handling the request (a summary written in the background is folded in at the start of the next turn).
+    """
+    max_messages:int = 0
+    max_tokens:int = 0
+    summarise:bool = False
+    summary_prompt:str = None
+    _token_counter:TokenCounter = None
+    usage_source:str = None
+    _summaries_in_progress:set[str] = None
+    _pending:dict[str, '_Fold'] = None
+    """The summaries written in the background, waiting to be folded into their thread's history"""
+    _lock:Lock = None
+
+    def __init__(self, max_messages:int = 0, max_tokens:int = 0, model:str = None, summarise:bool = False, summary_prompt:str = None, usage_source:str = None):
+        self.max_messages = max_messages or 0
+        self.max_tokens = max_tokens or 0
+        self.summarise = summarise
+        self.summary_prompt = summary_prompt or DEFAULT_SUMMARY_PROMPT
+        self._token_counter = get_token_counter(model) if self.max_tokens > 0 else None
+        self.usage_source = usage_source or HISTORY_SUMMARY_KEY
+        self._summaries_in_progress = set()
+        self._pending = {}
+        self._lock = Lock()
+
+    def window_messages(self, context:ChatContext) -> list[dict]:
+        """
+        Returns the messages (in the OpenAI message format) to send to the model
+        """
+        history = context.history
+        if history is None: return []
+        pinned = self._pinned_count(history)
+        start = self.window_start(context)
+        if start <= pinned:
+            return context.get_openai_messages()
+        ## (Only the messages in the window are converted, so the older messages of a lazily loaded history are never loaded)
+        return [ history[idx].to_openid_message() for idx in range(pinned) ] + context.get_openai_messages(start)
+
+    def needs_compaction(self, context:ChatContext) -> bool:
+        if context.history is None: return False
+        return self.window_start(context) > self._pinned_count(context.history)
+
+    def window_start(self, context:ChatContext, budget_scale:float = 1.0) -> int:
+        """
+        Returns the index of the first (non pinned) history message that fits within the window (optionally scaling the window budget)
+        """
+        history = context.history
+        count = len(history)
+        pinned = self._pinned_count(history)
+        max_messages = int(self.max_messages * budget_scale)
+        max_tokens = int(self.max_tokens * budget_scale)
+        if count <= pinned: return pinned
+        if max_tokens <= 0 and (max_messages <= 0 or count <= max_messages): return pinned
+
+        ## Always keep the current turn (from the latest user message onwards)
+        turn_start = count - 1
+        while turn_start > pinned and history[turn_start].role != 'user':
+            turn_start -= 1
+
+        msg_count = pinned + (count - turn_start)
+        token_count = self._count_tokens(history, 0, pinned) + self._count_tokens(history, turn_start, count) if max_tokens > 0 else 0
+
+        ## Walk backwards through the earlier turns, keeping tool calls and their results together, until the budget is used up
+        start = turn_start
+        idx = turn_start - 1
+        while idx >= pinned:
+            unit_start = idx
+            while unit_start > pinned and history[unit_start].role == 'tool':
+                unit_start -= 1
+            unit_count = idx - unit_start + 1
+            if max_messages > 0 and msg_count + unit_count > max_messages:
+                break
+            if max_tokens > 0:
+                unit_tokens = self._count_tokens(history, unit_start, idx + 1)
+                if token_count + unit_tokens > max_tokens:
+                    break
+                token_count += unit_tokens
+            msg_count += unit_count
+            start = unit_start
+            idx = unit_start - 1
+        return start
+
+    def compact(self, context:ChatContext, summarise_fn:Callable[[str, str], tuple[str, TokenUsage]]):
+        """
+        Fold the turns that have fallen outside the window into a single summary message (which is saved with the rest of the turn)
+
+        The `summarise_fn` is passed the summary system prompt + the transcript to summarise, and returns the summary + the tokens used to write it
+        """
+        if self.apply_pending(context): return
+        if not self.summarise or not self.needs_compaction(context): return
+        fold = self._plan_fold(context.history, self.window_start(context, budget_scale=0.5))
+        if fold is None: return
+        try:
+            fold.summarise(summarise_fn, self.summary_prompt, self._build_transcript)
+        except Exception as e:
+            logging.warning(f"Failed to summarise the history for thread {context.thread_id}: {e}")
+            return
+        self._apply(context, fold)
+
+    def compact_in_background(self, context:ChatContext, summarise_fn:Callable[[str, str], tuple[str, TokenUsage]]):
+        """
+        Summarise the turns that have fallen outside the window in the background, ready to be folded into the history at the start of the thread's next turn (see `apply_pending`)
+
+        Only the summary is written in the background, the history itself is only ever changed by the thread handling the request (so no messages can be lost to a concurrent save)
+        """
+        if not self.summarise or not self.needs_compaction(context): return
+        thread_key = self._thread_key(context)
+        with self._lock:
+            if thread_key in self._summaries_in_progress or thread_key in self._pending: return
+            self._summaries_in_progress.add(thread_key)
+        fold = self._plan_fold(context.history, self.window_start(context, budget_scale=0.5))     ## (The messages to fold are copied now, on the request thread)
+        if fold is None:
+            with self._lock:
+                self._summaries_in_progress.discard(thread_key)
+            return
+        _SUMMARY_EXECUTOR.submit(self._summarise_in_background, thread_key, fold, summarise_fn)
+
+    def apply_pending(self, context:ChatContext) -> bool:
+        """
+        Folds a summary written in the background into the history (as long as the messages it summarised are still there), returns whether the history was folded
+        """
+        if len(self._pending) == 0 or context.history is None: return False
+        with self._lock:
+            fold = self._pending.pop(self._thread_key(context), None)
+        if fold is None: return False
+        return self._apply(context, fold)
+
+    def _summarise_in_background(self, thread_key:str, fold:'_Fold', summarise_fn:Callable[[str, str], tuple[str, TokenUsage]]):
+        try:
+            fold.summarise(summarise_fn, self.summary_prompt, self._build_transcript)
+            if fold.summary is None: return
+            with self._lock:
+                if len(self._pending) >= MAX_PENDING_SUMMARIES:
+                    self._pending.pop(next(iter(self._pending)))    ## (Drop the oldest, eg. for threads that never came back)
+                self._pending[thread_key] = fold
+        except Exception as e:
+            logging.warning(f"Failed to summarise the history for thread {thread_key}: {e}")
+        finally:
+            with self._lock:
+                self._summaries_in_progress.discard(thread_key)
+
+    def _plan_fold(self, history:list[ChatMessage], cut:int) -> '_Fold':
+        ## Fold down to half of the window, so there's room for a few more turns before needing to summarise again
+        keep = 1 if len(history) > 0 and history[0].role == 'system' and history[0].get_metadata(HISTORY_SUMMARY_KEY) is None else 0
+        if cut <= keep: return None
+        return _Fold(keep, cut, list(history[keep:cut]))
+
+    def _apply(self, context:ChatContext, fold:'_Fold') -> bool:
+        ## Only fold the history if the messages that were summarised are still where they were (appending to the history since is fine)
+        history = context.history
+        if fold.summary is None or len(history) < fold.cut: return False
+        if _fingerprint(history[fold.keep]) != _fingerprint(fold.messages[0]) or _fingerprint(history[fold.cut - 1]) != _fingerprint(fold.messages[-1]): return False
+        if fold.keep == 1 and (history[0].role != 'system' or history[0].get_metadata(HISTORY_SUMMARY_KEY) is not None): return False
+
+        summary_msg = ChatMessage(message=f"Summary of the conversation so far:\n{fold.summary.strip()}", role='system', metadata={ HISTORY_SUMMARY_KEY: True, 'summarised-messages': len(fold.messages) })
+        context.history = list(history[:fold.keep]) + [summary_msg] + list(history[fold.cut:])
+        if fold.usage is not None:
+            context.get_usage_tracker().record(self.usage_source, fold.usage)
+        return True
+
+    def _thread_key(self, context:ChatContext) -> str:
+        return context.thread_id or str(id(context))
+
+    def _build_transcript(self, messages:list[ChatMessage]) -> str:
+        lines = []
+        for msg in messages:
+            if msg.tool_calls is not None and len(msg.tool_calls) > 0:
+                for tool_call in msg.tool_calls:
+                    function = tool_call.get('function') or {}
+                    lines.append(f"[{msg.role}] Called the function '{function.get('name')}' with args: {function.get('arguments')}")
+            else:
+                content = msg.message if msg.message is not None else str(msg.content or '')
+                if msg.role == 'tool' and len(content) > 2000:
+                    content = content[:2000] + "...(truncated)"
+                lines.append(f"[{msg.role}] {content}")
+        return "\n".join(lines)
+
+    def _pinned_count(self, history:list[ChatMessage]) -> int:
+        pinned = 0
+        while pinned < len(history) and history[pinned].role == 'system':
+            pinned += 1
+        return pinned
+
+    def _count_tokens(self, history:list[ChatMessage], start:int, end:int) -> int:
+        tokens = 0
+        for idx in range(start, end):
+            msg = history[idx]
+            if msg._token_count is None:
+                msg._token_count = self._token_counter.count_message(msg.to_openid_message())
+            tokens += msg._token_count
+        return tokens
+
+
+class _Fold:
+    """
+    The messages to fold into a summary (copied when the fold was planned), + the summary once it has been written
+    """
+    __slots__ = ('keep', 'cut', 'messages', 'summary', 'usage')
+
+    def __init__(self, keep:int, cut:int, messages:list[ChatMessage]):
+        self.keep = keep
+        self.cut = cut
+        self.messages = messages
+        self.summary:str = None
+        self.usage:TokenUsage = None
+
+    def summarise(self, summarise_fn:Callable[[str, str], tuple[str, TokenUsage]], summary_prompt:str, build_transcript:Callable[[list[ChatMessage]], str]):
+        summary, self.usage = summarise_fn(summary_prompt, build_transcript(self.messages))
+        if summary is not None and len(summary.strip()) > 0:
+            self.summary = summary
+
+def _fingerprint(msg:ChatMessage) -> tuple:
+    ## (The history may have been re-loaded since the fold was planned, so the messages are compared by their content rather than their identity)
+    return (msg.role, msg.message, msg.tool_call_id, len(msg.tool_calls or []))
@@ -1,18 +1,171 @@
-
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
 from typing import Tuple
 from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.lazy_history import loaded_from
 
 from ..interfaces.abstract_history_provider import HistoryProvider
+from .caching_history_provider import _estimate_size
+
+EVICTION_POLICIES = ['lru', 'lfu']
+
+class _StoredThread:
+    __slots__ = ('messages', 'metadata', 'size', 'expires_at', 'uses')
+
+    def __init__(self, messages:list[ChatMessage], metadata:dict[str,any], size:int, expires_at:float, uses:int = 0):
+        self.messages = messages
+        self.metadata = metadata
+        self.size = size
+        self.expires_at = expires_at
+        self.uses = uses
+
 
 class MapHistoryProvider(HistoryProvider):
-    _map:dict[str, list[ChatMessage]]
-    def __init__(self):
-        self._map = {}
+    """
+    Keeps the threads in memory (they're lost when the process restarts)
+
+    The map is bounded by both the number of threads and their (approximate) size, evicting the least recently used (`lru`) or least frequently used (`lfu`)
+    threads once either limit is reached, and each thread expires once it hasn't been saved for the TTL. A limit of 0 means unbounded.
+    """
+    _map:OrderedDict[str, _StoredThread]
+    def __init__(self, max_entries:int = None, max_bytes:int = None, ttl_secs:float = None, eviction_policy:str = None):
+        self._max_entries = max_entries if max_entries is not None else int(os.environ.get('MAP_HISTORY_MAX_ENTRIES', 10000))
+        self._max_bytes = max_bytes if max_bytes is not None else int(os.environ.get('MAP_HISTORY_MAX_BYTES', 256 * 1024 * 1024))
+        self._ttl_secs = ttl_secs if ttl_secs is not None else float(os.environ.get('MAP_HISTORY_TTL_SECS', 0))
+        self._eviction_policy = (eviction_policy or os.environ.get('MAP_HISTORY_EVICTION_POLICY', 'lru')).lower()
+        if self._eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy '{self._eviction_policy}', expected one of {EVICTION_POLICIES}")
+        self._map = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self._use_buckets:dict[int, OrderedDict[str, None]] = {}
+        self._min_uses:int = None
+        self.evictions = 0
+        self.expirations = 0
 
     def load_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
-        data = self._map.get(thread_id)
+        data = self._get(thread_id)
         if data is None: return None, None
-        return data.get('messages'), data.get('metadata')
+        return list(data.messages), data.metadata
 
     def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
-        self._map[thread_id] = { 'messages':history, 'metadata': metadata }
\ No newline at end of file
+        ## (A lazily loaded history is stored as a list, so loading its older pages never reads back through itself)
+        ## NB. The list is built before the lock is taken, as loading the older pages of a lazily loaded history reads them from this provider
+        messages = list(history)
+        size = _estimate_size(messages)
+        with self._lock:
+            data = self._live(thread_id)
+            self._store(thread_id, messages, metadata, size, data.uses if data is not None else 0)     ## (The thread is as used as it was before the save)
+
+    def append_history(self, thread_id:str, history:list[ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        ## (The thread is read + updated with a single hold of the lock, so concurrent appends to it are never lost)
+        new_messages = list(history[new_from:])
+        new_size = _estimate_size(new_messages)
+        lazy = loaded_from(history) > 0
+        with self._lock:
+            data = self._live(thread_id)
+            if data is not None and (len(data.messages) == new_from or lazy):
+                ## (If the thread has changed since it was lazily loaded, the older messages that weren't loaded would be read from the changed thread when rewriting it, so the new messages are added to it as it is)
+                self._store(thread_id, data.messages + new_messages, metadata, data.size + new_size, data.uses)
+                return
+            if not lazy:
+                ## (Every message has been loaded, so listing them doesn't read from this provider)
+                messages = list(history)
+                self._store(thread_id, messages, metadata, _estimate_size(messages), data.uses if data is not None else 0)
+                return
+        ## The thread no longer exists (eg. it has expired), and only the last messages of the history were loaded, so they're loaded in full to save it (without the lock held)
+        self.save_history(thread_id, history, metadata=metadata)
+
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[ChatMessage], dict[str,any], int]:
+        data = self._get(thread_id)
+        if data is None: return None, None, 0
+        return data.messages[-count:] if count > 0 else [], data.metadata, len(data.messages)
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        data = self._get(thread_id, use=False)
+        if count is not None and (data is None or len(data.messages) != count): return None
+        return data.messages[start:end] if data is not None else []
+
+    def stats(self) -> dict[str,any]:
+        with self._lock:
+            return { 'entries': len(self._map), 'bytes': self._size, 'evictions': self.evictions, 'expirations': self.expirations }
+
+    def _get(self, thread_id:str, use:bool = True) -> _StoredThread:
+        with self._lock:
+            data = self._live(thread_id)
+            if data is not None and use:
+                self._use(thread_id, data)
+                self._map.move_to_end(thread_id)
+            return data
+
+    def _live(self, thread_id:str) -> _StoredThread:
+        ## Returns the stored thread, or None if there isn't one (or it has expired)
+        ## NB. Must be called with the lock held
+        data = self._map.get(thread_id)
+        if data is None: return None
+        if data.expires_at > 0 and data.expires_at < time():
+            self._remove(thread_id)
+            self.expirations += 1
+            return None
+        return data
+
+    def _store(self, thread_id:str, messages:list[ChatMessage], metadata:dict[str,any], size:int, uses:int = 0):
+        ## NB. Must be called with the lock held
+        data = _StoredThread(messages, metadata, size, time() + self._ttl_secs if self._ttl_secs > 0 else 0, uses + 1)
+        self._remove(thread_id)
+        self._map[thread_id] = data
+        self._size += data.size
+        self._add_use_bucket(thread_id, data.uses)
+        while len(self._map) > 1 and ((self._max_entries > 0 and len(self._map) > self._max_entries) or (self._max_bytes > 0 and self._size > self._max_bytes)):
+            self._evict(thread_id)
+
+    def _evict(self, keep_thread_id:str):
+        ## NB. Must be called with the lock held (the thread that's just been saved is never evicted)
+        victim = self._least_used(keep_thread_id) if self._eviction_policy == 'lfu' else next(iter(self._map))
+        self._remove(victim)
+        self.evictions += 1
+
+    def _remove(self, thread_id:str):
+        ## NB. Must be called with the lock held
+        data = self._map.pop(thread_id, None)
+        if data is not None:
+            self._size -= data.size
+            self._remove_use_bucket(thread_id, data.uses)
+
+    ## For `lfu` eviction the threads are also kept in buckets by their use count (each in LRU order), along with the lowest count that has a bucket,
+    ## so the least used thread is found without going through the whole map
+    def _use(self, thread_id:str, data:_StoredThread):
+        ## NB. Must be called with the lock held
+        if self._eviction_policy != 'lfu':
+            data.uses += 1
+            return
+        was_least_used = data.uses == self._min_uses
+        self._remove_use_bucket(thread_id, data.uses)
+        data.uses += 1
+        if was_least_used and self._min_uses is None: self._min_uses = data.uses    ## (It was the only thread with the lowest count, so now has the lowest count)
+        self._add_use_bucket(thread_id, data.uses)
+
+    def _add_use_bucket(self, thread_id:str, uses:int):
+        if self._eviction_policy != 'lfu': return
+        self._use_buckets.setdefault(uses, OrderedDict())[thread_id] = None
+        if self._min_uses is not None and uses < self._min_uses: self._min_uses = uses
+
+    def _remove_use_bucket(self, thread_id:str, uses:int):
+        if self._eviction_policy != 'lfu': return
+        bucket = self._use_buckets.get(uses)
+        if bucket is None: return
+        bucket.pop(thread_id, None)
+        if len(bucket) == 0:
+            del self._use_buckets[uses]
+            if uses == self._min_uses: self._min_uses = None    ## (Found again when it's next needed)
+
+    def _least_used(self, keep_thread_id:str) -> str:
+        ## The least used thread, the least recently used of those if there's a tie (skipping the thread that's just been saved)
+        if self._min_uses is None: self._min_uses = min(self._use_buckets)
+        for thread_id in self._use_buckets[self._min_uses]:
+            if thread_id != keep_thread_id: return thread_id
+        ## (The thread that's just been saved is the only one with the lowest count, so take the least used of the rest)
+        next_uses = min(uses for uses in self._use_buckets if uses != self._min_uses)
+        return next(iter(self._use_buckets[next_uses]))
@@ -0,0 +1,175 @@
+import os
+import json
+import sqlite3
+import threading
+from time import time
+from typing import Tuple
+from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.lazy_history import loaded_from
+
+from ..interfaces.abstract_history_provider import HistoryProvider
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS thread_messages (thread_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (thread_id, seq)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, metadata TEXT, message_count INTEGER NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at)",
+]
+
+class SqliteHistoryProvider(HistoryProvider):
+    """
+    Stores the threads in a local SQLite database (eg. for single node / edge deployments, where the history needs to survive a restart)
+
+    Each message is a row keyed by (thread_id, seq), so a save that only adds messages inserts just the new rows (in a single batch), and the tail
+    (or any range) of a thread can be loaded without reading the rest of it. The metadata of each thread is kept in a separate table, along with
+    its message count, version + when it was last saved.
+
+    The database is opened in WAL mode (so readers don't block the writer), with a connection per thread. When a TTL is set, threads that haven't been
+    saved for that long are treated as missing, and are deleted by a periodic cleanup (run as part of saving, or by calling `cleanup_expired`).
+    """
+    _db_path:str
+
+    def __init__(self, db_path:str = None, ttl_secs:float = None, cleanup_interval_secs:float = None, busy_timeout_secs:float = 30):
+        self._db_path = db_path or os.environ.get('SQLITE_HISTORY_PATH', 'history.db')
+        self._ttl_secs = ttl_secs if ttl_secs is not None else float(os.environ.get('SQLITE_HISTORY_TTL_SECS', 0))
+        self._cleanup_interval_secs = cleanup_interval_secs if cleanup_interval_secs is not None else float(os.environ.get('SQLITE_HISTORY_CLEANUP_INTERVAL_SECS', 300))
+        self._busy_timeout_secs = busy_timeout_secs
+        self._local = threading.local()
+        self._last_cleanup = time()
+
+        with self._transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def load_history(self, thread_id:str) -> Tuple[list[ChatMessage], dict[str,any]]:
+        conn = self._connection()
+        thread = self._get_thread(conn, thread_id)
+        if thread is None: return None, None
+        rows = conn.execute("SELECT message FROM thread_messages WHERE thread_id = ? ORDER BY seq", (thread_id,)).fetchall()
+        return _to_messages(rows), _from_json(thread[0])
+
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[ChatMessage], dict[str,any], int]:
+        conn = self._connection()
+        thread = self._get_thread(conn, thread_id)
+        if thread is None: return None, None, 0
+        metadata, total = _from_json(thread[0]), thread[1]
+        if count <= 0: return [], metadata, total
+        rows = conn.execute("SELECT message FROM thread_messages WHERE thread_id = ? AND seq >= ? ORDER BY seq", (thread_id, total - count)).fetchall()
+        return _to_messages(rows), metadata, total
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[ChatMessage]:
+        if count is None:
+            rows = self._connection().execute("SELECT message FROM thread_messages WHERE thread_id = ? AND seq >= ? AND seq < ? ORDER BY seq", (thread_id, start, end)).fetchall()
+            return _to_messages(rows)
+        ## (The thread's message count is checked in the same statement, so the messages can't come from a save made after the check)
+        rows = self._connection().execute("""SELECT message FROM thread_messages WHERE thread_id = ? AND seq >= ? AND seq < ?
+                                             AND (SELECT message_count FROM threads WHERE thread_id = ?) = ? ORDER BY seq""", (thread_id, start, end, thread_id, count)).fetchall()
+        if len(rows) == 0 and end > start: return None
+        return _to_messages(rows)
+
+    def save_history(self, thread_id:str, history:list[ChatMessage], metadata:dict[str,any] = None):
+        ## (The messages are serialised before the transaction, as the older pages of a lazily loaded history are read from this database)
+        rows = _to_rows(history, 0)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM thread_messages WHERE thread_id = ?", (thread_id,))
+            self._insert_rows(conn, thread_id, rows, 0)
+            self._set_thread(conn, thread_id, metadata, len(history))
+        self._cleanup_if_due()
+
+    def append_history(self, thread_id:str, history:list[ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        rows = _to_rows(history, new_from)
+        with self._transaction() as conn:
+            ## Only insert the new messages if the stored thread is still the one they were added to (eg. it hasn't been saved by another process since)
+            thread = conn.execute("SELECT message_count FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            stored_count = thread[0] if thread is not None else 0
+            appended = stored_count == new_from
+            if not appended and thread is not None and loaded_from(history) > 0:
+                ## The older messages of a lazily loaded history that haven't been loaded would now be read from the changed thread (mixing its messages with these),
+                ## so the new messages are added to the thread as it is, rather than rewriting it
+                new_from, appended = stored_count, True
+            if appended:
+                self._insert_rows(conn, thread_id, rows, new_from)
+                self._set_thread(conn, thread_id, metadata, new_from + len(rows))
+        if not appended:
+            self.save_history(thread_id, history, metadata)
+            return
+        self._cleanup_if_due()
+
+    def get_version(self, thread_id:str) -> str:
+        row = self._connection().execute("SELECT version FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return str(row[0]) if row is not None else None
+
+    def cleanup_expired(self) -> int:
+        """
+        Deletes the threads that haven't been saved within the TTL, returning the number of threads deleted
+        """
+        self._last_cleanup = time()
+        if self._ttl_secs <= 0: return 0
+        cutoff = time() - self._ttl_secs
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM thread_messages WHERE thread_id IN (SELECT thread_id FROM threads WHERE updated_at < ?)", (cutoff,))
+            return conn.execute("DELETE FROM threads WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def close(self):
+        """
+        Closes the calling thread's connection to the database
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        ## (SQLite connections can't be shared between threads, so each thread has its own)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=self._busy_timeout_secs, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")   ## (Safe with WAL, a crash can only lose the last transactions, never corrupt the database)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self) -> '_Transaction':
+        return _Transaction(self._connection())
+
+    def _get_thread(self, conn:sqlite3.Connection, thread_id:str) -> tuple:
+        ## Returns the (metadata, message_count) of the thread, or None if it doesn't exist (or has expired)
+        if self._ttl_secs > 0:
+            return conn.execute("SELECT metadata, message_count FROM threads WHERE thread_id = ? AND updated_at >= ?", (thread_id, time() - self._ttl_secs)).fetchone()
+        return conn.execute("SELECT metadata, message_count FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+
+    def _insert_rows(self, conn:sqlite3.Connection, thread_id:str, rows:list[str], start:int):
+        conn.executemany("INSERT INTO thread_messages (thread_id, seq, message) VALUES (?, ?, ?)",
+                         ((thread_id, start + idx, row) for idx, row in enumerate(rows)))
+
+    def _set_thread(self, conn:sqlite3.Connection, thread_id:str, metadata:dict[str,any], message_count:int):
+        conn.execute("""INSERT INTO threads (thread_id, metadata, message_count, version, updated_at) VALUES (?, ?, ?, 1, ?)
+                        ON CONFLICT (thread_id) DO UPDATE SET metadata = excluded.metadata, message_count = excluded.message_count, version = threads.version + 1, updated_at = excluded.updated_at""",
+                     (thread_id, json.dumps(metadata) if metadata is not None else None, message_count, time()))
+
+    def _cleanup_if_due(self):
+        if self._ttl_secs > 0 and time() - self._last_cleanup >= self._cleanup_interval_secs:
+            self.cleanup_expired()
+
+
+class _Transaction:
+    ## Runs the statements in a single write transaction (taking the write lock up front, so concurrent writers wait on the busy timeout rather than failing part way through)
+    def __init__(self, conn:sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def _to_rows(history:list[ChatMessage], start:int) -> list[str]:
+    return [ json.dumps(msg.to_dict()) for msg in history[start:] ]
+
+def _to_messages(rows:list[tuple]) -> list[ChatMessage]:
+    return [ ChatMessage.from_dict(json.loads(row[0])) for row in rows ]
+
+def _from_json(value:str) -> dict[str,any]:
+    return json.loads(value) if value is not None else None
@@ -0,0 +1,156 @@
+import atexit
+import logging
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+class WriteBehindBuffer:
+    """
+    Buffers writes of keyed items (eg. thread history documents) and writes them in the background
+
+    * Multiple pending writes for the same key are coalesced, so only the latest version of the item is written (or the result of `merge_fn(pending, new)`, if one is given)
+    * The pending items are written every `flush_interval_secs`, or as soon as `flush_threshold` items are pending
+    * Once `max_pending` items are pending, `put` blocks until the next batch has been written (applying backpressure to the callers rather than letting the queue grow unbounded)
+    * Items are written in batches, one batch at a time, so writes of the same key are never re-ordered
+    * `get` returns the pending (or in-flight) version of an item, so a reader in this process sees its own writes before they reach the store
+
+    Call `flush()` to write everything that is pending (eg. on a graceful shutdown), it's also called automatically when the interpreter exits
+    """
+    def __init__(self,
+                 write_fn:Callable[[str, any], None],
+                 flush_interval_secs:float = 0.5,
+                 flush_threshold:int = 50,
+                 max_pending:int = 1000,
+                 max_workers:int = 4,
+                 name:str = "write-behind",
+                 merge_fn:Callable[[any, any], any] = None):
+        self._write_fn = write_fn
+        self._merge_fn = merge_fn
+        self._flush_interval_secs = flush_interval_secs
+        self._flush_threshold = max(1, flush_threshold)
+        self._max_pending = max(self._flush_threshold, max_pending)
+        self._name = name
+        self._pending:dict[str, any] = {}
+        self._inflight:dict[str, any] = {}
+        self._flush_requested = False
+        self._closed = False
+        self._cond = Condition()
+        self._executor = ThreadPoolExecutor(thread_name_prefix=f"{name}-", max_workers=max_workers) if max_workers > 1 else None
+
+        ## Counters (for monitoring how effective the buffer is)
+        self.puts = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.failed_writes = 0
+
+        self._thread = Thread(target=self._run, name=f"{name}-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, key:str, item:any, timeout_secs:float = None) -> bool:
+        """
+        Queue the item to be written (replacing any pending version of it), returns False if the buffer stayed full for longer than the timeout (in which case the item was not queued)
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The write-behind buffer has been closed")
+            self.puts += 1
+            if key in self._pending:
+                self._pending[key] = self._merge_fn(self._pending[key], item) if self._merge_fn is not None else item
+                self.coalesced += 1
+                return True
+
+            if len(self._pending) >= self._max_pending:
+                ## Backpressure: wait for the flusher to make room
+                self._flush_requested = True
+                self._cond.notify_all()
+                if not self._cond.wait_for(lambda: len(self._pending) < self._max_pending or self._closed, timeout_secs):
+                    logging.warning(f"The {self._name} buffer is full, the write of {key} timed out")
+                    return False
+                if self._closed:
+                    raise RuntimeError("The write-behind buffer has been closed")
+
+            self._pending[key] = item
+            if len(self._pending) >= self._flush_threshold:
+                self._flush_requested = True
+                self._cond.notify_all()
+            return True
+
+    def get(self, key:str) -> any:
+        """
+        Returns the latest version of the item that is waiting to be written (or is being written), or None if there isn't one
+        """
+        with self._cond:
+            item = self._pending.get(key)
+            return item if item is not None else self._inflight.get(key)
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending) + len(self._inflight)
+
+    def flush(self, timeout_secs:float = None) -> bool:
+        """
+        Write everything that is pending, waiting until it has been written (returns False if that took longer than the timeout)
+        """
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: (len(self._pending) == 0 and len(self._inflight) == 0) or not self._thread.is_alive(), timeout_secs)
+
+    def close(self, timeout_secs:float = None):
+        """
+        Flush the buffer and stop the background flusher (no more items can be queued)
+        """
+        if self._closed: return
+        self.flush(timeout_secs)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout_secs)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = monotonic() + self._flush_interval_secs
+                while not self._flush_requested and not self._closed:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0: break
+                    self._cond.wait(remaining)
+                if self._closed and len(self._pending) == 0:
+                    return
+                self._flush_requested = False
+                if len(self._pending) == 0:
+                    continue
+                self._inflight = self._pending
+                self._pending = {}
+                self._cond.notify_all()     ## (There's room in the buffer again)
+                batch = list(self._inflight.items())
+
+            self._write_batch(batch)
+
+            with self._cond:
+                self._inflight = {}
+                self._cond.notify_all()
+
+    def _write_batch(self, batch:list[tuple[str, any]]):
+        if self._executor is not None and len(batch) > 1:
+            try:
+                for _ in self._executor.map(self._write, batch):
+                    pass
+                return
+            except RuntimeError:
+                pass    ## The executor won't accept work once the interpreter is shutting down, so write the batch from this thread
+        for entry in batch:
+            self._write(entry)
+
+    def _write(self, entry:tuple[str, any]):
+        key, item = entry
+        try:
+            self._write_fn(key, item)
+            self.writes += 1
+        except Exception as e:
+            self.failed_writes += 1
+            logging.error(f"Failed to write {key} from the {self._name} buffer: {e}")
@@ -1,4 +1,6 @@
 
 from .abstract_streamer import StreamWriter, SimpleStreamMessage, ERROR_MESSAGE,  INFO_MESSAGE, INTERIM_RESULT_MESSAGE, PROGRESS_UPDATE_MESSAGE
 from .abstract_history_provider import HistoryProvider, NoOpHistoryProvider
+from .abstract_response_cache import ResponseCache, NoOpResponseCache
+from .abstract_span_exporter import SpanExporter, NoOpSpanExporter
 from .function_def import FunctionDef
\ No newline at end of file
@@ -7,6 +7,46 @@ class HistoryProvider:
     
     def save_history(self, thread_id:str, history:list[data.ChatMessage], metadata:dict[str,any] = None):
         raise NotImplementedError("This method must be implemented by the subclass")
+
+    def load_history_tail(self, thread_id:str, count:int) -> Tuple[list[data.ChatMessage], dict[str,any], int]:
+        """
+        Loads the last `count` messages of the thread (+ its metadata), returning them along with the total number of messages in the thread
+
+        Providers that can load part of a thread should override this (+ `load_history_range`), by default the whole thread is loaded
+        """
+        history, metadata = self.load_history(thread_id)
+        if history is None: return None, metadata, 0
+        return history[-count:] if count > 0 else [], metadata, len(history)
+
+    def load_history_range(self, thread_id:str, start:int, end:int, count:int = None) -> list[data.ChatMessage]:
+        """
+        Loads the messages of the thread in the range [start, end)
+
+        With `count`, the messages are only loaded if the thread still has that many messages (eg. the number it had when its tail was loaded), otherwise None is returned
+        """
+        history, _ = self.load_history(thread_id)
+        if count is not None and (history is None or len(history) != count): return None
+        return history[start:end] if history is not None else []
+
+    def append_history(self, thread_id:str, history:list[data.ChatMessage], new_from:int, metadata:dict[str,any] = None):
+        """
+        Saves the thread, when only the messages from `history[new_from:]` have been added since it was loaded (or last saved)
+
+        Providers that can persist just the new messages should override this, by default the whole thread is saved
+        """
+        self.save_history(thread_id, history, metadata=metadata)
+
+    def get_version(self, thread_id:str) -> str:
+        """
+        Returns the version of the saved thread (eg. an etag), which changes every time the thread is saved, or None if the provider doesn't track versions
+        """
+        return None
+
+    def flush(self, timeout_secs:float = None) -> bool:
+        """
+        Waits for any saves that are being written in the background to complete (providers that write synchronously have nothing to do)
+        """
+        return True
     
 
 class NoOpHistoryProvider(HistoryProvider):
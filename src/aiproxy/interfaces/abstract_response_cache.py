@@ -0,0 +1,47 @@
+class ResponseCache:
+    """
+    A cache of responses from the AI Model, keyed on a hash of the request (eg. the model + messages + tools)
+    """
+    hits:int = 0
+    misses:int = 0
+    evictions:int = 0
+
+    def get(self, key:str) -> dict[str,any]:
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+    def set(self, key:str, value:dict[str,any], ttl_secs:float = None):
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+    def clear(self):
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+    def stats(self) -> dict[str,any]:
+        """
+        Returns the hit/miss counters of the cache (for monitoring)
+        """
+        lookups = self.hits + self.misses
+        return {
+            'type': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit-ratio': self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def _record_lookup(self, hit:bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+class NoOpResponseCache(ResponseCache):
+    def get(self, key:str) -> dict[str,any]:
+        self._record_lookup(False)
+        return None
+
+    def set(self, key:str, value:dict[str,any], ttl_secs:float = None):
+        pass
+
+    def clear(self):
+        pass
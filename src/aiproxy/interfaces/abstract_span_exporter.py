@@ -0,0 +1,13 @@
+class SpanExporter:
+    """
+    Exports the timed spans recorded while handling a request (eg. to the logs, or to a tracing backend)
+
+    The exporter is passed the `RequestTrace` (see `aiproxy.telemetry`) once the request has completed
+    """
+    def export(self, trace:'RequestTrace'):
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+
+class NoOpSpanExporter(SpanExporter):
+    def export(self, trace:'RequestTrace'):
+        pass
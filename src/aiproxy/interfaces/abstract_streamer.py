@@ -1,7 +1,8 @@
 import os
+import asyncio
 from typing import Callable
 from abc import abstractmethod
-from time import time_ns
+from time import time_ns, perf_counter
 from uuid import uuid4
 from concurrent.futures import ThreadPoolExecutor
 
@@ -35,23 +36,57 @@ class StreamWriter:
     _message_filter:Callable[[dict|str], bool]
     _stream_id:str
     _executor:ThreadPoolExecutor = None
-
+    _dispatcher = None      ## (A `StreamDispatcher`, which delivers the messages in the background, in order)
+    _push_rtt_secs:float = None
+    _push_blocks:bool = True
+    """Whether pushing a message can block (eg. on a network call), writers that only buffer the messages in memory set this to False"""
+    PUSH_RTT_SMOOTHING = 0.25
 
     def __init__(self, stream_id:str, message_filter:Callable[[dict|str], bool] = None) -> None:
         self._message_filter = message_filter
         self._stream_id = stream_id or uuid4().hex
         self._async = os.environ.get('STREAM_WRITER_ASYNC', 'true').lower() == 'true'
     
-    def push_message(self, message:dict|str, content_type:str = "application/json"):
+    def push_message(self, message:dict|str, content_type:str = "application/json", block:bool = True):
+        ## (With `block=False`, a push to a full dispatcher queue doesn't wait for room, see `StreamDispatcher.submit`)
         if self._message_filter is None or self._message_filter(message):
-            if self._async and self._executor is not None: 
-                self._executor.submit(self._execute_push_message, message, content_type)
+            if self._async and self._dispatcher is not None:
+                self._dispatcher.submit(self, message, content_type, block=block)
+            elif self._async and self._executor is not None: 
+                self._executor.submit(self._execute_timed_push, message, content_type, perf_counter())
+            elif not block and self._push_blocks and _on_event_loop():
+                ## A push that would block (eg. an HTTP post, with STREAM_WRITER_ASYNC off) mustn't hold up an event loop, so from here on the writer's messages
+                ## are delivered by the stream dispatcher (all of them, so they stay in order)
+                from aiproxy.streaming import get_stream_dispatcher
+                self._dispatcher = self._dispatcher or get_stream_dispatcher()
+                self._async = True
+                self._dispatcher.submit(self, message, content_type, block=False)
             else: 
-                self._execute_push_message(message, content_type)
+                self._execute_timed_push(message, content_type, perf_counter())
     
     def set_executor(self, excutor:ThreadPoolExecutor):
         self._executor = excutor
 
+    def set_dispatcher(self, dispatcher):
+        self._dispatcher = dispatcher
+
+    @property
+    def push_rtt_secs(self) -> float:
+        """
+        The (smoothed) time from a message being pushed to it being delivered to the sink, including any time spent waiting in a queue (None until a message has been delivered)
+        """
+        return self._push_rtt_secs
+
+    def _record_push_rtt(self, rtt_secs:float):
+        if self._push_rtt_secs is None:
+            self._push_rtt_secs = rtt_secs
+        else:
+            self._push_rtt_secs += self.PUSH_RTT_SMOOTHING * (rtt_secs - self._push_rtt_secs)
+
+    def _execute_timed_push(self, message:dict|str, content_type:str, pushed_at:float):
+        self._execute_push_message(message, content_type)
+        self._record_push_rtt(perf_counter() - pushed_at)
+
     def _execute_push_message(self, message:dict|str, content_type:str = "application/json"):
         try:
             self._push_message(message, content_type)
@@ -62,7 +97,21 @@ class StreamWriter:
             logging.error(traceback.format_exc())
 
 
+    def _push_messages(self, messages:list[dict|str], content_type:str = "application/json"):
+        """
+        Pushes a batch of messages (in order), writers for sinks that accept several messages at once can override this to send them together
+        """
+        for message in messages:
+            self._execute_push_message(message, content_type)
+
     @abstractmethod
     def _push_message(self, message:dict|str, content_type:str = "application/json"):
         raise NotImplementedError("This method must be implemented by the subclass")
-    
\ No newline at end of file
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
@@ -3,7 +3,8 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.data.lazy_history import as_list
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agent import Agent
 from .agents import agent_factory
 
@@ -23,6 +24,7 @@ class AgentOrchestrator(AbstractProxy):
                 if 'not found' not in estr and 'unknown' not in estr:
                     raise ValueError(f"Failed to create agent from config: {estr}")
         
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
@@ -40,7 +42,7 @@ class AgentOrchestrator(AbstractProxy):
             raise ValueError("No agent specified for the message")
         
         if working_notifier is not None: working_notifier()
-        result = self._agent.process_message(message, context.clone_for_single_shot(with_streamer=True), working_notifier=working_notifier, conversation_history=context.history, **kwargs)
+        result = self._agent.process_message(message, context.clone_for_single_shot(with_streamer=True), working_notifier=working_notifier, conversation_history=as_list(context.history), **kwargs)
         context.add_prompt_to_history(message, 'user')
         context.add_response_to_history(result)
         context.save_history()
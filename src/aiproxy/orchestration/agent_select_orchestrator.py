@@ -3,7 +3,8 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.data.lazy_history import as_list
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agent import Agent
 from .agents import agent_factory
 from .agents.route_to_agent_agent import RouteToAgentAgent
@@ -33,6 +34,7 @@ class AgentSelectOrchestrator(AbstractProxy):
                 raise AssertionError(f"Agent {agent.name} does not have a description - all agents must have a description")
             self._agents.append(agent)
 
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
@@ -47,7 +49,8 @@ class AgentSelectOrchestrator(AbstractProxy):
         selector_context.current_msg_id = context.current_msg_id
         context.init_history()
         if context.history: 
-            for msg in context.history:
+            ## (The whole conversation is copied, so load any older messages of a lazily loaded history in one go)
+            for msg in as_list(context.history):
                 selector_context.add_prompt_to_history(msg.message, msg.role)
         if working_notifier is not None: working_notifier()
         result = self._selector.process_message(message, selector_context, working_notifier=working_notifier)
@@ -3,7 +3,7 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agent import Agent
 from .agents import agent_factory
 from .agents.assistant_agent import AssistantAgent
@@ -21,6 +21,7 @@ class AssistantOrchestrator(AbstractProxy):
         if not isinstance(self._agent, AssistantAgent):
             raise ValueError("Agent created is not an AssistantAgent")
         
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
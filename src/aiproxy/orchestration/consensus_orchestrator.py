@@ -2,7 +2,7 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agent import Agent
 from .agents import agent_factory
 from .agents.route_to_agent_agent import RouteToAgentAgent
@@ -257,6 +257,7 @@ class ConsensusOrchestrator(AbstractProxy):
             response_str += f"[{agent.name}]:\n{response.message}\n---\n"
         return response_str
 
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
@@ -293,7 +294,7 @@ class ConsensusOrchestrator(AbstractProxy):
         ## Check if we need to force all agents to respond first time
         all_agents_must_respond_first_time = context.get_metadata("all_agents_must_respond_first_time") or self._all_agents_must_respond_first_time
         
-        include_interim_responses = context.get_metadata("include_interim_responses") if 'include_interim_responses' in context.metadata else self._include_interim_responses
+        include_interim_responses = context.get_metadata("include_interim_responses") if context.metadata is not None and 'include_interim_responses' in context.metadata else self._include_interim_responses
 
 
         ## Setup the conversation context
@@ -348,6 +349,9 @@ class ConsensusOrchestrator(AbstractProxy):
             turn += 1
             if turn > max_turns:
                 break
+            if context.get_usage_tracker().budget_exceeded():
+                context.push_stream_update("The token budget has been used up, so the conversation is being wrapped up", "step")
+                break
             
             ## Step 1: Ask the Coordinator to select an agent or complete the conversation
             if working_notifier is not None: working_notifier()
@@ -3,7 +3,7 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agents.analyse_image_agent import AnalyseImageAgent
 from .agents import agent_factory
 
@@ -17,6 +17,7 @@ class ImageOrchestrator(AbstractProxy):
         agent_config = ChatConfig.load(config)
         self._agent = AnalyseImageAgent(agent_name, agent_desc, agent_config)
         
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
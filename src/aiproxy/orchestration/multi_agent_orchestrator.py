@@ -4,7 +4,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, GLOBAL_PROXIES_REGISTRY, CompletionsProxy
+from aiproxy.proxy import AbstractProxy, GLOBAL_PROXIES_REGISTRY, CompletionsProxy, track_usage
 from .agent import Agent
 from .agents import agent_factory
 
@@ -77,6 +77,7 @@ class MultiAgentOrchestrator(AbstractProxy):
     def _send_message_to_agent(self, agent:Agent, message:str, context:ChatContext) -> Tuple[Agent, ChatResponse]:
         return (agent, agent.process_message(message, context))
 
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
@@ -150,3 +151,5 @@ class MultiAgentOrchestrator(AbstractProxy):
             context.add_prompt_to_history(message, 'user')
             context.add_response_to_history(response)
             context.save_history()
+
+        return response
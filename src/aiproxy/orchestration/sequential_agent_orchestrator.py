@@ -2,7 +2,7 @@ from typing import Callable
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
-from aiproxy.proxy import AbstractProxy, ProxyRegistry
+from aiproxy.proxy import AbstractProxy, ProxyRegistry, track_usage
 from .agent import Agent
 from .agents import agent_factory
 from .agents.route_to_agent_agent import RouteToAgentAgent
@@ -50,6 +50,7 @@ class SequentialAgentOrchestrator(AbstractProxy):
             agents.append(agent)
         return agents
 
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
@@ -4,8 +4,9 @@ from typing import Callable, Annotated
 
 from ..proxy import AbstractProxy
 from aiproxy.data import ChatConfig, ChatContext, ChatResponse
+from aiproxy.data.lazy_history import as_list
 from aiproxy.functions import GLOBAL_FUNCTIONS_REGISTRY, FunctionDef
-from aiproxy.proxy import GLOBAL_PROXIES_REGISTRY, CompletionsProxy
+from aiproxy.proxy import GLOBAL_PROXIES_REGISTRY, CompletionsProxy, track_usage
 from aiproxy.utils.func import invoke_registered_function, FAILED_INVOKE_RESPONSE
 from aiproxy.streaming import PROGRESS_UPDATE_MESSAGE
 
@@ -316,10 +317,11 @@ class StepPlanOrchestrator(AbstractProxy):
         if not context.history or len(context.history) == 0:
             return 'No recent conversation.'
         
-        for message in context.history:
+        for message in as_list(context.history):
             recent_conversation += f"[{message.role}]\n{message.message}\n***"
         return recent_conversation
 
+    @track_usage
     def send_message(self, message: str, 
                      context: ChatContext, 
                      override_model: str = None, 
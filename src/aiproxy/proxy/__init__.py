@@ -1,6 +1,7 @@
-from .abstract_proxy import AbstractProxy
+from .abstract_proxy import AbstractProxy, track_usage
 from .proxy_registry import ProxyRegistry, GLOBAL_PROXIES_REGISTRY
 from .completions_proxy import CompletionsProxy
+from .async_completions_proxy import AsyncCompletionsProxy
 from .assistant_proxy import AssistantProxy
 from .embedding_proxy import EmbeddingProxy
 
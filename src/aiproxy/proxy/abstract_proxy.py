@@ -1,4 +1,5 @@
 from abc import abstractmethod
+from functools import wraps
 from typing import Callable
 import logging
 import json
@@ -8,11 +9,14 @@ from openai import AzureOpenAI
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse
+from aiproxy.data.token_usage import TokenUsage
 from aiproxy.functions.function_registry import GLOBAL_FUNCTIONS_REGISTRY
 from aiproxy.utils.func import invoke_registered_function
+from aiproxy.telemetry import RequestTrace, TRACING_ENABLED, export_trace
 
 class AbstractProxy:
     _config:ChatConfig
+    _client:AzureOpenAI
 
     def __init__(self, config:ChatConfig|str) -> None:
         if config is None:
@@ -22,14 +26,21 @@ class AbstractProxy:
         if type(config) is dict: 
             config = ChatConfig.load(config)
         self._config = config
-        self._client = AzureOpenAI(
-            azure_endpoint = self._build_base_url(False), 
-            api_key=self._config.oai_key,  
-            api_version=self._config.oai_version
-        )
+
+        ## Share the client (and its connection pool) with any other proxies that use the same Azure OpenAI resource
+        from .proxy_registry import GLOBAL_PROXIES_REGISTRY
+        self._client = GLOBAL_PROXIES_REGISTRY.get_client(self._build_base_url(False), self._config.oai_version, self._config.oai_key, self._config)
 
         logging.getLogger("httpx").setLevel(logging.ERROR) ## Stop the excessive logging from the httpx client library  
 
+        ## Record where the time goes in each request (if this config, or the environment, has opted in to tracing)
+        self._tracing = str(self._config.get('tracing', TRACING_ENABLED)).lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+
+        ## The maximum number of tokens a single request can use (0 = unlimited), and the price of the tokens (per 1000 tokens)
+        self._token_budget = int(self._config.get('token-budget', 0) or 0)
+        self._prompt_token_cost = float(self._config.get('prompt-token-cost', 0) or 0)
+        self._completion_token_cost = float(self._config.get('completion-token-cost', 0) or 0)
+
     @abstractmethod
     def send_message(self, 
                      message:str, 
@@ -65,6 +76,48 @@ class AbstractProxy:
             region = self._config.oai_region if self._config.oai_region is not None else "australiaeast"
             return f"https://aoai-{region}.openai.azure.com/{'openai' if include_path else ''}"
 
+    def _start_trace(self, context:ChatContext) -> RequestTrace:
+        """
+        Starts tracing the request (if tracing is enabled), returning the new trace, or None if the request is not being traced or is already part of another request's trace
+        """
+        if not self._tracing or context.trace is not None: return None
+        context.trace = RequestTrace()
+        return context.trace
+
+    def _finish_trace(self, trace:RequestTrace, context:ChatContext, response:ChatResponse):
+        """
+        Finishes the trace started by `_start_trace`, adding it to the response metadata (as `_trace`) and sending it to the span exporter
+        """
+        if trace is None: return
+        if context.trace is trace:
+            context.trace = None
+        ## This happens after the response has been added to the history, so the trace isn't persisted with the history
+        if response is not None:
+            response.add_metadata('_trace', trace.to_dict())
+        export_trace(trace)
+
+    def _start_usage(self, context:ChatContext) -> tuple[TokenUsage, int]:
+        """
+        Marks the start of a request, for tracking the tokens it uses (and applying this config's token budget to it)
+        """
+        tracker = context.get_usage_tracker()
+        limit_id = tracker.add_limit(self._token_budget) if self._token_budget > 0 else None
+        return tracker.snapshot(), limit_id
+
+    def _finish_usage(self, context:ChatContext, usage_start:tuple[TokenUsage, int], response:ChatResponse = None):
+        """
+        Marks the end of a request started with `_start_usage`, setting the usage of the response (if one is given) to the tokens used since the start (broken down by the config that used them)
+        """
+        start, limit_id = usage_start
+        tracker = context.get_usage_tracker()
+        if limit_id is not None:
+            tracker.remove_limit(limit_id)
+        if response is not None:
+            response.usage = tracker.usage_since(start)
+
+    def _token_cost(self, prompt_tokens:int, completion_tokens:int) -> float:
+        return (prompt_tokens * self._prompt_token_cost + completion_tokens * self._completion_token_cost) / 1000
+
     def _invoke_function_tool(self, function_name:str, function_args:str|dict, context:ChatContext) -> str:
         return invoke_registered_function(function_name, function_args, context, sys_objects={ 'config': self._config, 'proxy': self })
     
@@ -120,4 +173,19 @@ class AbstractProxy:
                 pass
 
         return response
-    
\ No newline at end of file
+    
+
+def track_usage(send_message:Callable) -> Callable:
+    """
+    Decorates the `send_message` of an orchestrator, so that the usage of the response is the total of all the tokens used by the agents (+ the orchestrator itself) to respond, and the config's token budget is applied
+    """
+    @wraps(send_message)
+    def wrapper(self:AbstractProxy, message:str, context:ChatContext, *args, **kwargs) -> ChatResponse:
+        usage_start = self._start_usage(context)
+        response = None
+        try:
+            response = send_message(self, message, context, *args, **kwargs)
+        finally:
+            self._finish_usage(context, usage_start, response)
+        return response
+    return wrapper
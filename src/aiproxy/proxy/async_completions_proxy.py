@@ -0,0 +1,201 @@
+import asyncio
+from typing import Callable
+from time import time, perf_counter
+
+import openai
+from openai import AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from aiproxy.data.chat_config import ChatConfig
+from aiproxy.data.chat_context import ChatContext
+from aiproxy.data.chat_response import ChatResponse
+from aiproxy.data.chat_chunk import ChunkData
+from aiproxy.data.token_usage import TokenUsage
+from aiproxy.streaming import PROGRESS_UPDATE_MESSAGE
+from aiproxy.functions.function_registry import GLOBAL_FUNCTIONS_REGISTRY
+from aiproxy.cache.completion_cache import AsyncCachingStream
+from aiproxy.telemetry import StreamStats
+
+from .completions_proxy import CompletionsProxy
+
+class AsyncCompletionsProxy(CompletionsProxy):
+    """
+    A CompletionsProxy that can also be driven from an asyncio event loop (via `send_message_async`)
+
+    The calls to the model are made using the async OpenAI client, so awaiting a response does not tie up a thread,
+    while the (blocking) history loads/saves and function tool calls are handed off to worker threads.
+    """
+    @property
+    def _async_client(self) -> AsyncAzureOpenAI:
+        ## An async client is bound to the event loop it's used on, so the (shared) client for the running loop is looked up on each call
+        ## (eg. so a proxy can be used with `asyncio.run` from several threads)
+        from .proxy_registry import GLOBAL_PROXIES_REGISTRY
+        return GLOBAL_PROXIES_REGISTRY.get_client(self._build_base_url(False), self._config.oai_version, self._config.oai_key, self._config, use_async=True)
+
+    async def send_message_async(self,
+                     message:str,
+                     context:ChatContext,
+                     override_model:str = None,
+                     override_system_prompt:str = None,
+                     function_filter:Callable[[str,str], bool] = None,
+                     use_functions:bool = None,
+                     timeout_secs:int = 0,
+                     use_completions_data_source_extensions:bool = False,
+                     working_notifier:Callable[[], None] = None,
+                     **kwargs
+                     ) -> ChatResponse:
+        trace = self._start_trace(context)
+        usage_start = self._start_usage(context)
+        response = None
+        try:
+            with context.span('completions.send_message', config=self._config.name, model=override_model or self._config.oai_model, stream=context.has_stream(), is_async=True) as span:
+                response = await self._send_message_async(message, context, override_model, override_system_prompt, function_filter, use_functions, timeout_secs, use_completions_data_source_extensions, working_notifier, **kwargs)
+                span.set_attribute('thread_id', response.thread_id)
+                span.set_attribute('failed', response.failed)
+        finally:
+            self._finish_usage(context, usage_start)
+            self._finish_trace(trace, context, response)
+        return response
+
+    async def _send_message_async(self,
+                     message:str,
+                     context:ChatContext,
+                     override_model:str = None,
+                     override_system_prompt:str = None,
+                     function_filter:Callable[[str,str], bool] = None,
+                     use_functions:bool = None,
+                     timeout_secs:int = 0,
+                     use_completions_data_source_extensions:bool = False,
+                     working_notifier:Callable[[], None] = None,
+                     **kwargs
+                     ) -> ChatResponse:
+
+        ## The Data Source Extensions adapter only has a synchronous client, so hand the whole request off to a worker thread
+        if self.completions_data_sources is not None and use_completions_data_source_extensions:
+            return await asyncio.to_thread(self.send_message, message, context, override_model, override_system_prompt, function_filter, use_functions, timeout_secs, use_completions_data_source_extensions, working_notifier, **kwargs)
+
+        ## Add the user message to the thread history (this may need to load the history from the provider, so do it off the event loop)
+        thread_id, message = await asyncio.to_thread(self._start_thread_turn, message, context, override_system_prompt)
+
+        ## Create the response object
+        response = ChatResponse()
+        response.thread_id = thread_id
+        response.usage = TokenUsage()
+
+        try:
+            ## If a (semantically) similar prompt has already been answered, then respond with that answer (embedding the prompt is a blocking call, so do it off the event loop)
+            prompt_embedding, cache_scope, cache_result = await asyncio.to_thread(self._lookup_semantic_cache, message, context, response)
+            if cache_result is not None and cache_result['hit']:
+                await asyncio.to_thread(self._complete_thread_turn, response, context)
+                response.add_metadata('semantic-cache', cache_result)   ## (Added after the response is saved to the history, so it isn't persisted)
+                return response
+
+            ## Continuously send messages to the model until we get a final response
+            more_steps = True
+            step_count = 0
+            remaining_secs = timeout_secs if timeout_secs > 0 else self._config.timeout_secs
+            model = override_model or self._config.oai_model
+            using_functions = use_functions if use_functions is not None else self._config.use_functions
+            filter_for_tool_calls = function_filter or context.function_filter
+
+            tool_list = GLOBAL_FUNCTIONS_REGISTRY.generate_tools_definition(filter_for_tool_calls) if using_functions else None
+            chunk_data = ChunkData(context.current_msg_id) if context.has_stream() else None
+            stream_stats = []
+            usage_tracker = context.get_usage_tracker()
+            while more_steps and step_count < self._config.max_steps:
+                if remaining_secs <= 0:
+                    raise TimeoutError("The request timed out")
+                usage_tracker.check_budget()
+
+                start = time()
+                call_start = perf_counter()
+                step_count += 1
+                cached = False
+
+                ## Build the Message list from the history window (only the messages added since the last step are converted)
+                ## (Off the event loop, as it counts the tokens in the window + may load the older messages of a lazily loaded history from the provider)
+                messages = await asyncio.to_thread(self._history_compactor.window_messages, context)
+
+                ## Send a progress Update
+                self._push_step_progress(step_count, context)
+
+                ## Send the messages to the model
+                with context.span('model.call', step=step_count, messages=len(messages)) as span:
+                    completion_args = self._build_completion_args(messages, model, tool_list, use_functions, step_count, remaining_secs, context)
+                    ## (The response cache may be a SQLite database, so it's read + written off the event loop)
+                    cache_key, result = await asyncio.to_thread(self._lookup_cached_completion, completion_args) if self._response_cache is not None else (None, None)
+                    if result is None:
+                        result = await self._async_client.chat.completions.create(**completion_args)
+                        if cache_key is not None:
+                            result = await self._cache_completion_async(cache_key, result)
+                    else:
+                        span.set_attribute('cached', True)
+                        cached = True
+
+                ## Process the response from the model
+                stats = None
+                if type(result) is not ChatCompletion:
+                    stats = StreamStats(call_start) if type(result) is not list else None     ## (A list is a response replayed from the cache)
+                    with context.span('model.stream', step=step_count) as span:
+                        more_steps = await self._process_streaming_results_async(result, response, context, chunk_data, stats)
+                        self._record_stream_stats(stats, step_count, model, stream_stats, span, chunk_data)
+                else:
+                    context.push_stream_update("Writing a response", PROGRESS_UPDATE_MESSAGE, block=False)
+                    with context.span('model.process', step=step_count):
+                        more_steps = await self._process_choices_async(result, response, context)
+
+                ## Record the tokens used by this step (a response replayed from the cache didn't use any)
+                if not cached:
+                    self._record_step_usage(step_count, result, stats, messages, model, response.usage, usage_tracker)
+
+                ## Update the remaining time
+                remaining_secs -= time() - start
+
+            ## Now, parse the response and update the context if needed (saving the history may block, so do it off the event loop)
+            await asyncio.to_thread(self._complete_thread_turn, response, context)
+            self._add_to_semantic_cache(prompt_embedding, cache_scope, message, response)
+            if cache_result is not None:
+                response.add_metadata('semantic-cache', cache_result)
+            if len(stream_stats) > 0:
+                response.add_metadata('_stream-stats', stream_stats)
+
+        except Exception as e:
+            self._handle_send_error(e, message, response)
+
+        return response
+
+    async def _cache_completion_async(self, cache_key:str, result:ChatCompletion|openai.AsyncStream) -> ChatCompletion|AsyncCachingStream:
+        if type(result) is ChatCompletion:
+            return await asyncio.to_thread(self._cache_completion, cache_key, result)
+        return AsyncCachingStream(result, self._response_cache, cache_key)
+
+    async def _process_streaming_results_async(self, result:openai.AsyncStream|list[ChatCompletionChunk], response:ChatResponse, context:ChatContext, chunk_data:ChunkData, stats:StreamStats = None) -> bool:
+        more_steps = True
+        if type(result) is list:    ## A response replayed from the cache
+            for chunk in result:
+                if not chunk.choices: continue
+                more_steps = await self._process_choices_async(chunk, response, context, chunk_data)
+            return more_steps
+
+        async for chunk in result:
+            if stats is not None: stats.add_chunk(chunk)
+            if not chunk.choices: continue     ## eg. the usage chunk at the end of the stream (which mustn't reset `more_steps`)
+            more_steps = await self._process_choices_async(chunk, response, context, chunk_data)
+        return more_steps
+
+    async def _process_choices_async(self, result, response:ChatResponse, context:ChatContext, chunk_data:ChunkData = None) -> bool:
+        ## Processing a choice that asks for tools to be called will invoke the (blocking) registered functions, so run those on a worker thread
+        ## Everything else (eg. accumulating a streamed delta) is cheap enough to do on the event loop (the stream updates it pushes never block, see `StreamWriter.push_message`)
+        if self._requires_tool_dispatch(result):
+            return await asyncio.to_thread(self._process_choices, result, response, context, chunk_data)
+        return self._process_choices(result, response, context, chunk_data)
+
+    def _requires_tool_dispatch(self, result) -> bool:
+        for choice in result.choices or []:
+            if type(result) is ChatCompletionChunk:
+                if choice.finish_reason == "tool_calls":
+                    return True
+            elif choice.message is not None and choice.message.tool_calls is not None and len(choice.message.tool_calls) > 0:
+                return True
+        return False
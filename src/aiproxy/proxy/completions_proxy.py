@@ -1,19 +1,28 @@
 from typing import Callable
 from uuid import uuid4
-from time import time
+from time import time, perf_counter
 import logging
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 
 import openai
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk, Choice as StreamChoice
-from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat import ChatCompletionMessageToolCall, ChatCompletion
 
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_context import ChatContext
 from aiproxy.data.chat_response import ChatResponse, ChatCitation
 from aiproxy.data.chat_chunk import ChunkData
 from aiproxy.data.chat_message import ChatMessage
-from aiproxy.streaming import SimpleStreamMessage, PROGRESS_UPDATE_MESSAGE, INTERIM_RESULT_MESSAGE
+from aiproxy.data.token_usage import TokenUsage, UsageTracker, TokenBudgetExceededError
+from aiproxy.streaming import SimpleStreamMessage, PublishCadence, PROGRESS_UPDATE_MESSAGE, INTERIM_RESULT_MESSAGE
 from aiproxy.functions.function_registry import GLOBAL_FUNCTIONS_REGISTRY
+from aiproxy.utils.prompt_template import PromptTemplate
+from aiproxy.utils.tokens import get_token_counter
+from aiproxy.cache.completion_cache import load_response_cache, completion_cache_key, cacheable_completion, is_replayable, replay_completion, CachingStream
+from aiproxy.cache.semantic_cache import get_semantic_cache, DEFAULT_SEMANTIC_CACHE_THRESHOLD
+from aiproxy.telemetry import StreamStats, Span
 
 from .abstract_proxy import AbstractProxy
 from .completions_extensions_adapter import CompletionsWithExtensionsAdapter
@@ -23,6 +32,34 @@ class CompletionsProxy(AbstractProxy):
         super().__init__(config)
         self.__load_oai_data_source_config()
 
+        from aiproxy.history.history_compactor import HistoryCompactor
+        self._history_compactor = HistoryCompactor(
+            max_messages=self._config.max_history if self._config.use_history_window or self._config.summarise_history else 0,    ## (The message count window is opt-in, so existing threads aren't truncated)
+            max_tokens=self._config.max_history_tokens, 
+            model=self._config.oai_model, 
+            summarise=self._config.summarise_history, 
+            summary_prompt=self._config.get('history-summary-prompt'),
+            usage_source=self._config.name,
+        )
+
+        ## Load the response cache (if this config has opted in to caching the responses from the model)
+        self._response_cache = load_response_cache(self._config)
+
+        ## Load the semantic cache (if this config has opted in to answering similar prompts from the cache)
+        self._semantic_cache = None
+        self._embedding_proxy = None
+        if str(self._config.get('semantic-cache', False)).lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']:
+            self._semantic_cache = get_semantic_cache(
+                self._config.name, 
+                threshold=float(self._config.get('semantic-cache-threshold', DEFAULT_SEMANTIC_CACHE_THRESHOLD)), 
+                max_entries=int(self._config.get('semantic-cache-max-entries', 1000)), 
+                ttl_secs=float(self._config.get('semantic-cache-ttl-secs', 3600))
+            )
+
+        ## Ask the model to report its token usage at the end of a streamed response (only supported from the 2024-09-01 API versions)
+        stream_usage_default = (self._config.oai_version or '') >= '2024-09-01'
+        self._stream_usage = str(self._config.get('stream-usage', stream_usage_default)).lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+
     def _get_or_create_thread(self, context:ChatContext, override_system_prompt:str = None) -> str:
         ## Create a new Thread ID
         thread_id = context.thread_id or uuid4().hex
@@ -33,66 +70,20 @@ class CompletionsProxy(AbstractProxy):
         ## Return Thread ID
         return thread_id
     
-    def _parse_prompt_template(self, prompt:str, context:ChatContext) -> str:
-        ## Extract each key from the prompt (wrapped in squiggly brackets) and then find the matching value in metadata or config and replace the key with the value
+    def _parse_prompt_template(self, prompt:str, context:ChatContext, cache_template:bool = True) -> str:
+        ## Replace each key in the prompt (wrapped in squiggly brackets) with the matching value from the context metadata or config prompt vars
         ## If the key is not found, then leave the key in the string
         if prompt is None: return None
-        from_pos = 0
-        start = prompt.find("{", from_pos)
-        while start >= 0:
-            if prompt[start:start+2] == "{{":    ## Ignore any double squiggly brackets
-                from_pos = start + 2
-                start = prompt.find("{", from_pos)
-                continue
+        template = self._config.get_prompt_template(prompt) if cache_template else PromptTemplate(prompt)
+        return template.render(lambda key: self._resolve_prompt_key(key, context))
 
-            
-            end = prompt.find("}", start)
-            if end < 0: break
-
-            key = prompt[start+1:end]
-
-            if key == "date": 
-                from datetime import datetime
-                value = datetime.now().strftime("%Y-%m-%d")
-            elif key == "time": 
-                from datetime import datetime
-                value = datetime.now().strftime("%H:%M:%S")
-            elif key == "datetime":
-                from datetime import datetime
-                value = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            elif key == "utcdate": 
-                from datetime import datetime, tzinfo                
-                value = datetime.now(tz=tzinfo.utcoffset).strftime("%Y-%m-%d")
-            elif key == "utctime": 
-                from datetime import datetime, tzinfo                
-                value = datetime.now(tz=tzinfo.utcoffset).strftime("%H:%M:%S")
-            elif key == "utcdatetime": 
-                from datetime import datetime, tzinfo                
-                value = datetime.now(tz=tzinfo.utcoffset).strftime("%Y-%m-%d %H:%M:%S")
-            elif key == "iso8601":
-                from datetime import datetime
-                value = datetime.now().isoformat()
-            elif key.startswith("date-format:"):
-                from datetime import datetime
-                value = datetime.now().strftime(key[12:])
-            else:
-                ## Ask the context to parse the key
-                value = context.parse_prompt_key(key)
-                if value is None:
-                    ## Check if the key is in the prompt_vars
-                    value = self._config.prompt_vars.get(key) if self._config.prompt_vars is not None else None
-                
-            ## If the key is not found, then leave it, and move on to the next key
-            if value is None:
-                from_pos = start + 2
-                start = prompt.find("{", from_pos)
-                continue
-
-            ## Replace the key with the value                
-            prompt = prompt[:start] + str(value) + prompt[end+1:]
-            from_pos = start + len(value)
-            start = prompt.find("{", from_pos)
-        return prompt
+    def _resolve_prompt_key(self, key:str, context:ChatContext) -> any:
+        ## Ask the context to parse the key
+        value = context.parse_prompt_key(key)
+        if value is None:
+            ## Check if the key is in the prompt_vars
+            value = self._config.prompt_vars.get(key) if self._config.prompt_vars is not None else None
+        return value
 
     def send_message(self, 
                      message:str, 
@@ -106,31 +97,48 @@ class CompletionsProxy(AbstractProxy):
                      working_notifier:Callable[[], None] = None,
                      **kwargs
                      ) -> ChatResponse:
+        trace = self._start_trace(context)
+        usage_start = self._start_usage(context)
+        response = None
+        try:
+            with context.span('completions.send_message', config=self._config.name, model=override_model or self._config.oai_model, stream=context.has_stream()) as span:
+                response = self._send_message(message, context, override_model, override_system_prompt, function_filter, use_functions, timeout_secs, use_completions_data_source_extensions, working_notifier, **kwargs)
+                span.set_attribute('thread_id', response.thread_id)
+                span.set_attribute('failed', response.failed)
+        finally:
+            self._finish_usage(context, usage_start)    ## (The usage of the response is the per-step usage recorded by `_send_message`)
+            self._finish_trace(trace, context, response)
+        return response
+
+    def _send_message(self, 
+                     message:str, 
+                     context:ChatContext, 
+                     override_model:str = None, 
+                     override_system_prompt:str = None, 
+                     function_filter:Callable[[str,str], bool] = None, 
+                     use_functions:bool = None, 
+                     timeout_secs:int = 0, 
+                     use_completions_data_source_extensions:bool = False,
+                     working_notifier:Callable[[], None] = None,
+                     **kwargs
+                     ) -> ChatResponse:
         
         ## Add the user message to the thread history
-        system_prompt_to_use = override_system_prompt or self._config.system_prompt
-        if self._config.system_prompt_is_template: 
-            system_prompt_to_use = self._parse_prompt_template(system_prompt_to_use, context)
-        
-        context.push_stream_update(SimpleStreamMessage("Recalling our conversation so far", PROGRESS_UPDATE_MESSAGE))
-        thread_id = self._get_or_create_thread(context, system_prompt_to_use)     ## This will trigger the context to load the history if it hasn't been loaded already...
-        if message is not None and len(message) > 0:
-            if self._config.user_prompt_is_template: 
-                message = self._parse_prompt_template(message, context)
-            context.add_prompt_to_history(message, "user")
-        elif len(context.history) == 0:
-            context.add_prompt_to_history(system_prompt_to_use, "system")
-        
-        ## If the length of the conversation is getting long, summarise the conversation and drop the history
-        if len(context.history) >= self._config.max_history:
-            # self.__summarise_thread( metadata)
-            pass
+        thread_id, message = self._start_thread_turn(message, context, override_system_prompt)
 
         ## Create the response object
         response = ChatResponse()
         response.thread_id = thread_id
+        response.usage = TokenUsage()
 
         try:
+            ## If a (semantically) similar prompt has already been answered, then respond with that answer
+            prompt_embedding, cache_scope, cache_result = self._lookup_semantic_cache(message, context, response)
+            if cache_result is not None and cache_result['hit']:
+                self._complete_thread_turn(response, context)
+                response.add_metadata('semantic-cache', cache_result)   ## (Added after the response is saved to the history, so it isn't persisted)
+                return response
+
             ## Continuously send messages to the model until we get a final response
             more_steps = True
             step_count = 0
@@ -141,100 +149,344 @@ class CompletionsProxy(AbstractProxy):
 
             tool_list = GLOBAL_FUNCTIONS_REGISTRY.generate_tools_definition(filter_for_tool_calls) if using_functions else None
             chunk_data = ChunkData(context.current_msg_id) if context.has_stream() else None
+            stream_stats = []
+            usage_tracker = context.get_usage_tracker()
             while more_steps and step_count < self._config.max_steps:
                 if remaining_secs <= 0:
                     raise TimeoutError("The request timed out")
+                usage_tracker.check_budget()
             
                 start = time()
+                call_start = perf_counter()
                 step_count += 1
+                cached = False
 
-                ## Build the Message list from the history
-                messages = [ history_item.to_openid_message() for history_item in context.history ]
+                ## Build the Message list from the history window (only the messages added since the last step are converted)
+                messages = self._history_compactor.window_messages(context)
                 
                 ## Send a progress Update
-                if step_count == 1:
-                    context.push_stream_update("Thinking about what you said", PROGRESS_UPDATE_MESSAGE)
-                else: 
-                    context.push_stream_update("Analysing the data I've collected so far", PROGRESS_UPDATE_MESSAGE)
+                self._push_step_progress(step_count, context)
 
                 ## Send the messages to the model
-                if self.completions_data_sources is not None and use_completions_data_source_extensions:
-                    ## Pass a data source configuration to the Completions API and let it do the RAG operations itself
-                    ## This approach simplifies the work done by this function, but is limited to only supporting the 
-                    ## data sources and operations supported by the Azure OpenAI Data Sources API 
-                    result = self.completions_adapter.client().chat.completions.create(
-                        messages=messages,
-                        model=model,
-                        temperature=self._config.temperature,
-                        extra_body={ "dataSources": self.completions_data_sources},
-                        timeout=remaining_secs,
-                        top_p=self._config.top_p,
-                        max_tokens=self._config.max_tokens,
-                        stop=None,
-                        stream=context.has_stream(),
-                    )
-                else: 
-                    ## Pass a tool configuration to the Completions API and handle the RAG + other function calls ourselves
-                    ## This approach allows for more flexibility in the data sources and operations that can be supported, 
-                    ## essentially allowing for any function to be called and any data source to be queried :) 
-                    result = self._client.chat.completions.create(
-                        messages=messages, 
-                        model=model,
-                        temperature=self._config.temperature,
-                        max_tokens=self._config.max_tokens,
-                        top_p=self._config.top_p,
-                        tools=tool_list,
-                        tool_choice=None if not use_functions else "auto" if step_count < self._config.max_steps - 1 else "none",
-                        timeout=remaining_secs,
-                        stream=context.has_stream(),
-                    )
-
-                ## Process the response from the model
-                if type(result) is openai.Stream:
-                    more_steps = self._process_streaming_results(result, response, context, chunk_data)
+                with context.span('model.call', step=step_count, messages=len(messages)) as span:
+                    if self.completions_data_sources is not None and use_completions_data_source_extensions:
+                        ## Pass a data source configuration to the Completions API and let it do the RAG operations itself
+                        ## This approach simplifies the work done by this function, but is limited to only supporting the 
+                        ## data sources and operations supported by the Azure OpenAI Data Sources API 
+                        result = self.completions_adapter.client().chat.completions.create(
+                            messages=messages,
+                            model=model,
+                            temperature=self._config.temperature,
+                            extra_body={ "dataSources": self.completions_data_sources},
+                            timeout=remaining_secs,
+                            top_p=self._config.top_p,
+                            max_tokens=self._config.max_tokens,
+                            stop=None,
+                            stream=context.has_stream(),
+                        )
+                    else: 
+                        ## Pass a tool configuration to the Completions API and handle the RAG + other function calls ourselves
+                        ## This approach allows for more flexibility in the data sources and operations that can be supported, 
+                        ## essentially allowing for any function to be called and any data source to be queried :) 
+                        completion_args = self._build_completion_args(messages, model, tool_list, use_functions, step_count, remaining_secs, context)
+                        cache_key, result = self._lookup_cached_completion(completion_args)
+                        if result is None:
+                            result = self._client.chat.completions.create(**completion_args)
+                            if cache_key is not None:
+                                result = self._cache_completion(cache_key, result)
+                        else: 
+                            span.set_attribute('cached', True)
+                            cached = True
+
+                ## Process the response from the model (for a streamed response, this is where the time waiting for the model to generate the response goes)
+                stats = None
+                if type(result) is not ChatCompletion:
+                    stats = StreamStats(call_start) if type(result) is not list else None     ## (A list is a response replayed from the cache)
+                    with context.span('model.stream', step=step_count) as span:
+                        more_steps = self._process_streaming_results(result, response, context, chunk_data, stats)
+                        self._record_stream_stats(stats, step_count, model, stream_stats, span, chunk_data)
                 else: 
-                    context.push_stream_update("Writing a response", PROGRESS_UPDATE_MESSAGE)
-                    more_steps = self._process_choices(result, response, context) 
+                    context.push_stream_update("Writing a response", PROGRESS_UPDATE_MESSAGE, block=False)
+                    with context.span('model.process', step=step_count):
+                        more_steps = self._process_choices(result, response, context) 
+                
+                ## Record the tokens used by this step (a response replayed from the cache didn't use any)
+                if not cached:
+                    self._record_step_usage(step_count, result, stats, messages, model, response.usage, usage_tracker)
                 
                 ## Update the remaining time
                 remaining_secs -= time() - start
                 
             
             ## Now, parse the response and update the context if needed
-            self._parse_response(response, context)
-
-            ## Request the context to save the history (with the updated messages list)
-            context.push_stream_update("Documenting our conversation", PROGRESS_UPDATE_MESSAGE)
-            context.add_response_to_history(response)
-            context.save_history()
+            self._complete_thread_turn(response, context)
+            self._add_to_semantic_cache(prompt_embedding, cache_scope, message, response)
+            if cache_result is not None:
+                response.add_metadata('semantic-cache', cache_result)
+            if len(stream_stats) > 0:
+                response.add_metadata('_stream-stats', stream_stats)    ## (Added after the response is saved to the history, so the timings aren't persisted)
 
         except Exception as e:
-            if hasattr(e, 'code') and str(e.code or "") == "content_filter":
-                data = e.body if e.body is not None and type(e.body) is dict else {}
-                response.failed = True
-                response.error = "Content Filtered"
-                response.filtered = True
-                response.filter_reason = None
-                logging.debug(f"This prompt triggered the content policy: {message}")
-                if "content_filter_result" in data:
-                    response.filter_reason = data["content_filter_result"]
-                response.message = "I'm sorry, I can't respond to that message, maybe try asking again in a slightly different way."
-            else: 
-                import traceback
-                traceback.print_exception(e)
-                logging.error(f"Failed to send a prompt to the model with error: {e}, Prompt: {message}")
-                response.failed = True
-                response.error = "Unexpected Error Occurred. Please try again later."
-                response.message = "I'm sorry, I'm having trouble responding right now. Please try again later."
+            self._handle_send_error(e, message, response)
 
         return response
+
+    def _start_thread_turn(self, message:str, context:ChatContext, override_system_prompt:str = None) -> tuple[str, str]:
+        """
+        Prepares the thread for a new turn (loading the history + adding the user message), returning the thread id and the (possibly templated) user message
+        """
+        system_prompt_to_use = override_system_prompt or self._config.system_prompt
+        if self._config.system_prompt_is_template: 
+            system_prompt_to_use = self._parse_prompt_template(system_prompt_to_use, context)
+        
+        context.push_stream_update(SimpleStreamMessage("Recalling our conversation so far", PROGRESS_UPDATE_MESSAGE), block=False)
+        thread_id = self._get_or_create_thread(context, system_prompt_to_use)     ## This will trigger the context to load the history if it hasn't been loaded already...
+        if message is not None and len(message) > 0:
+            if self._config.user_prompt_is_template: 
+                message = self._parse_prompt_template(message, context, cache_template=False)     ## User prompts are (usually) different every time, so don't bother caching them
+            context.add_prompt_to_history(message, "user")
+        elif len(context.history) == 0:
+            context.add_prompt_to_history(system_prompt_to_use, "system")
+        
+        ## If the conversation no longer fits in the history window, summarise the older turns now (or fold in the summary written in the background after the last turn)
+        if not self._config.summarise_history_async:
+            with context.span('history.compact'):
+                self._history_compactor.compact(context, self._summarise_history)
+        else:
+            self._history_compactor.apply_pending(context)
+
+        return thread_id, message
+
+    def _complete_thread_turn(self, response:ChatResponse, context:ChatContext):
+        """
+        Parses the final response + records it in the thread history (and then saves the history)
+        """
+        self._parse_response(response, context)
+
+        ## Request the context to save the history (with the updated messages list)
+        context.push_stream_update("Documenting our conversation", PROGRESS_UPDATE_MESSAGE, block=False)
+        context.add_response_to_history(response)
+        context.save_history()
+
+        ## Summarise the older turns in the background (ready for the next turn)
+        if self._config.summarise_history_async:
+            self._history_compactor.compact_in_background(context, self._summarise_history)
+
+    def _summarise_history(self, summary_prompt:str, transcript:str) -> tuple[str, TokenUsage]:
+        messages = [ { "role": "system", "content": summary_prompt }, { "role": "user", "content": transcript } ]
+        model = self._config.get('history-summary-model') or self._config.oai_model
+        result = self._client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=0,
+            max_tokens=self._config.max_tokens,
+            timeout=self._config.timeout_secs,
+        )
+        summary = result.choices[0].message.content if len(result.choices) > 0 else None
+
+        ## (The tokens used are recorded against the turn that the summary is folded into)
+        return summary, self._measure_usage(result, None, messages, model)
+
+    def _push_step_progress(self, step_count:int, context:ChatContext):
+        if step_count == 1:
+            context.push_stream_update("Thinking about what you said", PROGRESS_UPDATE_MESSAGE, block=False)
+        else: 
+            context.push_stream_update("Analysing the data I've collected so far", PROGRESS_UPDATE_MESSAGE, block=False)
+
+    def _build_completion_args(self, messages:list[dict], model:str, tool_list:list[dict], use_functions:bool, step_count:int, remaining_secs:float, context:ChatContext) -> dict:
+        """
+        Builds the arguments for a call to the Chat Completions API (when using function calling rather than the data source extensions)
+        """
+        return {
+            "messages": messages, 
+            "model": model,
+            "temperature": self._config.temperature,
+            "max_tokens": self._config.max_tokens,
+            "top_p": self._config.top_p,
+            "tools": tool_list,
+            "tool_choice": None if not use_functions else "auto" if step_count < self._config.max_steps - 1 else "none",
+            "timeout": remaining_secs,
+            "stream": context.has_stream(),
+            **({ "stream_options": { "include_usage": True } } if self._stream_usage and context.has_stream() else {}),
+        }
+
+    def _lookup_cached_completion(self, completion_args:dict) -> tuple[str, ChatCompletion|list]:
+        """
+        Returns the cache key for the call (or None if the call shouldn't be cached) + the cached response (or None if it's not in the cache)
+        """
+        if self._response_cache is None: return None, None
+        ## Only deterministic calls are cached (unless the config says otherwise)
+        if (completion_args.get('temperature') or 0) > 0 and not self._config.get('response-cache-any-temperature', False): return None, None
+
+        cache_key = completion_cache_key(completion_args, self._build_base_url(False), self._config.oai_version)
+        cached = self._response_cache.get(cache_key)
+        if cached is None or not is_replayable(cached): return cache_key, None
+        return cache_key, replay_completion(cached, completion_args.get('model'), completion_args.get('stream'))
+
+    def _cache_completion(self, cache_key:str, result:ChatCompletion|openai.Stream) -> ChatCompletion|CachingStream:
+        if type(result) is ChatCompletion:
+            cacheable = cacheable_completion(result)
+            if cacheable is not None:
+                self._response_cache.set(cache_key, cacheable)
+            return result
+        ## The streamed response is cached once the stream has been consumed
+        return CachingStream(result, self._response_cache, cache_key)
+
+    def _lookup_semantic_cache(self, message:str, context:ChatContext, response:ChatResponse) -> tuple[list[float], str, dict[str,any]]:
+        """
+        Look for a cached answer to a similar prompt (in the same scope), filling in the response if one is found
+
+        Returns the embedding of the prompt + its scope (so it can be cached once it's been answered), and the result of the lookup (for the `semantic-cache` response metadata,
+        None if the cache wasn't looked up), which is `hit` if the response was filled in from the cache
+        """
+        if self._semantic_cache is None or message is None or len(message) == 0: return None, None, None
+
+        ## By default, only stand-alone prompts are answered from the cache (the answer to a follow-up question depends on the conversation so far)
+        if not str(self._config.get('semantic-cache-any-turn', False)).lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']:
+            ## (Counted from the most recent message, stopping at the second prompt, so the older messages of a long thread don't need to be loaded)
+            user_count = 0
+            for msg in reversed(context.history):
+                if msg.role == 'user': user_count += 1
+                if user_count > 1: return None, None, None
+
+        with context.span('semantic-cache.lookup') as span:
+            try:
+                if self._embedding_proxy is None:
+                    from .proxy_registry import GLOBAL_PROXIES_REGISTRY
+                    from .embedding_proxy import EmbeddingProxy
+                    self._embedding_proxy = GLOBAL_PROXIES_REGISTRY.load_proxy(self._config.get('semantic-cache-embedding-config', 'default-embedding'), EmbeddingProxy)
+                embedding = self._embedding_proxy.get_embeddings(message)
+            except Exception as e:
+                logging.warning(f"Failed to embed the prompt for the semantic cache: {e}")
+                return None, None, None
+
+            scope = self._semantic_cache_scope(context)
+            entry, similarity = self._semantic_cache.lookup(embedding, scope)
+            span.set_attribute('hit', entry is not None)
+        if entry is None:
+            return embedding, scope, { 'hit': False, 'similarity': similarity }
+
+        response.message = entry.response.get('message')
+        response.citations = entry.response.get('citations')
+        response.intent = entry.response.get('intent')
+        for key, val in (entry.response.get('metadata') or {}).items():
+            response.add_metadata(key, val)
+        context.push_stream_update({ "delta": response.message, "id": context.current_msg_id }, INTERIM_RESULT_MESSAGE, block=False)
+        return embedding, scope, { 'hit': True, 'similarity': similarity, 'cached-prompt': entry.prompt }
+
+    def _semantic_cache_scope(self, context:ChatContext) -> str:
+        ## An answer is only reused for prompts made with the same (rendered) system prompt, eg. so a prompt templated with the user's details never gets another user's answer
+        ## + with the same values of any of the `semantic-cache-scope-keys` (eg. the user id, for answers that depend on the user's data rather than the prompt)
+        scope = hashlib.sha256()
+        first = context.history[0] if context.history is not None and len(context.history) > 0 else None
+        if first is not None and first.role == 'system':
+            scope.update((first.message or '').encode())
+        scope_keys = self._config.get('semantic-cache-scope-keys', None)
+        if type(scope_keys) is str: scope_keys = [ key.strip() for key in scope_keys.split(',') if len(key.strip()) > 0 ]
+        for key in scope_keys or []:
+            scope.update(f"\n{key}={self._resolve_prompt_key(key, context)}".encode())
+        return scope.hexdigest()
+
+    def _add_to_semantic_cache(self, embedding:list[float], scope:str, message:str, response:ChatResponse):
+        if self._semantic_cache is None or embedding is None: return
+        if response.failed or response.filtered or response.message is None or len(response.message) == 0: return
+        self._semantic_cache.add(embedding, message, {
+            'message': response.message,
+            'citations': response.citations,
+            'intent': response.intent,
+            'metadata': { k: v for k, v in response.metadata.items() if k != 'semantic-cache' and not k.startswith('_') } if response.metadata is not None else None,
+        }, scope)
+
+    def _handle_send_error(self, e:Exception, message:str, response:ChatResponse):
+        if hasattr(e, 'code') and str(e.code or "") == "content_filter":
+            data = e.body if e.body is not None and type(e.body) is dict else {}
+            response.failed = True
+            response.error = "Content Filtered"
+            response.filtered = True
+            response.filter_reason = None
+            logging.debug(f"This prompt triggered the content policy: {message}")
+            if "content_filter_result" in data:
+                response.filter_reason = data["content_filter_result"]
+            response.message = "I'm sorry, I can't respond to that message, maybe try asking again in a slightly different way."
+        elif type(e) is TokenBudgetExceededError:
+            logging.warning(f"The token budget was used up before a response was generated, Prompt: {message}")
+            response.failed = True
+            response.error = "Token Budget Exceeded"
+            response.message = "I'm sorry, I wasn't able to finish working on that within the limits I've been given."
+        else: 
+            import traceback
+            traceback.print_exception(e)
+            logging.error(f"Failed to send a prompt to the model with error: {e}, Prompt: {message}")
+            response.failed = True
+            response.error = "Unexpected Error Occurred. Please try again later."
+            response.message = "I'm sorry, I'm having trouble responding right now. Please try again later."
     
-    def _process_streaming_results(self, result:list[ChatCompletionChunk], response:ChatResponse, context:ChatContext, chunk_data:ChunkData) -> bool:
+    def _process_streaming_results(self, result:openai.Stream|list[ChatCompletionChunk], response:ChatResponse, context:ChatContext, chunk_data:ChunkData, stats:StreamStats = None) -> bool:
         more_steps = True 
-        for chunk in result:
-            more_steps = self._process_choices(chunk, response, context, chunk_data)
+        if stats is None:
+            for chunk in result:
+                if not chunk.choices: continue     ## eg. the usage chunk at the end of the stream (which mustn't reset `more_steps`)
+                more_steps = self._process_choices(chunk, response, context, chunk_data)
+        else: 
+            for chunk in result:
+                stats.add_chunk(chunk)
+                if not chunk.choices: continue
+                more_steps = self._process_choices(chunk, response, context, chunk_data)
         return more_steps
 
+    def _record_stream_stats(self, stats:StreamStats, step:int, model:str, stream_stats:list[dict], span:Span, chunk_data:ChunkData = None):
+        """
+        Summarise the timings of a streamed step (adding them to the list of step timings + the trace span), and add them to the process-wide streaming metrics
+        (along with the cadence the interim results were published at)
+        """
+        if stats is None: return
+        try:
+            summary = stats.summary(model)
+            stats.observe(summary, config=self._config.name, model=model)
+        except Exception as e:
+            logging.warning(f"Failed to record the streaming metrics: {e}")
+            return
+        summary["step"] = step
+        if chunk_data is not None and chunk_data.publish_cadence is not None:
+            summary.update(chunk_data.publish_cadence.step_summary())
+            span.set_attribute('publish_interval_ms', summary["publish-interval-ms"])
+        stream_stats.append(summary)
+        span.set_attribute('ttft_ms', summary["ttft-ms"])
+        span.set_attribute('output_tokens', summary["output-tokens"])
+        span.set_attribute('tokens_per_sec', summary["tokens-per-sec"])
+
+    def _record_step_usage(self, step:int, result:ChatCompletion|openai.Stream, stats:StreamStats, messages:list[dict], model:str, usage:TokenUsage, usage_tracker:UsageTracker):
+        """
+        Add the tokens used by a step to the usage of the response (+ the request's usage tracker)
+        
+        If the model didn't report its usage (eg. a stream on an API version that doesn't support `stream_options`), then the tokens are counted locally
+        """
+        step_usage = self._measure_usage(result, stats, messages, model)
+        if step_usage is None: return
+        usage.add(step_usage, f"step-{step}")
+        usage_tracker.record(self._config.name, step_usage)
+
+    def _measure_usage(self, result:ChatCompletion|openai.Stream, stats:StreamStats, messages:list[dict], model:str) -> TokenUsage:
+        """
+        Returns the tokens used by a call to the model (counting them locally if the model didn't report them), or None if they couldn't be measured
+        """
+        try:
+            reported = stats.usage if stats is not None else getattr(result, 'usage', None)
+            if reported is not None:
+                usage = TokenUsage(reported.prompt_tokens or 0, reported.completion_tokens or 0, 1)
+            else:
+                counter = get_token_counter(model)
+                if stats is not None:
+                    completion_tokens = stats.output_tokens(model)
+                else:
+                    completion_tokens = sum(counter.count(choice.message.content or "") for choice in result.choices if choice.message is not None)
+                usage = TokenUsage(counter.count_messages(messages), completion_tokens, 1, estimated=True)
+            usage.cost = self._token_cost(usage.prompt_tokens, usage.completion_tokens)
+            return usage
+        except Exception as e:
+            logging.warning(f"Failed to record the token usage: {e}")
+            return None
+
 
     def _process_choices(self, result, response:ChatResponse, context:ChatContext, chunk_data:ChunkData = None) -> bool:
         ### Process the Choices from the AI Model
@@ -273,8 +525,8 @@ class CompletionsProxy(AbstractProxy):
         ## Process the streaming choice response from the AI
         more_steps = True
 
-        if chunk_data.accumulated_delta is None or len(chunk_data.accumulated_delta) == 0:
-            context.push_stream_update("Writing a response", PROGRESS_UPDATE_MESSAGE)
+        if chunk_data.accumulated_delta_length == 0:
+            context.push_stream_update("Writing a response", PROGRESS_UPDATE_MESSAGE, block=False)
 
         if choice.finish_reason is not None:
             more_steps = self.__process_finished_stream_chunk(choice, response, context, chunk_data)
@@ -294,7 +546,7 @@ class CompletionsProxy(AbstractProxy):
 
         ## If the content was updated by this delta, then publish the interim result
         if content_updated:
-            self._publish_interim_result()
+            self._publish_interim_result(chunk_data, context)
 
         ## If it's the end of the turn, then we're done, publish any remaining updates, add the message to the history and return
         if end_turn: 
@@ -399,19 +651,56 @@ class CompletionsProxy(AbstractProxy):
         return more_steps
     
     def __process_tool_calls(self, tool_calls:list[ChatCompletionMessageToolCall], context:ChatContext):
-        for tool in tool_calls:
-            if tool.function is not None:
-                result = self._invoke_function_tool(tool.function.name, tool.function.arguments, context=context)
-                context.add_message_to_history(ChatMessage(message=result, role='tool', tool_call_id = tool.id, tool_name=tool.function.name))
+        function_calls = [ tool for tool in tool_calls if tool.function is not None ]
+        max_parallel = self._config.max_parallel_tools or 1
+        parallel = max_parallel > 1 and len(function_calls) > 1
+        with context.span('tools', count=len(function_calls), parallel=parallel):
+            if parallel:
+                ## Invoke the functions in parallel, so the turn takes as long as the slowest function rather than the sum of them all
+                ## (A new executor is used for each turn, so that a function that itself calls back into this proxy can't starve the pool)
+                ## Each function runs in a copy of the current context, so that its spans are recorded as children of this one
+                with ThreadPoolExecutor(thread_name_prefix="tool-exec-", max_workers=min(max_parallel, len(function_calls))) as executor:
+                    futures = [ executor.submit(copy_context().run, self._invoke_function_tool, tool.function.name, tool.function.arguments, context) for tool in function_calls ]
+                    results = [ future.result() for future in futures ]
+            else: 
+                results = [ self._invoke_function_tool(tool.function.name, tool.function.arguments, context=context) for tool in function_calls ]
+
+        ## Add the results to the history in the same order as the tool calls were requested
+        for tool, result in zip(function_calls, results):
+            context.add_message_to_history(ChatMessage(message=result, role='tool', tool_call_id = tool.id, tool_name=tool.function.name))
 
     def _publish_interim_result(self, chunk_data:ChunkData, context:ChatContext, force_publish:bool = False, publish_frequency:float = 0): 
-        if publish_frequency <= 0: 
-            publish_frequency = self._config.interim_result_publish_frequency_secs if self._config.interim_result_publish_frequency_secs > 0 else 0.032
-        if force_publish or time() - chunk_data.last_stream_publish > publish_frequency:
-            if chunk_data.accumulated_delta is not None and len(chunk_data.accumulated_delta) > 0: ## Only publish if there is actually something to publish
-                context.push_stream_update({ "delta": chunk_data.accumulated_delta, "id": chunk_data.assigned_id }, INTERIM_RESULT_MESSAGE)
-                chunk_data.last_stream_publish = time()
-                chunk_data.accumulated_delta = None
+        """
+        Publishes the deltas accumulated since the last publish, once they're due (see `PublishCadence`), or straight away if forced (eg. at the end of the response)
+        A `publish_frequency` > 0 publishes at that fixed interval instead
+        """
+        if chunk_data.accumulated_delta_length == 0: return   ## Only publish if there is actually something to publish
+        cadence = self._get_publish_cadence(chunk_data)
+        cadence.update(getattr(context.stream_writer, 'push_rtt_secs', None))
+        if not force_publish:
+            secs_since_publish = time() - chunk_data.last_stream_publish
+            if publish_frequency > 0:
+                if secs_since_publish <= publish_frequency: return
+            elif not cadence.is_due(secs_since_publish, chunk_data.accumulated_delta_length): 
+                return
+
+        context.push_stream_update({ "delta": chunk_data.take_accumulated_delta(), "id": chunk_data.assigned_id }, INTERIM_RESULT_MESSAGE, block=False)
+        chunk_data.last_stream_publish = time()
+        cadence.published()
+
+    def _get_publish_cadence(self, chunk_data:ChunkData) -> PublishCadence:
+        ## (The cadence lives with the chunk, so it carries on adapting over the steps of the response)
+        if chunk_data.publish_cadence is None:
+            fixed_frequency = self._config.interim_result_publish_frequency_secs if self._config.interim_result_publish_frequency_secs > 0 else 0.032
+            chunk_data.publish_cadence = PublishCadence(
+                min_interval_secs=self._config.min_publish_frequency_secs,
+                max_interval_secs=self._config.max_publish_frequency_secs,
+                min_batch_chars=self._config.min_publish_batch_chars,
+                max_batch_chars=self._config.max_publish_batch_chars,
+                initial_interval_secs=fixed_frequency,     ## (Until the stream's round trip has been measured)
+                adaptive=self._config.adaptive_publishing,
+            )
+        return chunk_data.publish_cadence
 
 
     def __load_oai_data_source_config(self):
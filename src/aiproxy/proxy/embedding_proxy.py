@@ -1,18 +1,135 @@
 import os
+import base64
+from hashlib import sha256
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Lock, BoundedSemaphore
+
+import numpy as np
 
 from aiproxy.data.chat_config import ChatConfig
 from aiproxy.data.chat_response import ChatResponse
+from aiproxy.utils.tokens import get_token_counter
 
 from .abstract_proxy import AbstractProxy
 
 DEFAULT_EMBEDDING_MODEL = os.getenv("DEFAULT_EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))                  ## The API accepts at most 2048 inputs per request
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 250000))   ## The API accepts at most 300K tokens (across all the inputs) per request
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000))
+EMBEDDING_MAX_PARALLEL_REQUESTS = max(1, int(os.getenv("EMBEDDING_MAX_PARALLEL_REQUESTS", 4)))
+
+## Limits the batch requests in flight at once (across all the proxies), it's only held for the request itself, so it can't deadlock a batch that's embedded from a worker thread
+_EMBEDDING_REQUEST_SLOTS = BoundedSemaphore(EMBEDDING_MAX_PARALLEL_REQUESTS)
+_EMBEDDING_CACHE:OrderedDict[tuple[str,str,str], np.ndarray] = OrderedDict()
+_EMBEDDING_CACHE_LOCK = Lock()
 
 class EmbeddingProxy(AbstractProxy):
     def __init__(self, config:ChatConfig|str) -> None:
         super().__init__(config or 'default-embedding')
-        self._model = config.oai_model or DEFAULT_EMBEDDING_MODEL
-        
+        self._model = self._config.oai_model or DEFAULT_EMBEDDING_MODEL
+        self._batch_size = min(int(self._config.get('embedding-batch-size', EMBEDDING_BATCH_SIZE)), 2048)
+        self._batch_max_tokens = int(self._config.get('embedding-batch-max-tokens', EMBEDDING_BATCH_MAX_TOKENS))
+
     def get_embeddings(self, message:str, override_model:str = None) -> list[float]:
         use_model = override_model or self._model
-        result = self._client.embeddings.create(input=message, model=use_model, encoding_format='float')
-        return result.data[0].embedding
\ No newline at end of file
+        cache_key = self._cache_key(message, use_model)
+        embedding = _get_cached_embedding(cache_key)
+        if embedding is None:
+            embedding = self._embed([message], use_model)[0]
+            _cache_embedding(cache_key, embedding)
+        return embedding.tolist()
+
+    def get_embeddings_batch(self, texts:list[str], override_model:str = None) -> np.ndarray:
+        """
+        Embed a list of texts, returning a (float32) matrix with one row per text (in the same order as the texts)
+
+        Texts that have been embedded recently are taken from the cache, the rest are split into batches (within the API limits) that are embedded in parallel
+        """
+        use_model = override_model or self._model
+        if texts is None or len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        ## Find the (unique) texts that aren't already in the cache
+        keys = [ self._cache_key(text, use_model) for text in texts ]
+        embeddings:dict[tuple[str,str,str], np.ndarray] = {}
+        to_embed:dict[tuple[str,str,str], str] = {}
+        for key, text in zip(keys, texts):
+            if key in embeddings or key in to_embed: continue
+            embedding = _get_cached_embedding(key)
+            if embedding is not None:
+                embeddings[key] = embedding
+            else:
+                to_embed[key] = text
+
+        ## Embed the rest, in parallel batches
+        if len(to_embed) > 0:
+            batches = self._build_batches(list(to_embed.items()), use_model)
+            if len(batches) == 1:
+                results = [ self._embed([ text for _, text in batches[0] ], use_model) ]
+            else:
+                ## (A new executor is used for each call, rather than a shared pool, so a batch embedded from a thread of a pool can't wait on that pool's own workers)
+                with ThreadPoolExecutor(thread_name_prefix="embedding-", max_workers=min(EMBEDDING_MAX_PARALLEL_REQUESTS, len(batches))) as executor:
+                    futures = [ executor.submit(copy_context().run, self._embed_limited, [ text for _, text in batch ], use_model) for batch in batches ]
+                    results = [ future.result() for future in futures ]
+            for batch, result in zip(batches, results):
+                for (key, _), embedding in zip(batch, result):
+                    embeddings[key] = embedding
+                    _cache_embedding(key, embedding)
+
+        return np.stack([ embeddings[key] for key in keys ])
+
+    def _cache_key(self, text:str, model:str) -> tuple[str,str,str]:
+        ## (The endpoint is part of the key, as the same deployment name can be a different model on each resource)
+        return (self._build_base_url(False), model, sha256(text.encode()).hexdigest())
+
+    def _build_batches(self, items:list[tuple[tuple[str,str,str], str]], model:str) -> list[list[tuple[tuple[str,str,str], str]]]:
+        ## Split the texts into batches that are within the API limits on the number of inputs + the total tokens per request
+        counter = get_token_counter(model)
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for item in items:
+            tokens = counter.count(item[1])
+            if len(batch) > 0 and (len(batch) >= self._batch_size or batch_tokens + tokens > self._batch_max_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def _embed_limited(self, texts:list[str], model:str) -> list[np.ndarray]:
+        with _EMBEDDING_REQUEST_SLOTS:
+            return self._embed(texts, model)
+
+    def _embed(self, texts:list[str], model:str) -> list[np.ndarray]:
+        ## Ask for the embeddings as base64, which is far smaller (+ quicker to decode) than a JSON list of floats
+        result = self._client.embeddings.create(input=texts, model=model, encoding_format='base64')
+        embeddings = [ None ] * len(texts)
+        for item in result.data:
+            embedding = item.embedding
+            if type(embedding) is str:
+                embeddings[item.index] = np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+            else:
+                embeddings[item.index] = np.asarray(embedding, dtype=np.float32)
+        return embeddings
+
+
+def _get_cached_embedding(key:tuple[str,str,str]) -> np.ndarray:
+    with _EMBEDDING_CACHE_LOCK:
+        embedding = _EMBEDDING_CACHE.get(key)
+        if embedding is not None:
+            _EMBEDDING_CACHE.move_to_end(key)
+        return embedding
+
+def _cache_embedding(key:tuple[str,str,str], embedding:np.ndarray):
+    if EMBEDDING_CACHE_MAX_ENTRIES <= 0: return
+    with _EMBEDDING_CACHE_LOCK:
+        _EMBEDDING_CACHE[key] = embedding
+        _EMBEDDING_CACHE.move_to_end(key)
+        while len(_EMBEDDING_CACHE) > EMBEDDING_CACHE_MAX_ENTRIES:
+            _EMBEDDING_CACHE.popitem(last=False)
@@ -1,13 +1,127 @@
+import os
+import asyncio
+from hashlib import sha256
+from threading import Lock
+from typing import Callable
+from weakref import WeakKeyDictionary
+
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
 from .abstract_proxy import AbstractProxy
 from aiproxy.data import ChatConfig
 
+HTTP_MAX_CONNECTIONS = int(os.environ.get('AI_HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('AI_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+HTTP_KEEPALIVE_EXPIRY_SECS = float(os.environ.get('AI_HTTP_KEEPALIVE_EXPIRY_SECS', 30))
+
+AZURE_COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
 class ProxyRegistry:
     _proxies:dict[str, AbstractProxy]
     _defaults:dict[type, AbstractProxy]
+    _clients:dict[tuple, AzureOpenAI]
+    _async_clients:WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, AsyncAzureOpenAI]]
+    _clients_lock:Lock
 
     def __init__(self):
         self._proxies = {}
         self._defaults = {}
+        self._clients = {}
+        self._async_clients = WeakKeyDictionary()
+        self._clients_lock = Lock()
+        self._default_token_provider = None
+
+    def get_client(self, endpoint:str, api_version:str, api_key:str, config:ChatConfig = None, use_async:bool = False, azure_ad_token_provider:Callable[[], str] = None) -> AzureOpenAI|AsyncAzureOpenAI:
+        """
+        Get the (shared) Azure OpenAI client for the endpoint, api version and credential, creating it if needed
+
+        All the proxies that talk to the same Azure OpenAI resource (with the same connection pool limits) share the one client, and so share its pool of warm (keep-alive) connections.
+        The pool limits are taken from the config (falling back to the AI_HTTP_* environment variables).
+
+        Without an api key, the client authenticates with Entra ID (Azure AD) using the `azure_ad_token_provider` if one is given. Otherwise the key in the AZURE_OPENAI_API_KEY
+        environment variable (the one the openai library reads by default) is used if it's set, falling back to a token provider for the `DefaultAzureCredential`.
+
+        An async client is bound to the event loop it's used on, so an async client is shared by the proxies running on the same event loop, and must be requested from within that loop.
+        """
+        limits = _pool_limits(config)
+        if api_key is None and azure_ad_token_provider is None:
+            api_key = os.environ.get('AZURE_OPENAI_API_KEY') or None
+        if api_key is not None:
+            credential_key = sha256(api_key.encode()).hexdigest()
+        elif azure_ad_token_provider is not None:
+            credential_key = ('token-provider', id(azure_ad_token_provider))
+        else:
+            credential_key = 'default-credential'
+        key = (endpoint, api_version, credential_key, limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry)
+
+        if use_async:
+            loop = asyncio.get_running_loop()     ## (Raises a RuntimeError if called outside of an event loop)
+            clients = self._async_clients.get(loop)
+            client = clients.get(key) if clients is not None else None
+        else:
+            clients = self._clients
+            client = clients.get(key)
+        if client is not None: return client
+
+        with self._clients_lock:
+            if use_async:
+                clients = self._async_clients.get(loop)
+                if clients is None:
+                    ## (The clients of a loop keep it alive, so drop those of the loops that have been closed, eg. by `asyncio.run` returning)
+                    for closed_loop in [ other for other in self._async_clients if other.is_closed() ]:
+                        del self._async_clients[closed_loop]
+                    clients = self._async_clients[loop] = {}
+            client = clients.get(key)
+            if client is None:
+                if api_key is None and azure_ad_token_provider is None:
+                    azure_ad_token_provider = self._get_default_token_provider()
+                credential = { 'api_key': api_key } if api_key is not None else { 'azure_ad_token_provider': azure_ad_token_provider }
+
+                ## Use the same timeout as the openai library would by default (the per-request timeout is set when calling the model)
+                timeout = httpx.Timeout(timeout=600.0, connect=5.0)
+                if use_async:
+                    client = AsyncAzureOpenAI(azure_endpoint=endpoint, api_version=api_version, http_client=httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True), **credential)
+                else:
+                    client = AzureOpenAI(azure_endpoint=endpoint, api_version=api_version, http_client=httpx.Client(limits=limits, timeout=timeout, follow_redirects=True), **credential)
+                clients[key] = client
+        return client
+
+    def close_clients(self):
+        """
+        Close the shared (sync) clients and their connection pools
+
+        Any async clients are just released, as they must be closed from their event loop (use `aclose_clients` from each loop to close their connection pools too)
+        """
+        with self._clients_lock:
+            clients = self._clients
+            self._clients = {}
+            self._async_clients = WeakKeyDictionary()
+        for client in clients.values():
+            try:
+                client.close()
+            except:
+                pass
+
+    async def aclose_clients(self):
+        """
+        Close the shared async clients of the running event loop, and their connection pools (call before the loop is closed, eg. at the end of the coroutine passed to `asyncio.run`)
+        """
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            clients = self._async_clients.pop(loop, None)
+        for client in (clients or {}).values():
+            try:
+                await client.close()
+            except:
+                pass
+
+    def _get_default_token_provider(self) -> Callable[[], str]:
+        ## NB. Must be called with the clients lock held
+        if self._default_token_provider is None:
+            from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+            self._default_token_provider = get_bearer_token_provider(DefaultAzureCredential(), AZURE_COGNITIVE_SERVICES_SCOPE)
+        return self._default_token_provider
 
     def add_proxy(self, name:str, proxy:AbstractProxy, make_default:bool = True):
         self._proxies[name] = proxy
@@ -77,4 +191,12 @@ class ProxyRegistry:
             return name_or_type in self._defaults
         return name_or_type in self._proxies
     
+def _pool_limits(config:ChatConfig = None) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(config.get('http-max-connections', HTTP_MAX_CONNECTIONS)) if config is not None else HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=int(config.get('http-max-keepalive-connections', HTTP_MAX_KEEPALIVE_CONNECTIONS)) if config is not None else HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=float(config.get('http-keepalive-expiry-secs', HTTP_KEEPALIVE_EXPIRY_SECS)) if config is not None else HTTP_KEEPALIVE_EXPIRY_SECS
+    )
+
+
 GLOBAL_PROXIES_REGISTRY = ProxyRegistry()
\ No newline at end of file
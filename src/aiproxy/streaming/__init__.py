@@ -1,17 +1,31 @@
 import os
 from typing import Callable
-from concurrent.futures import ThreadPoolExecutor
 
 from ..interfaces.abstract_streamer import StreamWriter, SimpleStreamMessage, INTERIM_RESULT_MESSAGE, PROGRESS_UPDATE_MESSAGE, ERROR_MESSAGE, INFO_MESSAGE
 from .pubsub_streamer import PubsubStreamWriter
 from .botframework_streamer import BotframeworkStreamWriter
 from .http_post_streamer import HttpPostStreamWriter
 from .function_streamer import FunctionStreamWriter
+from .queue_streamer import QueueStreamWriter, sse_frame
+from .broadcast_hub import BroadcastHub, HubStreamWriter, GLOBAL_BROADCAST_HUB, serve_websockets
+from .stream_dispatcher import StreamDispatcher
+from .publish_cadence import PublishCadence
 
-__GLOBAL_STREAM_EXECUTOR:ThreadPoolExecutor = ThreadPoolExecutor(thread_name_prefix="streaming-", max_workers=int(os.environ.get('STREAMING_MAX_WORKERS', 4)))
+__GLOBAL_STREAM_DISPATCHER:StreamDispatcher = StreamDispatcher(
+    max_workers=int(os.environ.get('STREAMING_MAX_WORKERS', 4)),
+    max_queue_size=int(os.environ.get('STREAMING_MAX_QUEUE_SIZE', 1000)),
+    max_batch_size=int(os.environ.get('STREAMING_MAX_BATCH_SIZE', 50)),
+    put_timeout_secs=float(os.environ.get('STREAMING_QUEUE_TIMEOUT_SECS', 5)),
+)
+
+def get_stream_dispatcher() -> StreamDispatcher:
+    """
+    Returns the dispatcher that delivers the messages of the streams created by `stream_factory` (eg. for its `stats()`)
+    """
+    return __GLOBAL_STREAM_DISPATCHER
 
 def stream_factory(stream_type:str, stream_id:str = None, stream_config:str = None, message_filter:Callable[[dict|str], bool] = None, **kwargs) -> StreamWriter:
-    global __GLOBAL_STREAM_EXECUTOR
+    global __GLOBAL_STREAM_DISPATCHER
     streamer = None
     if stream_type == "pubsub" or stream_type == "azure" or stream_type == "webpubsub":
         streamer = PubsubStreamWriter(stream_id, stream_config, message_filter, **kwargs)
@@ -19,10 +33,14 @@ def stream_factory(stream_type:str, stream_id:str = None, stream_config:str = No
         streamer = BotframeworkStreamWriter(stream_id, stream_config, message_filter, **kwargs)
     elif stream_type == "http" or stream_type == "https" or stream_type == "webhook" or stream_type == "web" or stream_type == "post":
         streamer = HttpPostStreamWriter(stream_id, stream_config, message_filter, **kwargs)
+    elif stream_type == "queue" or stream_type == "sse" or stream_type == "local":
+        streamer = QueueStreamWriter(stream_id, stream_config, message_filter, **kwargs)
+    elif stream_type == "hub" or stream_type == "websocket" or stream_type == "ws" or stream_type == "broadcast":
+        streamer = HubStreamWriter(stream_id, stream_config, message_filter, **kwargs)
     elif stream_type == "function" or stream_type == "func" or stream_type == "lambda":
         streamer = FunctionStreamWriter(stream_id, stream_config, message_filter, **kwargs)
     else:
         raise ValueError(f"Unknown stream type: {stream_type}")
     
-    streamer.set_executor(__GLOBAL_STREAM_EXECUTOR)
+    streamer.set_dispatcher(__GLOBAL_STREAM_DISPATCHER)
     return streamer
\ No newline at end of file
@@ -1,5 +1,5 @@
 from uuid import uuid4
-from requests import post
+from requests import Session
 from typing import Callable
 
 from azure.core.credentials import AzureKeyCredential
@@ -11,6 +11,8 @@ from ..interfaces.abstract_streamer import StreamWriter
 class BotframeworkStreamWriter(StreamWriter):
     _convo_endpoint:str
     _headers:dict[str, str]
+    _timeout_secs:float = 10
+    _session:Session = None
 
     def __init__(self, stream_id:str = None, config_name:str = None, message_filter:Callable[[dict|str], bool] = None) -> None:
         super().__init__(stream_id, message_filter)
@@ -34,8 +36,11 @@ class BotframeworkStreamWriter(StreamWriter):
         if self._stream_id is None:
             raise ValueError("The Stream ID is not set - Please provide the conversation id (stream_id) when initialising this class, or set the 'stream-id' in the config or the environment variable: BOT_CONVERSATION_ID")
         self._convo_endpoint = f"{endpoint}/conversations/{stream_id}/activities"
+        ## How long to wait for the Bot Framework to respond to each activity (so a hung connection can't tie up the thread delivering the stream's messages)
+        self._timeout_secs = float(config.get('timeout-secs') or os.environ.get('BOT_TIMEOUT_SECS', 10))
+        self._session = Session()   ## (Re-uses the connection for all the activities posted to the conversation)
 
 
     def _push_message(self, message:dict|str, content_type:str = "application/json"):
-        resp = post(self._convo_endpoint, headers=self._headers, json=message)
+        resp = self._session.post(self._convo_endpoint, headers=self._headers, json=message, timeout=self._timeout_secs)
         return resp.status_code >= 200 and resp.status_code < 300
\ No newline at end of file
@@ -0,0 +1,225 @@
+import os
+import json
+import asyncio
+from collections import deque
+from threading import Lock
+from time import monotonic
+from typing import Awaitable, Callable
+
+from ..interfaces.abstract_streamer import StreamWriter
+from .queue_streamer import QueueStreamWriter
+from .stream_dispatcher import _merge_interim
+
+BROADCAST_REPLAY_MESSAGES = int(os.environ.get('BROADCAST_REPLAY_MESSAGES', 100))
+BROADCAST_REPLAY_TTL_SECS = float(os.environ.get('BROADCAST_REPLAY_TTL_SECS', 60))
+
+class _Subscription:
+    __slots__ = ('stream_id', 'buffer')
+
+    def __init__(self, stream_id:str, buffer:QueueStreamWriter):
+        self.stream_id = stream_id
+        self.buffer = buffer
+
+
+class _Replay:
+    ## The latest messages published to a stream (with the interim deltas coalesced), which are sent to a connection when it subscribes + whether the stream has been closed
+    __slots__ = ('messages', 'closed', 'updated_at')
+
+    def __init__(self, max_messages:int):
+        self.messages:deque[dict|str] = deque(maxlen=max_messages)
+        self.closed = False
+        self.updated_at = monotonic()
+
+    def add(self, message:dict|str):
+        merged = _merge_interim(self.messages[-1], message) if len(self.messages) > 0 else None
+        if merged is not None:
+            self.messages[-1] = merged
+        else:
+            self.messages.append(message)
+        self.updated_at = monotonic()
+
+
+class BroadcastHub:
+    """
+    Fans the messages of each stream out to the connections subscribed to it (eg. WebSockets), within this process, so streaming doesn't need an external service like Web PubSub
+
+    Each stream id is a group that any number of connections can subscribe to, and every connection has its own bounded buffer (coalescing the interim deltas
+    while they wait to be sent), so a slow connection only falls behind itself, rather than holding up the stream or the other subscribers.
+
+    The hub is transport agnostic: a connection is served by awaiting `serve(stream_id, send)` with a coroutine function that sends a text frame, eg. in a
+    Starlette / FastAPI WebSocket endpoint:
+
+        await websocket.accept()
+        await GLOBAL_BROADCAST_HUB.serve(stream_id, websocket.send_text)
+
+    or `serve_websockets()` runs a stand-alone WebSocket server (using the `websockets` package) where clients connect to `ws://host:port/{stream_id}`
+
+    The latest `replay_messages` of each stream are kept (for `replay_ttl_secs` after its last message), and sent to a connection when it subscribes, so a client
+    that connects after the response has started (or even finished) doesn't miss its start. A stream's connections end once it's closed (see `close_stream`,
+    or `HubStreamWriter.close`), and a connection that subscribes to a stream that has already been closed is sent the replayed messages and then ends
+    (until a message is published to the stream again, which starts a new replay).
+    """
+    def __init__(self, max_messages_per_connection:int = None, replay_messages:int = None, replay_ttl_secs:float = None):
+        self._max_messages = max_messages_per_connection
+        self._replay_messages = replay_messages if replay_messages is not None else BROADCAST_REPLAY_MESSAGES
+        self._replay_ttl_secs = replay_ttl_secs if replay_ttl_secs is not None else BROADCAST_REPLAY_TTL_SECS
+        self._groups:dict[str, set[_Subscription]] = {}
+        self._replays:dict[str, _Replay] = {}
+        self._last_expiry = monotonic()
+        self._lock = Lock()
+        self.published = 0
+        self._closed_coalesced = 0      ## (The counts of the connections that have ended)
+        self._closed_dropped = 0
+
+    def publish(self, stream_id:str, message:dict|str):
+        """
+        Queues the message to be sent to every connection subscribed to the stream (without waiting for it to be sent, so it can be called from any thread)
+        """
+        if hasattr(message, 'to_dict'): message = message.to_dict()
+        with self._lock:
+            self.published += 1
+            ## (A connection that subscribes from here on is sent the message in the replay, rather than by the loop below)
+            replay = self._replay(stream_id)
+            if replay is not None:
+                if replay.closed:
+                    ## (A message published after the stream was closed starts the next response on it, eg. the next turn of the conversation)
+                    replay.messages.clear()
+                    replay.closed = False
+                replay.add(message)
+            ## (Pushed with the lock held too, so messages published from several threads reach each connection in the order the replay has them,
+            ##  pushing only adds the message to the connection's buffer, so it's cheap)
+            for subscription in self._groups.get(stream_id, ()):
+                subscription.buffer.push_message(message)
+
+    async def serve(self, stream_id:str, send:Callable[[str], Awaitable], encode:Callable[[dict|str], str] = None):
+        """
+        Subscribes a connection to the stream, sending it the stream's messages until the stream is closed (see `close_stream`) or sending fails (eg. the connection was closed)
+        """
+        encode = encode or _encode
+        subscription = _Subscription(stream_id, QueueStreamWriter(stream_id, max_messages=self._max_messages))
+        with self._lock:
+            ## Start the connection with the messages already published to the stream (with the lock held, so none are missed or sent twice)
+            replay = self._replays.get(stream_id)
+            for message in (replay.messages if replay is not None else ()):
+                subscription.buffer.push_message(message)
+            if replay is not None and replay.closed:
+                subscription.buffer.close()
+            else:
+                self._groups.setdefault(stream_id, set()).add(subscription)
+        try:
+            async for message in subscription.buffer.messages():
+                await send(encode(message))
+        finally:
+            self._unsubscribe(subscription)
+
+    def close_stream(self, stream_id:str):
+        """
+        Ends the connections subscribed to the stream (once they've been sent the messages already published to it)
+        """
+        with self._lock:
+            subscriptions = self._groups.pop(stream_id, ())
+            replay = self._replay(stream_id)
+            if replay is not None:
+                replay.closed = True
+                replay.updated_at = monotonic()
+            for subscription in subscriptions:
+                subscription.buffer.close()
+
+    def subscriber_count(self, stream_id:str) -> int:
+        with self._lock:
+            return len(self._groups.get(stream_id, ()))
+
+    def stats(self) -> dict[str,any]:
+        with self._lock:
+            subscriptions = [ subscription for group in self._groups.values() for subscription in group ]
+            return {
+                'streams': len(self._groups),
+                'replayed-streams': len(self._replays),
+                'connections': len(subscriptions),
+                'published': self.published,
+                'coalesced': self._closed_coalesced + sum(subscription.buffer.coalesced for subscription in subscriptions),
+                'dropped': self._closed_dropped + sum(subscription.buffer.dropped for subscription in subscriptions),
+            }
+
+    def _replay(self, stream_id:str) -> _Replay:
+        ## Returns the stream's replay (creating it if needed, or None if replays are disabled), expiring the replays of the streams that have gone quiet
+        ## NB. Must be called with the lock held
+        if self._replay_messages <= 0: return None
+        now = monotonic()
+        if now - self._last_expiry >= min(self._replay_ttl_secs, 1):
+            self._last_expiry = now
+            for expired_id in [ key for key, replay in self._replays.items() if now - replay.updated_at > self._replay_ttl_secs ]:
+                del self._replays[expired_id]
+        replay = self._replays.get(stream_id)
+        if replay is None:
+            replay = self._replays[stream_id] = _Replay(self._replay_messages)
+        return replay
+
+    def _unsubscribe(self, subscription:_Subscription):
+        with self._lock:
+            group = self._groups.get(subscription.stream_id)
+            if group is not None:
+                group.discard(subscription)
+                if len(group) == 0: del self._groups[subscription.stream_id]
+            self._closed_coalesced += subscription.buffer.coalesced
+            self._closed_dropped += subscription.buffer.dropped
+        subscription.buffer.close()
+
+
+async def serve_websockets(hub:BroadcastHub = None, host:str = "0.0.0.0", port:int = 8765):
+    """
+    Runs a WebSocket server where each client connects to `ws://host:port/{stream_id}` to receive the messages of that stream (runs until cancelled)
+
+    Requires the `websockets` package
+    """
+    try:
+        import websockets
+    except ImportError:
+        raise ImportError("The WebSocket server requires the 'websockets' package to be installed")
+    hub = hub or GLOBAL_BROADCAST_HUB
+
+    async def handler(websocket, path:str = None):
+        ## (The path is passed to the handler by older versions of the package, and is on the request in newer versions)
+        if path is None: path = websocket.request.path if hasattr(websocket, 'request') else websocket.path
+        stream_id = path.strip("/").split("?")[0]
+        if len(stream_id) == 0:
+            await websocket.close(code=1008, reason="No stream id")
+            return
+        try:
+            await hub.serve(stream_id, websocket.send)
+        except websockets.ConnectionClosed:
+            pass
+
+    async with websockets.serve(handler, host, port):
+        await asyncio.Future()
+
+
+class HubStreamWriter(StreamWriter):
+    """
+    Publishes the stream's messages to the connections subscribed to it in a `BroadcastHub` (by default, the process-wide `GLOBAL_BROADCAST_HUB`)
+
+    Call `close` once the response has been streamed, to end the connections subscribed to the stream
+    """
+    _hub:BroadcastHub
+    _push_blocks:bool = False
+
+    def __init__(self, stream_id:str = None, config_name:str = None, message_filter:Callable[[dict|str], bool] = None, hub:BroadcastHub = None) -> None:
+        super().__init__(stream_id, message_filter)
+        self._hub = hub or GLOBAL_BROADCAST_HUB
+        self._async = False     ## (Publishing only adds the message to each connection's buffer, so it doesn't need to be done in the background)
+
+    def close(self):
+        """
+        Ends the stream's connections (once they've been sent the messages already published to it)
+        """
+        self._hub.close_stream(self._stream_id)
+
+    def _push_message(self, message:dict|str, content_type:str = "application/json"):
+        self._hub.publish(self._stream_id, message)
+
+
+def _encode(message:dict|str) -> str:
+    return json.dumps(message) if type(message) is dict else str(message)
+
+
+GLOBAL_BROADCAST_HUB = BroadcastHub()
@@ -1,5 +1,5 @@
 from uuid import uuid4
-from requests import post
+from requests import Session
 from typing import Callable
 
 from azure.core.credentials import AzureKeyCredential
@@ -12,6 +12,9 @@ class HttpPostStreamWriter(StreamWriter):
     _post_url:str
     _headers:dict[str, str]
     _add_stream_to_body:bool = False
+    _batch_messages:bool = False
+    _timeout_secs:float = 10
+    _session:Session = None
 
     def __init__(self, stream_id:str = None, config_name:str = None, message_filter:Callable[[dict|str], bool] = None) -> None:
         super().__init__(stream_id, message_filter)
@@ -38,19 +41,34 @@ class HttpPostStreamWriter(StreamWriter):
         self._headers = headers
         
         self._add_stream_to_body = config.get('add-stream-id-to-body') or os.environ.get('POST_STREAM_ADD_ID_TO_BODY', 'false').lower() == 'true'
+        ## Whether the endpoint accepts an array of messages, in which case the messages waiting to be delivered are posted together
+        self._batch_messages = str(config.get('batch-messages') or os.environ.get('POST_STREAM_BATCH_MESSAGES', 'false')).lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+        ## How long to wait for the endpoint to respond to each post (so an endpoint that hangs can't tie up the thread delivering the stream's messages)
+        self._timeout_secs = float(config.get('timeout-secs') or os.environ.get('POST_STREAM_TIMEOUT_SECS', 10))
+        self._session = Session()   ## (Re-uses the connection for all the posts to the stream)
 
 
     def _push_message(self, message:dict|str, content_type:str = "application/json"):
+        return self._post(self._with_stream_id(message), content_type)
+
+    def _push_messages(self, messages:list[dict|str], content_type:str = "application/json"):
+        if not self._batch_messages or len(messages) == 1:
+            return super()._push_messages(messages, content_type)
+        return self._post([ self._with_stream_id(message) for message in messages ], content_type)
+
+    def _with_stream_id(self, message:dict|str) -> dict|str:
         if self._add_stream_to_body:
             if type(message) is str:
                 message = {"message": message, "stream-id": self._stream_id}
             else:
                 message["stream-id"] = self._stream_id
+        return message
 
+    def _post(self, body:dict|str|list, content_type:str) -> bool:
         headers = self._headers
         if 'content-type' in self._headers and self._headers['content-type'] != content_type:
             headers = self._headers.copy()
             headers['content-type'] = content_type
 
-        resp = post(self._post_url, headers=headers, json=message)
+        resp = self._session.post(self._post_url, headers=headers, json=body, timeout=self._timeout_secs)
         return resp.status_code >= 200 and resp.status_code < 300
\ No newline at end of file
@@ -0,0 +1,63 @@
+class PublishCadence:
+    """
+    Decides when the accumulated interim deltas of a streamed response are published, adapting to how quickly the stream's sink takes the messages
+
+    The interval between publishes follows the (smoothed) round trip of a push to the stream's writer (see `StreamWriter.push_rtt_secs`), so a fast sink
+    (eg. an in-process queue) is published to as often as the minimum interval allows, while a slow one (eg. an HTTP endpoint) is published to less often,
+    in bigger batches, rather than the messages backing up behind it. Both the interval + the batch size (the characters to accumulate before publishing)
+    stay within the configured bounds, and a delta is never held back for longer than the maximum interval.
+
+    If it isn't adaptive, the deltas are published every `initial_interval_secs` (whatever their size)
+    """
+    RTT_MULTIPLIER = 2      ## Publish at most every 2 round trips, so the sink has (about) finished with one push before the next one arrives
+
+    def __init__(self, min_interval_secs:float = 0.016, max_interval_secs:float = 0.5, min_batch_chars:int = 1, max_batch_chars:int = 256, initial_interval_secs:float = None, adaptive:bool = True):
+        self.min_interval_secs = max(0, min_interval_secs)
+        self.max_interval_secs = max(self.min_interval_secs, max_interval_secs)
+        self.min_batch_chars = max(1, min_batch_chars)
+        self.max_batch_chars = max(self.min_batch_chars, max_batch_chars)
+        self.adaptive = adaptive
+        self.interval_secs = self._clamp(initial_interval_secs if initial_interval_secs is not None else self.min_interval_secs) if adaptive else (initial_interval_secs or 0)
+        self.batch_chars = self.min_batch_chars if adaptive else 1
+        self.rtt_secs:float = None
+        self.publishes = 0
+
+    def update(self, rtt_secs:float):
+        """
+        Adapts the interval + batch size to the latest push round trip of the stream (does nothing if it isn't adaptive, or there isn't a round trip yet)
+        """
+        if not self.adaptive or rtt_secs is None: return
+        self.rtt_secs = rtt_secs
+        self.interval_secs = self._clamp(rtt_secs * self.RTT_MULTIPLIER)
+
+        ## The batch size grows in step with the interval, from the minimum batch (at the minimum interval) to the maximum (at the maximum interval)
+        interval_range = self.max_interval_secs - self.min_interval_secs
+        fraction = (self.interval_secs - self.min_interval_secs) / interval_range if interval_range > 0 else 0
+        self.batch_chars = self.min_batch_chars + round((self.max_batch_chars - self.min_batch_chars) * fraction)
+
+    def is_due(self, secs_since_publish:float, pending_chars:int) -> bool:
+        """
+        Whether the pending delta should be published now
+        """
+        if pending_chars <= 0 or secs_since_publish < self.interval_secs: return False
+        return pending_chars >= self.batch_chars or secs_since_publish >= self.max_interval_secs or not self.adaptive
+
+    def published(self):
+        self.publishes += 1
+
+    def step_summary(self) -> dict[str,any]:
+        """
+        The cadence at the end of a step + the number of publishes during it (resetting the count for the next step)
+        """
+        summary = {
+            "adaptive-publishing": self.adaptive,
+            "publish-interval-ms": round(self.interval_secs * 1000, 3),
+            "publish-batch-chars": self.batch_chars,
+            "push-rtt-ms": round(self.rtt_secs * 1000, 3) if self.rtt_secs is not None else None,
+            "publishes": self.publishes,
+        }
+        self.publishes = 0
+        return summary
+
+    def _clamp(self, interval_secs:float) -> float:
+        return min(self.max_interval_secs, max(self.min_interval_secs, interval_secs))
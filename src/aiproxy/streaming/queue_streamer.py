@@ -0,0 +1,163 @@
+import os
+import json
+import asyncio
+from collections import deque
+from threading import Condition
+from typing import AsyncIterator, Callable, Iterator
+
+from aiproxy.utils.config import load_named_config
+from ..interfaces.abstract_streamer import StreamWriter, PROGRESS_UPDATE_MESSAGE
+from .stream_dispatcher import _merge_interim, _message_type
+
+class QueueStreamWriter(StreamWriter):
+    """
+    Buffers the stream's messages in memory, for the web server handling the request to stream them straight to the client (eg. as Server-Sent Events)
+
+    The messages are read (from any thread, or from an asyncio event loop) by iterating over `sse_frames()` / `messages()` (async) or `iter_messages()`,
+    which end once the writer is closed, eg. with a Starlette / FastAPI app:
+
+        writer = QueueStreamWriter()
+        task = asyncio.get_running_loop().run_in_executor(None, lambda: proxy.send_message(prompt, ChatContext(stream=writer)))
+        task.add_done_callback(lambda _: writer.close())
+        return StreamingResponse(writer.sse_frames(), media_type="text/event-stream")
+
+    The buffer is a bounded ring buffer: consecutive interim deltas of the same message are coalesced while they wait to be read, and once the buffer is
+    full the oldest progress message (or if there isn't one, the oldest message) is dropped to make room, so a slow (or gone) client never holds up the proxy.
+    """
+    _max_messages:int = 1000
+    _push_blocks:bool = False
+
+    def __init__(self, stream_id:str = None, config_name:str = None, message_filter:Callable[[dict|str], bool] = None, max_messages:int = None) -> None:
+        super().__init__(stream_id, message_filter)
+        config = None
+        if config_name is not None:
+            config = load_named_config(config_name)
+        if config is None:
+            config = {}
+        self._max_messages = max(1, max_messages or config.get('max-messages') or int(os.environ.get('STREAM_QUEUE_MAX_MESSAGES', self._max_messages)))
+        self._async = False     ## (Adding to the buffer is cheap, so the messages are buffered as they're pushed, rather than by the stream dispatcher)
+        self._buffer:deque[dict|str] = deque()
+        self._cond = Condition()
+        self._waiters:set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._closed = False
+        self._next_id = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def close(self):
+        """
+        Marks the end of the stream (the iterators end once they've read the messages that were pushed before it was closed)
+        """
+        with self._cond:
+            self._closed = True
+            self._notify()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _push_message(self, message:dict|str, content_type:str = "application/json"):
+        if hasattr(message, 'to_dict'): message = message.to_dict()
+        with self._cond:
+            if self._closed: return
+            if len(self._buffer) > 0:
+                merged = _merge_interim(self._buffer[-1], message)
+                if merged is not None:
+                    self._buffer[-1] = merged
+                    self.coalesced += 1
+                    return
+
+            if len(self._buffer) >= self._max_messages:
+                self._drop_oldest()
+            self._buffer.append(message)
+            self._notify()
+
+    def _drop_oldest(self):
+        ## NB. Must be called with the lock held
+        for idx, message in enumerate(self._buffer):
+            if _message_type(message) == PROGRESS_UPDATE_MESSAGE:
+                del self._buffer[idx]
+                break
+        else:
+            self._buffer.popleft()
+        self.dropped += 1
+
+    def _notify(self):
+        ## NB. Must be called with the lock held
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass    ## (The reader's event loop has been closed)
+
+    def _take(self) -> tuple[list[dict|str], bool]:
+        ## NB. Must be called with the lock held, returns the buffered messages + whether the stream has been closed
+        messages = list(self._buffer)
+        self._buffer.clear()
+        return messages, self._closed
+
+    def iter_messages(self, timeout_secs:float = None) -> Iterator[dict|str]:
+        """
+        Yields the messages as they're pushed (blocking between them), until the writer is closed (or no message arrives within the timeout)
+        """
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self._buffer) > 0 or self._closed, timeout_secs): return
+                messages, closed = self._take()
+            for message in messages:
+                yield message
+            if closed and len(messages) == 0: return
+
+    async def messages(self, timeout_secs:float = None) -> AsyncIterator[dict|str]:
+        """
+        Yields the messages as they're pushed (without blocking the event loop), until the writer is closed (or no message arrives within the timeout)
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()   ## (Before reading the buffer, so a message pushed after reading it always wakes the wait)
+                with self._cond:
+                    messages, closed = self._take()
+                for message in messages:
+                    yield message
+                if len(messages) > 0: continue
+                if closed: return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout_secs)
+                except asyncio.TimeoutError:
+                    return
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+
+    async def sse_frames(self, heartbeat_secs:float = 15, end_event:str = "end") -> AsyncIterator[str]:
+        """
+        Yields the messages as Server-Sent Events frames (the event name is the message's type), sending a comment every `heartbeat_secs` while the stream is idle
+        (so proxies don't close the connection), and an `end_event` event once the writer is closed
+        """
+        while True:
+            async for message in self.messages(timeout_secs=heartbeat_secs):
+                yield self._to_sse_frame(message)
+            if self._closed and len(self._buffer) == 0: break
+            yield ": keep-alive\n\n"
+        if end_event is not None:
+            yield sse_frame("{}", event=end_event)
+
+    def _to_sse_frame(self, message:dict|str) -> str:
+        self._next_id += 1
+        data = json.dumps(message) if type(message) is dict else str(message)
+        return sse_frame(data, event=_message_type(message), event_id=str(self._next_id))
+
+
+def sse_frame(data:str, event:str = None, event_id:str = None) -> str:
+    """
+    Formats the data as a Server-Sent Events frame (a multi-line value is sent as multiple `data` lines, which the client joins back together)
+    """
+    lines = []
+    if event is not None: lines.append(f"event: {event}")
+    if event_id is not None: lines.append(f"id: {event_id}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,218 @@
+import logging
+from collections import deque
+from threading import Condition, Thread
+from time import perf_counter
+
+from ..interfaces.abstract_streamer import INTERIM_RESULT_MESSAGE, PROGRESS_UPDATE_MESSAGE
+from ..telemetry.metrics import GLOBAL_METRICS_REGISTRY, MetricsRegistry
+
+PUSH_LATENCY_BUCKETS = [ 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5 ]
+
+class _QueuedMessage:
+    __slots__ = ('writer', 'message', 'content_type', 'queued_at')
+
+    def __init__(self, writer, message:dict|str, content_type:str, queued_at:float):
+        self.writer = writer
+        self.message = message
+        self.content_type = content_type
+        self.queued_at = queued_at
+
+
+class StreamDispatcher:
+    """
+    Delivers the messages pushed to the stream writers in the background, in order for each stream
+
+    Each stream has its own (bounded) queue, keyed by its stream id, and a fixed pool of workers drains them. A stream is only ever drained by one worker at a time
+    (so its messages are delivered in the order they were pushed), and a worker delivers a batch from one stream before moving on to the next stream that has
+    messages waiting (so a slow sink only holds up its own stream, rather than starving the others).
+
+    * Consecutive interim deltas of the same message that are still waiting to be delivered are coalesced into a single message
+    * Once a stream's queue is full, its oldest progress message is dropped to make room (as it's stale by then), otherwise the push waits for room
+      (for up to `put_timeout_secs`, after which the message is dropped). A push that mustn't block (eg. from the thread reading the model's stream, or an event loop)
+      adds an interim delta to the newest one queued for the same message instead (so no text is lost), and drops any other message
+    * `stats()` reports the queue depth + the latency from a message being pushed to it being delivered, which are also recorded in the metrics registry
+    """
+    def __init__(self, max_workers:int = 4, max_queue_size:int = 1000, max_batch_size:int = 50, put_timeout_secs:float = 5, name:str = "streaming", registry:MetricsRegistry = None):
+        self._max_workers = max(1, max_workers)
+        self._max_queue_size = max(1, max_queue_size)
+        self._max_batch_size = max(1, max_batch_size)
+        self._put_timeout_secs = put_timeout_secs
+        self._name = name
+        self._queues:dict[str, deque[_QueuedMessage]] = {}
+        self._ready:deque[str] = deque()
+        """The streams with messages waiting, that aren't being drained by a worker"""
+        self._scheduled:set[str] = set()
+        """The streams that are either ready or being drained"""
+        self._cond = Condition()
+        self._workers:list[Thread] = []
+
+        ## Metrics
+        self.pushed = 0
+        self.delivered = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._depth = 0
+        self._latency_total_ms = 0.0
+        self._latency_max_ms = 0.0
+        registry = registry or GLOBAL_METRICS_REGISTRY
+        self._depth_gauge = registry.gauge("aiproxy_stream_queue_depth", "The number of stream messages waiting to be delivered", ["dispatcher"])
+        self._messages_counter = registry.counter("aiproxy_stream_messages_total", "The number of messages pushed to the streams, by what happened to them (delivered, coalesced or dropped)", ["dispatcher", "outcome"])
+        self._latency_histogram = registry.histogram("aiproxy_stream_push_latency_seconds", "The time from a message being pushed to a stream to it being delivered", PUSH_LATENCY_BUCKETS, ["dispatcher"])
+
+    def submit(self, writer, message:dict|str, content_type:str = "application/json", block:bool = True) -> bool:
+        """
+        Queues the message to be pushed by the writer, returns False if it was dropped (as the stream's queue stayed full)
+
+        With `block=False`, a push to a full queue never waits for room (see above)
+        """
+        key = writer._stream_id
+        item = _QueuedMessage(writer, message, content_type, perf_counter())
+        with self._cond:
+            if len(self._workers) == 0: self._start_workers()
+            self.pushed += 1
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+
+            if len(queue) > 0 and _coalesce(queue[-1], item):
+                self.coalesced += 1
+                self._messages_counter.inc(dispatcher=self._name, outcome="coalesced")
+                return True
+
+            if len(queue) >= self._max_queue_size and not self._drop_stale(queue):
+                if not block:
+                    ## (The delta is delivered along with an earlier one of the same message, so ahead of any other messages queued since, rather than being lost)
+                    if any(_coalesce(queued, item) for queued in reversed(queue)):
+                        self.coalesced += 1
+                        self._messages_counter.inc(dispatcher=self._name, outcome="coalesced")
+                        return True
+                    self.dropped += 1
+                    self._messages_counter.inc(dispatcher=self._name, outcome="dropped")
+                    logging.warning(f"The {self._name} queue of stream {key} is full, dropping a message")
+                    return False
+                ## Backpressure: wait for the stream's worker to make room
+                if not self._cond.wait_for(lambda: len(self._queues.get(key, ())) < self._max_queue_size, self._put_timeout_secs):
+                    self.dropped += 1
+                    self._messages_counter.inc(dispatcher=self._name, outcome="dropped")
+                    logging.warning(f"The {self._name} queue of stream {key} is full, dropping a message")
+                    return False
+                ## (The queue is removed once it's been drained, so it may need to be re-created)
+                queue = self._queues.get(key)
+                if queue is None:
+                    queue = self._queues[key] = deque()
+
+            queue.append(item)
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+            self._depth_gauge.set(self._depth, dispatcher=self._name)
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                self._ready.append(key)
+                self._cond.notify_all()
+            return True
+
+    def flush(self, timeout_secs:float = None) -> bool:
+        """
+        Waits until every queued message has been delivered (returns False if that took longer than the timeout)
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._scheduled) == 0, timeout_secs)
+
+    def stats(self) -> dict[str,any]:
+        with self._cond:
+            return {
+                'queued': self._depth,
+                'max-queued': self.max_depth,
+                'streams': len(self._scheduled),
+                'pushed': self.pushed,
+                'delivered': self.delivered,
+                'batches': self.batches,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'avg-latency-ms': round(self._latency_total_ms / self.delivered, 3) if self.delivered > 0 else 0,
+                'max-latency-ms': round(self._latency_max_ms, 3),
+            }
+
+    def _start_workers(self):
+        ## NB. Must be called with the lock held (the workers are started on the first push, rather than on import)
+        for idx in range(self._max_workers):
+            worker = Thread(target=self._run, name=f"{self._name}-{idx}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _drop_stale(self, queue:deque[_QueuedMessage]) -> bool:
+        ## NB. Must be called with the lock held
+        for idx, item in enumerate(queue):
+            if _message_type(item.message) == PROGRESS_UPDATE_MESSAGE:
+                del queue[idx]
+                self._depth -= 1
+                self.dropped += 1
+                self._messages_counter.inc(dispatcher=self._name, outcome="dropped")
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._ready) > 0)
+                key = self._ready.popleft()
+                queue = self._queues[key]
+                batch = [ queue.popleft() for _ in range(min(len(queue), self._max_batch_size)) ]
+                self._depth -= len(batch)
+                self._depth_gauge.set(self._depth, dispatcher=self._name)
+                self._cond.notify_all()     ## (There's room in the stream's queue again)
+
+            self._deliver(batch)
+
+            delivered_at = perf_counter()
+            latencies = [ delivered_at - item.queued_at for item in batch ]
+            self._latency_histogram.observe_many(latencies, dispatcher=self._name)
+            self._messages_counter.inc(len(batch), dispatcher=self._name, outcome="delivered")
+            with self._cond:
+                self.batches += 1
+                self.delivered += len(batch)
+                self._latency_total_ms += sum(latencies) * 1000
+                self._latency_max_ms = max(self._latency_max_ms, max(latencies) * 1000)
+
+                if len(queue) > 0:
+                    self._ready.append(key)     ## (To the back, so the other streams get a turn)
+                else:
+                    del self._queues[key]
+                    self._scheduled.discard(key)
+                self._cond.notify_all()
+
+    def _deliver(self, batch:list[_QueuedMessage]):
+        ## Push the runs of messages for the same writer (+ content type) together, so a writer that can send several messages at once can do so
+        start = 0
+        while start < len(batch):
+            end = start + 1
+            while end < len(batch) and batch[end].writer is batch[start].writer and batch[end].content_type == batch[start].content_type:
+                end += 1
+            writer = batch[start].writer
+            try:
+                writer._push_messages([ item.message for item in batch[start:end] ], batch[start].content_type)
+            except Exception as e:
+                logging.error(f"Error pushing messages to stream {writer._stream_id}: {e}")
+            writer._record_push_rtt(perf_counter() - batch[start].queued_at)    ## (From the oldest message in the run being pushed, so it includes the time spent queued)
+            start = end
+
+
+def _message_type(message:dict|str) -> str:
+    return message.get('type') if type(message) is dict else None
+
+def _coalesce(queued:_QueuedMessage, item:_QueuedMessage) -> bool:
+    ## Appends the item's delta to the queued message, if they're both interim deltas of the same message (for the same writer)
+    if queued.writer is not item.writer or queued.content_type != item.content_type: return False
+    merged = _merge_interim(queued.message, item.message)
+    if merged is None: return False
+    queued.message = merged
+    return True
+
+def _merge_interim(prev:dict|str, message:dict|str) -> dict:
+    ## Returns a single message with both deltas, if they're both interim deltas of the same message (otherwise None)
+    if _message_type(prev) != INTERIM_RESULT_MESSAGE or _message_type(message) != INTERIM_RESULT_MESSAGE: return None
+    if prev.keys() != message.keys() or prev.get('id') != message.get('id'): return None
+    if type(prev.get('delta')) is not str or type(message.get('delta')) is not str: return None
+    return { **message, 'delta': prev['delta'] + message['delta'] }
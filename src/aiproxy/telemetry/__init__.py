@@ -0,0 +1,40 @@
+import logging
+
+from ..interfaces.abstract_span_exporter import SpanExporter, NoOpSpanExporter
+from .trace import Span, RequestTrace, NULL_SPAN, NULL_SPAN_SCOPE, TRACING_ENABLED, TRACING_EXPORTER
+from .logging_exporter import LoggingSpanExporter
+from .metrics import MetricsRegistry, Counter, Gauge, Histogram, GLOBAL_METRICS_REGISTRY
+from .stream_stats import StreamStats
+
+_SPAN_EXPORTER:SpanExporter = None
+
+def span_exporter_factory(exporter_type:str, **kwargs) -> SpanExporter:
+    exporter_type = (exporter_type or "none").lower()
+    if exporter_type == "none" or exporter_type == "noop" or exporter_type == "off":
+        return NoOpSpanExporter()
+    elif exporter_type == "logging" or exporter_type == "log" or exporter_type == "logs":
+        return LoggingSpanExporter(**kwargs)
+    elif exporter_type == "otel" or exporter_type == "opentelemetry":
+        from .otel_exporter import OpenTelemetrySpanExporter
+        return OpenTelemetrySpanExporter(**kwargs)
+    else:
+        raise ValueError(f"Unknown span exporter type: {exporter_type}")
+
+def get_span_exporter() -> SpanExporter:
+    """
+    Returns the exporter that the traces of all requests are sent to (by default, the one specified by the `TRACING_EXPORTER` environment variable)
+    """
+    global _SPAN_EXPORTER
+    if _SPAN_EXPORTER is None:
+        _SPAN_EXPORTER = span_exporter_factory(TRACING_EXPORTER)
+    return _SPAN_EXPORTER
+
+def set_span_exporter(exporter:SpanExporter):
+    global _SPAN_EXPORTER
+    _SPAN_EXPORTER = exporter
+
+def export_trace(trace:RequestTrace):
+    try:
+        get_span_exporter().export(trace)
+    except Exception as e:
+        logging.warning(f"Failed to export the trace {trace.trace_id}: {e}")
@@ -0,0 +1,33 @@
+import json
+import logging
+
+from ..interfaces.abstract_span_exporter import SpanExporter
+from .trace import RequestTrace
+
+class LoggingSpanExporter(SpanExporter):
+    """
+    Logs a one line summary of where the time went in each request (the total time per span name), 
+    and optionally the full list of spans (as JSON)
+    """
+    def __init__(self, logger_name:str = "aiproxy.trace", level:int = logging.INFO, include_spans:bool = False):
+        self._logger = logging.getLogger(logger_name)
+        self._level = level
+        self._include_spans = include_spans
+
+    def export(self, trace:RequestTrace):
+        if not self._logger.isEnabledFor(self._level): return
+        data = trace.to_dict()
+        roots = [ span for span in data["spans"] if span.get("parent-id") is None ]
+        totals:dict[str, list] = {}
+        for span in data["spans"]:
+            if span.get("parent-id") is None: continue
+            total = totals.setdefault(span["name"], [ 0, 0.0 ])
+            total[0] += 1
+            total[1] += span["duration-ms"]
+
+        parts = [ f"{name}={total[1]:.1f}ms" + (f" (x{total[0]})" if total[0] > 1 else "") for name, total in totals.items() ]
+        parts.extend(f"{name}={agg['total-ms']:.1f}ms (x{agg['count']})" for name, agg in data["aggregates"].items())
+        root_str = ", ".join(f"{span['name']}={span['duration-ms']:.1f}ms" for span in roots)
+        self._logger.log(self._level, f"Trace {trace.trace_id}: {root_str} | {' '.join(parts)}")
+        if self._include_spans:
+            self._logger.log(self._level, json.dumps(data["spans"], default=str))
@@ -0,0 +1,199 @@
+from bisect import bisect_left
+from threading import Lock
+
+class Metric:
+    name:str = None
+    description:str = None
+    label_names:tuple[str] = None
+    metric_type:str = None
+
+    def __init__(self, name:str, description:str, label_names:list[str] = None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names or [])
+        self._lock = Lock()
+
+    def _label_values(self, labels:dict[str,any]) -> tuple[str]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, values:tuple[str], extra:str = None) -> str:
+        parts = [ f'{name}="{_escape_label(val)}"' for name, val in zip(self.label_names, values) ]
+        if extra is not None: parts.append(extra)
+        return "{" + ",".join(parts) + "}" if len(parts) > 0 else ""
+
+    def to_prometheus(self) -> list[str]:
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+    def to_dict(self) -> dict:
+        raise NotImplementedError("This method must be implemented by the subclass")
+
+
+class Counter(Metric):
+    """
+    A value that only ever goes up (eg. the total number of tokens generated)
+    """
+    metric_type = "counter"
+
+    def __init__(self, name:str, description:str, label_names:list[str] = None):
+        super().__init__(name, description, label_names)
+        self._values:dict[tuple[str], float] = {}
+
+    def inc(self, amount:float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [ f"{self.name}{self._format_labels(key)} {_format_value(val)}" for key, val in values ]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return { "type": self.metric_type, "values": [ { "labels": dict(zip(self.label_names, key)), "value": val } for key, val in self._values.items() ] }
+
+
+class Gauge(Metric):
+    """
+    A value that can go up + down (eg. the number of messages waiting to be delivered)
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name:str, description:str, label_names:list[str] = None):
+        super().__init__(name, description, label_names)
+        self._values:dict[tuple[str], float] = {}
+
+    def set(self, value:float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount:float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [ f"{self.name}{self._format_labels(key)} {_format_value(val)}" for key, val in values ]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return { "type": self.metric_type, "values": [ { "labels": dict(zip(self.label_names, key)), "value": val } for key, val in self._values.items() ] }
+
+
+class Histogram(Metric):
+    """
+    Counts observations into (cumulative) buckets, along with their count + sum, so that percentiles can be estimated when the metrics are scraped
+    """
+    metric_type = "histogram"
+    buckets:list[float] = None
+
+    def __init__(self, name:str, description:str, buckets:list[float], label_names:list[str] = None):
+        super().__init__(name, description, label_names)
+        self.buckets = sorted(buckets)
+        self._values:dict[tuple[str], list] = {}     ## label values -> [ bucket counts (+ the +Inf bucket), count, sum ]
+
+    def observe(self, value:float, **labels):
+        self.observe_many([ value ], **labels)
+
+    def observe_many(self, values:list[float], **labels):
+        """
+        Record a number of observations at once (taking the lock only once)
+        """
+        if len(values) == 0: return
+        key = self._label_values(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = [ [ 0 ] * (len(self.buckets) + 1), 0, 0.0 ]
+                self._values[key] = data
+            bucket_counts = data[0]
+            for value in values:
+                bucket_counts[bisect_left(self.buckets, value)] += 1
+            data[1] += len(values)
+            data[2] += sum(values)
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            values = [ (key, list(data[0]), data[1], data[2]) for key, data in self._values.items() ]
+        lines = []
+        for key, bucket_counts, count, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + [ "+Inf" ], bucket_counts):
+                cumulative += bucket_count
+                le = 'le="' + (bound if type(bound) is str else _format_value(bound)) + '"'
+                lines.append(f"{self.name}_bucket{self._format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return { "type": self.metric_type, "buckets": self.buckets, "values": [ { "labels": dict(zip(self.label_names, key)), "bucket-counts": list(data[0]), "count": data[1], "sum": data[2] } for key, data in self._values.items() ] }
+
+
+class MetricsRegistry:
+    """
+    A process-wide set of metrics, that can be scraped in the Prometheus text format (see `to_prometheus`)
+
+    Metrics are created on first use, asking for a metric that already exists returns the existing one
+    """
+    def __init__(self):
+        self._metrics:dict[str, Metric] = {}
+        self._lock = Lock()
+
+    def counter(self, name:str, description:str, label_names:list[str] = None) -> Counter:
+        return self._get_or_create(name, Counter, lambda: Counter(name, description, label_names))
+
+    def gauge(self, name:str, description:str, label_names:list[str] = None) -> Gauge:
+        return self._get_or_create(name, Gauge, lambda: Gauge(name, description, label_names))
+
+    def histogram(self, name:str, description:str, buckets:list[float], label_names:list[str] = None) -> Histogram:
+        return self._get_or_create(name, Histogram, lambda: Histogram(name, description, buckets, label_names))
+
+    def get(self, name:str) -> Metric:
+        return self._metrics.get(name)
+
+    def to_prometheus(self) -> str:
+        """
+        Render all the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return { name: metric.to_dict() for name, metric in list(self._metrics.items()) }
+
+    def _get_or_create(self, name:str, metric_type:type, factory) -> Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[name] = metric
+        if type(metric) is not metric_type:
+            raise ValueError(f"The metric '{name}' is already registered as a {metric.metric_type}")
+        return metric
+
+
+def _escape_label(value:str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_value(value:float) -> str:
+    return str(int(value)) if type(value) is int or (type(value) is float and value.is_integer()) else repr(value)
+
+
+GLOBAL_METRICS_REGISTRY = MetricsRegistry()
@@ -0,0 +1,41 @@
+from ..interfaces.abstract_span_exporter import SpanExporter
+from .trace import RequestTrace
+
+class OpenTelemetrySpanExporter(SpanExporter):
+    """
+    Replays the spans of each request as OpenTelemetry spans (with their original start + end times)
+
+    Requires the `opentelemetry-api` package (plus an SDK + exporter configured by the application, otherwise the spans go nowhere)
+    The root spans are parented to the span that is current when the trace is exported (if there is one)
+    """
+    def __init__(self, tracer_name:str = "aiproxy", tracer_provider:any = None):
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            raise ImportError("The OpenTelemetry span exporter requires the 'opentelemetry-api' package to be installed")
+        self._otel_trace = otel_trace
+        self._tracer = otel_trace.get_tracer(tracer_name, tracer_provider=tracer_provider)
+
+    def export(self, trace:RequestTrace):
+        from opentelemetry.trace import Status, StatusCode
+
+        otel_spans = {}
+        spans = sorted(trace.spans, key=lambda span: span.offset_ms)    ## Parents always start before their children
+        for span in spans:
+            parent = otel_spans.get(span.parent_id)
+            otel_context = self._otel_trace.set_span_in_context(parent) if parent is not None else None
+            attributes = { "aiproxy.trace_id": trace.trace_id }
+            for key, val in (span.attributes or {}).items():
+                if val is None: continue
+                attributes[key] = val if type(val) in [str, int, float, bool] else str(val)
+            if span.parent_id is None:
+                for name, agg in trace.aggregates.items():
+                    attributes[f"{name}.count"] = agg[0]
+                    attributes[f"{name}.total_ms"] = agg[1]
+            otel_span = self._tracer.start_span(span.name, context=otel_context, start_time=int(span.start * 1e9), attributes=attributes)
+            if span.error is not None:
+                otel_span.set_status(Status(StatusCode.ERROR, span.error))
+            otel_spans[span.span_id] = otel_span
+
+        for span in spans:
+            otel_spans[span.span_id].end(end_time=int((span.start + span.duration_ms / 1000) * 1e9))
@@ -0,0 +1,105 @@
+from time import perf_counter
+
+from aiproxy.utils.tokens import get_token_counter
+from .metrics import GLOBAL_METRICS_REGISTRY, MetricsRegistry
+
+class StreamStats:
+    """
+    Records the timings of a streamed completion as its chunks arrive: the time to the first token, the gaps between the chunks, and the rate the output tokens were generated at
+    """
+    request_start:float = None
+    first_token:float = None
+    last_chunk:float = None
+    chunks:int = 0
+    gaps:list[float] = None
+    usage:any = None
+    """The usage reported by the model at the end of the stream (if it was asked to include it)"""
+
+    def __init__(self, request_start:float = None):
+        self.request_start = request_start or perf_counter()
+        self.gaps = []
+        self._texts = []
+        self._output_tokens = None
+
+    def add_chunk(self, chunk):
+        now = perf_counter()
+        usage = getattr(chunk, 'usage', None)
+        if usage is not None:
+            self.usage = usage
+        if not chunk.choices: return    ## eg. the usage chunk at the end of the stream (which can arrive after the tools have been invoked, so it's not a real gap)
+
+        self.chunks += 1
+        if self.last_chunk is not None:
+            self.gaps.append(now - self.last_chunk)
+        self.last_chunk = now
+
+        for choice in chunk.choices:
+            delta = choice.delta
+            if delta is None:     ## A delta from the Data Source Extensions API
+                if self.first_token is None: self.first_token = now
+                continue
+            if delta.content:
+                self._texts.append(delta.content)
+                if self.first_token is None: self.first_token = now
+            if delta.tool_calls:
+                for tool_call in delta.tool_calls:
+                    if tool_call.function is not None:
+                        if tool_call.function.name: self._texts.append(tool_call.function.name)
+                        if tool_call.function.arguments: self._texts.append(tool_call.function.arguments)
+                if self.first_token is None: self.first_token = now
+
+    def output_tokens(self, model:str = None) -> int:
+        """
+        The number of tokens in the response, as reported by the model (if it included its usage in the stream), otherwise counted locally
+        """
+        if self._output_tokens is None:
+            if self.usage is not None and self.usage.completion_tokens is not None:
+                self._output_tokens = self.usage.completion_tokens
+            else:
+                self._output_tokens = get_token_counter(model).count("".join(self._texts))
+        return self._output_tokens
+
+    def summary(self, model:str = None) -> dict:
+        """
+        Summarise the timings of the stream (in ms)
+        """
+        output_tokens = self.output_tokens(model)
+        gaps = sorted(self.gaps)
+        generating_secs = (self.last_chunk - self.first_token) if self.first_token is not None and self.last_chunk is not None else 0
+        return {
+            "ttft-ms": _ms(self.first_token - self.request_start) if self.first_token is not None else None,
+            "duration-ms": _ms(self.last_chunk - self.request_start) if self.last_chunk is not None else None,
+            "chunks": self.chunks,
+            "gap-p50-ms": _ms(_percentile(gaps, 0.5)),
+            "gap-p90-ms": _ms(_percentile(gaps, 0.9)),
+            "gap-p99-ms": _ms(_percentile(gaps, 0.99)),
+            "gap-max-ms": _ms(gaps[-1]) if len(gaps) > 0 else None,
+            "output-tokens": output_tokens,
+            "tokens-per-sec": round(output_tokens / generating_secs, 1) if generating_secs > 0 else None,
+        }
+
+    def observe(self, summary:dict, registry:MetricsRegistry = None, **labels):
+        """
+        Add the timings of this stream to the (process-wide) streaming metrics
+        """
+        registry = registry or GLOBAL_METRICS_REGISTRY
+        label_names = list(labels.keys())
+        registry.counter("aiproxy_streamed_completions_total", "The number of streamed completions", label_names).inc(**labels)
+        registry.counter("aiproxy_stream_output_tokens_total", "The number of output tokens generated by streamed completions", label_names).inc(summary["output-tokens"], **labels)
+        if self.first_token is not None:
+            registry.histogram("aiproxy_stream_time_to_first_token_seconds", "The time from sending a request to receiving the first token of the streamed response", TTFT_BUCKETS, label_names).observe(self.first_token - self.request_start, **labels)
+        registry.histogram("aiproxy_stream_inter_chunk_gap_seconds", "The time between consecutive chunks of a streamed response", GAP_BUCKETS, label_names).observe_many(self.gaps, **labels)
+        if summary["tokens-per-sec"] is not None:
+            registry.histogram("aiproxy_stream_tokens_per_second", "The rate the output tokens of a streamed response were generated at (after the first token)", TOKENS_PER_SEC_BUCKETS, label_names).observe(summary["tokens-per-sec"], **labels)
+
+
+TTFT_BUCKETS = [ 0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30 ]
+GAP_BUCKETS = [ 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1 ]
+TOKENS_PER_SEC_BUCKETS = [ 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500 ]
+
+def _percentile(sorted_values:list[float], pct:float) -> float:
+    if len(sorted_values) == 0: return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+def _ms(secs:float) -> float:
+    return round(secs * 1000, 3) if secs is not None else None
@@ -0,0 +1,148 @@
+import os
+from time import time, perf_counter
+from uuid import uuid4
+from threading import Lock
+from contextvars import ContextVar
+
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'none').lower()
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false' if TRACING_EXPORTER == 'none' else 'true').lower() in ['true', '1', 'y', 't', 'on', 'yes', 'enabled']
+
+## The span that is currently open (in this thread / task), which becomes the parent of any span opened within it
+## (Use `contextvars.copy_context().run(...)` when handing work to another thread, so that its spans are parented correctly)
+_CURRENT_SPAN:ContextVar['Span'] = ContextVar('aiproxy_current_span', default=None)
+
+class Span:
+    """
+    A timed phase of a request (eg. loading the history, calling the model or invoking a tool)
+    """
+    name:str = None
+    span_id:int = None
+    parent_id:int = None
+    trace_id:str = None
+    start:float = None
+    """The time the span started (epoch secs)"""
+    offset_ms:float = None
+    """The time the span started, relative to the start of the trace (in ms)"""
+    duration_ms:float = None
+    attributes:dict[str,any] = None
+    error:str = None
+
+    def __init__(self, name:str, span_id:int, parent_id:int, trace_id:str, attributes:dict[str,any] = None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.trace_id = trace_id
+        self.attributes = attributes
+
+    def set_attribute(self, key:str, value:any):
+        if self.attributes is None: self.attributes = {}
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        out = { "name": self.name, "id": self.span_id, "offset-ms": round(self.offset_ms, 3), "duration-ms": round(self.duration_ms, 3) if self.duration_ms is not None else None }
+        if self.parent_id is not None: out["parent-id"] = self.parent_id
+        if self.attributes is not None: out["attributes"] = self.attributes
+        if self.error is not None: out["error"] = self.error
+        return out
+
+
+class _NullSpan(Span):
+    def __init__(self):
+        super().__init__(None, None, None, None)
+
+    def set_attribute(self, key:str, value:any):
+        pass
+
+class _NullSpanScope:
+    """
+    Stands in for a span when the request isn't being traced (so the instrumented code doesn't need to check)
+    """
+    def __enter__(self) -> Span:
+        return NULL_SPAN
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+NULL_SPAN = _NullSpan()
+NULL_SPAN_SCOPE = _NullSpanScope()
+
+
+class _SpanScope:
+    def __init__(self, trace:'RequestTrace', name:str, attributes:dict[str,any]):
+        self._trace = trace
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _CURRENT_SPAN.get()
+        parent_id = parent.span_id if parent is not None and parent.trace_id == self._trace.trace_id else None
+        self._span = Span(self._name, self._trace._next_span_id(), parent_id, self._trace.trace_id, self._attributes or None)
+        self._token = _CURRENT_SPAN.set(self._span)
+        self._start = perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        end = perf_counter()
+        _CURRENT_SPAN.reset(self._token)
+        if exc is not None:
+            self._span.error = f"{exc_type.__name__}: {exc}"
+        self._trace._add_span(self._span, self._start, end)
+        return False
+
+
+class RequestTrace:
+    """
+    The spans recorded while handling a single request
+
+    Phases that happen too often to be worth a span each (eg. pushing an update to the stream) are aggregated instead (see `record`)
+    """
+    trace_id:str = None
+    start:float = None
+    spans:list[Span] = None
+    aggregates:dict[str, list[float]] = None
+
+    def __init__(self, trace_id:str = None):
+        self.trace_id = trace_id or uuid4().hex
+        self.start = time()
+        self.spans = []
+        self.aggregates = {}
+        self._start_perf = perf_counter()
+        self._span_count = 0
+        self._lock = Lock()
+
+    def span(self, name:str, **attributes) -> _SpanScope:
+        """
+        Returns a context manager that times the enclosed block as a span of this trace
+        """
+        return _SpanScope(self, name, attributes)
+
+    def record(self, name:str, duration_ms:float):
+        """
+        Add a timing to the named aggregate (the count, total + max are kept rather than every timing)
+        """
+        with self._lock:
+            agg = self.aggregates.get(name)
+            if agg is None:
+                self.aggregates[name] = [ 1, duration_ms, duration_ms ]
+            else:
+                agg[0] += 1
+                agg[1] += duration_ms
+                if duration_ms > agg[2]: agg[2] = duration_ms
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.offset_ms)
+            aggregates = { name: { "count": agg[0], "total-ms": round(agg[1], 3), "max-ms": round(agg[2], 3) } for name, agg in self.aggregates.items() }
+        return { "trace-id": self.trace_id, "start": self.start, "spans": [ span.to_dict() for span in spans ], "aggregates": aggregates }
+
+    def _next_span_id(self) -> int:
+        with self._lock:
+            self._span_count += 1
+            return self._span_count
+
+    def _add_span(self, span:Span, start_perf:float, end_perf:float):
+        span.offset_ms = (start_perf - self._start_perf) * 1000
+        span.start = self.start + (start_perf - self._start_perf)
+        span.duration_ms = (end_perf - start_perf) * 1000
+        with self._lock:
+            self.spans.append(span)
@@ -4,6 +4,7 @@ import logging
 
 from aiproxy import ChatContext
 from aiproxy.functions import GLOBAL_FUNCTIONS_REGISTRY
+from aiproxy.telemetry.trace import NULL_SPAN_SCOPE
 
 FAILED_INVOKE_RESPONSE = "[Failed]"
 
@@ -58,7 +59,8 @@ def invoke_registered_function(function_name:str, function_args:str|dict, contex
         
         ## Invoke the function
         logging.debug(f"Invoking function: {function_name}")
-        result = function_def.func(**args)
+        with context.span('tool.invoke', function=function_name) if context is not None else NULL_SPAN_SCOPE:
+            result = function_def.func(**args)
 
         ## Return the result as is if not casting to string
         if not cast_result_to_string: return result
@@ -0,0 +1,90 @@
+from typing import Callable
+from datetime import datetime, timezone
+
+class PromptTemplate:
+    """
+    A prompt with `{key}` placeholders, compiled once into a list of literal runs + placeholder keys so it can be rendered with a single join
+
+    * `{{` is left as is (and is not treated as the start of a placeholder)
+    * A placeholder that cannot be resolved is left in the prompt as is
+    * The built in date/time keys (eg. `{date}`, `{utctime}`, `{date-format:%d %b %Y}`) are all rendered from the same point in time
+    """
+    template:str = None
+    _parts:list[str] = None
+    _placeholders:list[tuple[int, str]] = None
+
+    def __init__(self, template:str):
+        self.template = template
+        self._parts = []
+        self._placeholders = []
+        self.__compile(template)
+
+    def __compile(self, template:str):
+        literal_start = 0
+        start = template.find("{")
+        while start >= 0:
+            if template[start:start+2] == "{{":    ## Ignore any double squiggly brackets
+                start = template.find("{", start + 2)
+                continue
+
+            end = template.find("}", start)
+            if end < 0: break
+
+            key = template[start+1:end]
+            if "{" in key:      ## Not a placeholder (eg. a JSON example in the prompt), so keep looking from the next bracket
+                start = template.find("{", start + 1)
+                continue
+
+            if start > literal_start:
+                self._parts.append(template[literal_start:start])
+            self._placeholders.append((len(self._parts), key))
+            self._parts.append(None)
+            literal_start = end + 1
+            start = template.find("{", literal_start)
+
+        if literal_start < len(template):
+            self._parts.append(template[literal_start:])
+
+    @property
+    def has_placeholders(self) -> bool:
+        return len(self._placeholders) > 0
+
+    def render(self, resolve_key:Callable[[str], any] = None) -> str:
+        """
+        Render the template, using the `resolve_key` function to find the value of any placeholders that aren't built in date/time keys
+        """
+        if len(self._placeholders) == 0: return self.template
+
+        parts = self._parts.copy()
+        now = None
+        utcnow = None
+        for idx, key in self._placeholders:
+            if key in _LOCAL_DATE_FORMATS:
+                now = now or datetime.now()
+                value = now.isoformat() if key == "iso8601" else now.strftime(_LOCAL_DATE_FORMATS[key])
+            elif key in _UTC_DATE_FORMATS:
+                utcnow = utcnow or datetime.now(tz=timezone.utc)
+                value = utcnow.strftime(_UTC_DATE_FORMATS[key])
+            elif key.startswith("date-format:"):
+                now = now or datetime.now()
+                value = now.strftime(key[12:])
+            else:
+                value = resolve_key(key) if resolve_key is not None else None
+
+            ## If the key is not found, then leave it as is
+            parts[idx] = str(value) if value is not None else "{" + key + "}"
+        return "".join(parts)
+
+
+_LOCAL_DATE_FORMATS = {
+    "date": "%Y-%m-%d",
+    "time": "%H:%M:%S",
+    "datetime": "%Y-%m-%d %H:%M:%S",
+    "iso8601": None,
+}
+
+_UTC_DATE_FORMATS = {
+    "utcdate": "%Y-%m-%d",
+    "utctime": "%H:%M:%S",
+    "utcdatetime": "%Y-%m-%d %H:%M:%S",
+}
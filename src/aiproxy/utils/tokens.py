@@ -0,0 +1,69 @@
+import os
+
+DEFAULT_TOKEN_ENCODING = os.environ.get('DEFAULT_TOKEN_ENCODING', 'cl100k_base')
+
+_TOKEN_COUNTERS = {}
+
+class TokenCounter:
+    """
+    Counts tokens locally (without calling the model)
+
+    Uses `tiktoken` when it is installed, otherwise falls back to an approximation of ~4 characters per token
+    """
+    _encoding = None
+
+    def __init__(self, model:str = None):
+        try:
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(model) if model is not None else tiktoken.get_encoding(DEFAULT_TOKEN_ENCODING)
+            except KeyError:    ## Azure model deployments are usually named differently to the underlying model, so use the default encoding
+                self._encoding = tiktoken.get_encoding(DEFAULT_TOKEN_ENCODING)
+        except ImportError:
+            self._encoding = None
+
+    def count(self, text:str) -> int:
+        if text is None or len(text) == 0: return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_message(self, message:dict) -> int:
+        """
+        Count the tokens of a message in the OpenAI message format (including the per-message overhead)
+        """
+        tokens = 4  ## Every message is wrapped with a few tokens for the role + separators
+        content = message.get('content')
+        if type(content) is str:
+            tokens += self.count(content)
+        elif type(content) is list:
+            for part in content:
+                if type(part) is dict and part.get('type') == 'text':
+                    tokens += self.count(part.get('text'))
+                else:
+                    tokens += 85     ## Images (at low detail) cost a fixed number of tokens
+
+        tool_calls = message.get('tool_calls')
+        if tool_calls is not None:
+            for tool_call in tool_calls:
+                function = tool_call.get('function') or {}
+                tokens += 4 + self.count(function.get('name')) + self.count(function.get('arguments'))
+
+        if message.get('name') is not None:
+            tokens += 1
+        return tokens
+
+    def count_messages(self, messages:list[dict]) -> int:
+        return sum(self.count_message(msg) for msg in messages) + 3     ## Every reply is primed with a few tokens
+
+
+def get_token_counter(model:str = None) -> TokenCounter:
+    """
+    Get a (cached) token counter for the specified model
+    """
+    global _TOKEN_COUNTERS
+    counter = _TOKEN_COUNTERS.get(model)
+    if counter is None:
+        counter = TokenCounter(model)
+        _TOKEN_COUNTERS[model] = counter
+    return counter
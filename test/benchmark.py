@@ -0,0 +1,62 @@
+## Benchmarks the overhead of the library itself, against a local mock Azure OpenAI server (so no live endpoints are needed)
+##
+## Usage: python test/benchmark.py [--iterations N] [--latency-ms N] [--only name1,name2] [--output results.json]
+
+## Load src into path
+import sys
+sys.path.insert(0, 'src')
+sys.path.insert(0, 'test')
+
+import os
+import json
+import argparse
+import platform
+import logging
+
+from benchmarks import MockAzureOpenAIServer
+
+parser = argparse.ArgumentParser(description="Benchmark the aiproxy library against a local mock Azure OpenAI server")
+parser.add_argument("--iterations", type=int, default=20, help="The number of timed iterations of each benchmark")
+parser.add_argument("--latency-ms", type=float, default=0, help="Simulated model latency (per request) in milliseconds")
+parser.add_argument("--only", type=str, default=None, help="Comma separated list of the benchmarks to run")
+parser.add_argument("--output", type=str, default=None, help="Write the results (JSON) to this file, rather than to stdout")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.ERROR)
+
+server = MockAzureOpenAIServer(latency_secs=args.latency_ms / 1000).start()
+
+## Point every config at the mock server (this must be done before any configs are loaded)
+os.environ['AZURE_OAI_ENDPOINT'] = server.endpoint
+os.environ['AZURE_OAI_API_KEY'] = 'mock-key'
+os.environ['AZURE_OAI_API_VERSION'] = '2024-10-21'
+os.environ['AZURE_OAI_MODEL_DEPLOYMENT'] = 'mock-model'
+os.environ['CONFIGS_CHECK_COSMOS'] = 'false'       ## Configs that aren't passed in directly fall back to the defaults
+
+from benchmarks.scenarios import BENCHMARKS, register_bench_functions
+register_bench_functions()
+
+selected = args.only.split(",") if args.only else list(BENCHMARKS.keys())
+results = {}
+try:
+    for name in selected:
+        print(f"Running benchmark: {name}", file=sys.stderr)
+        results[name] = BENCHMARKS[name](server, args.iterations)
+finally:
+    server.stop()
+
+output = {
+    "meta": {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "latency-ms": args.latency_ms,
+    },
+    "results": results,
+}
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+else:
+    print(json.dumps(output, indent=2))
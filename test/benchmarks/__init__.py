@@ -0,0 +1 @@
+from .mock_server import MockAzureOpenAIServer, MockReply, words_reply
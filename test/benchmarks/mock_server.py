@@ -0,0 +1,181 @@
+import json
+import random
+import base64
+from array import array
+from hashlib import sha256
+from threading import Thread, Lock
+from time import sleep, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable
+
+class MockReply:
+    """
+    What the mock model should reply with: either some content, or a list of tool calls (as (function name, args) tuples)
+    """
+    content:str = None
+    tool_calls:list[tuple[str, dict]] = None
+
+    def __init__(self, content:str = None, tool_calls:list[tuple[str, dict]] = None):
+        self.content = content
+        self.tool_calls = tool_calls
+
+
+def words_reply(word_count:int = 50, seed:int = 0) -> MockReply:
+    """
+    A (reproducible) reply with the specified number of words
+    """
+    rand = random.Random(seed)
+    words = [ "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima" ]
+    return MockReply(content=" ".join(rand.choice(words) for _ in range(word_count)))
+
+
+class MockAzureOpenAIServer:
+    """
+    A local HTTP server that speaks enough of the Azure OpenAI wire format (chat completions, including SSE streaming + tool calls, and embeddings) to benchmark the library without a live endpoint
+
+    The reply to each chat completion request is decided by the `responder`, which is passed the (parsed) request body
+    """
+    responder:Callable[[dict], MockReply]
+    latency_secs:float = 0
+    words_per_chunk:int = 1
+    embedding_dims:int = 1536
+    request_count:int = 0
+
+    def __init__(self, responder:Callable[[dict], MockReply] = None, latency_secs:float = 0, words_per_chunk:int = 1, embedding_dims:int = 1536):
+        self.responder = responder or (lambda body: words_reply())
+        self.latency_secs = latency_secs
+        self.words_per_chunk = words_per_chunk
+        self.embedding_dims = embedding_dims
+        self.request_count = 0
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> 'MockAzureOpenAIServer':
+        server = self
+        class Handler(_MockRequestHandler):
+            mock = server
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, name="mock-aoai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    mock:MockAzureOpenAIServer = None
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True      ## Otherwise the headers + body writes stall on delayed ACKs (~40ms per request)
+
+    def log_message(self, format, *args):
+        pass    ## Don't log every request to the console
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        self.mock._count_request()
+        if self.mock.latency_secs > 0:
+            sleep(self.mock.latency_secs)
+
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            reply = self.mock.responder(body)
+            if body.get('stream'):
+                self._send_stream(body, reply)
+            else:
+                self._send_json(self._build_completion(body, reply))
+        elif path.endswith("/embeddings"):
+            self._send_json(self._build_embeddings(body))
+        else:
+            self._send_json({ "error": { "code": "NotFound", "message": f"Unknown path: {path}" } }, status=404)
+
+    def _send_json(self, data:dict, status:int = 200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _build_completion(self, body:dict, reply:MockReply) -> dict:
+        message = { "role": "assistant", "content": reply.content }
+        finish_reason = "stop"
+        if reply.tool_calls:
+            message["tool_calls"] = [ { "id": f"call_{idx}", "type": "function", "function": { "name": name, "arguments": json.dumps(args) } } for idx, (name, args) in enumerate(reply.tool_calls) ]
+            finish_reason = "tool_calls"
+        return {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time()), "model": body.get("model", "mock"),
+            "choices": [ { "index": 0, "message": message, "finish_reason": finish_reason } ],
+            "usage": self._build_usage(body, reply),
+        }
+
+    def _build_usage(self, body:dict, reply:MockReply) -> dict:
+        ## A rough (word count) stand-in for the token counts the real API reports
+        prompt_tokens = sum(len(str(msg.get("content") or "").split()) for msg in body.get("messages") or [])
+        completion_tokens = len((reply.content or "").split()) + sum(len(json.dumps(args).split()) + 1 for _, args in reply.tool_calls or [])
+        return { "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens }
+
+    def _send_stream(self, body:dict, reply:MockReply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta:dict, finish_reason:str = None):
+            return { "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "mock"), "choices": [ { "index": 0, "delta": delta, "finish_reason": finish_reason } ] }
+
+        events = [ chunk({ "role": "assistant", "content": "" }) ]
+        if reply.content:
+            words = reply.content.split(" ")
+            for idx in range(0, len(words), self.mock.words_per_chunk):
+                text = " ".join(words[idx:idx+self.mock.words_per_chunk])
+                events.append(chunk({ "content": text if idx == 0 else " " + text }))
+        if reply.tool_calls:
+            for idx, (name, args) in enumerate(reply.tool_calls):
+                args_str = json.dumps(args)
+                half = len(args_str) // 2      ## Split the arguments over two chunks (as the real API does)
+                events.append(chunk({ "tool_calls": [ { "index": idx, "id": f"call_{idx}", "type": "function", "function": { "name": name, "arguments": args_str[:half] } } ] }))
+                events.append(chunk({ "tool_calls": [ { "index": idx, "function": { "arguments": args_str[half:] } } ] }))
+        events.append(chunk({}, "tool_calls" if reply.tool_calls else "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append({ "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "mock"), "choices": [], "usage": self._build_usage(body, reply) })
+
+        for event in events:
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data:bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+    def _build_embeddings(self, body:dict) -> dict:
+        inputs = body.get("input")
+        if type(inputs) is str: inputs = [ inputs ]
+        data = []
+        for idx, text in enumerate(inputs):
+            ## A (reproducible) pseudo-random vector per text
+            rand = random.Random(sha256(str(text).encode()).digest())
+            vector = array('f', (rand.uniform(-1, 1) for _ in range(self.mock.embedding_dims)))
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({ "object": "embedding", "index": idx, "embedding": embedding })
+        return { "object": "list", "data": data, "model": body.get("model", "mock"), "usage": { "prompt_tokens": 0, "total_tokens": 0 } }
@@ -0,0 +1,165 @@
+import json
+from time import perf_counter
+from statistics import mean, median
+from typing import Annotated, Callable
+
+from aiproxy import GLOBAL_FUNCTIONS_REGISTRY, GLOBAL_PROXIES_REGISTRY, ChatContext
+from aiproxy.data import ChatConfig
+from aiproxy.proxy import CompletionsProxy
+from aiproxy.orchestration import orchestrator_factory
+from aiproxy.streaming import FunctionStreamWriter
+
+from .mock_server import MockAzureOpenAIServer, MockReply, words_reply
+
+BENCH_FUNCTION = "bench_lookup"
+
+def bench_lookup(key:Annotated[str, "The key to lookup"]) -> str:
+    return json.dumps({ "key": key, "value": f"The value for {key}" })
+
+def register_bench_functions():
+    GLOBAL_FUNCTIONS_REGISTRY.register_base_function(BENCH_FUNCTION, "Lookup the value for a key (benchmark function)", bench_lookup)
+
+
+def measure(fn:Callable[[], any], iterations:int, warmup:int = 2) -> dict:
+    """
+    Time the function over a number of iterations (after a few warmup runs), returning the timings in milliseconds
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = perf_counter()
+        fn()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean-ms": round(mean(timings), 3),
+        "median-ms": round(median(timings), 3),
+        "min-ms": round(timings[0], 3),
+        "p95-ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max-ms": round(timings[-1], 3),
+    }
+
+
+## Responders
+
+def tool_then_answer_responder(tool_call_count:int = 1) -> Callable[[dict], MockReply]:
+    """
+    Asks for the bench function to be called (`tool_call_count` times) in reply to the user prompt, then answers once the results are in
+    """
+    def responder(body:dict) -> MockReply:
+        if body.get("tools") and body["messages"][-1].get("role") == "user":
+            return MockReply(tool_calls=[ (BENCH_FUNCTION, { "key": f"key-{idx}" }) for idx in range(tool_call_count) ])
+        return words_reply(50)
+    return responder
+
+def orchestration_responder(body:dict) -> MockReply:
+    """
+    Recognises the prompts used by the orchestrators, and replies in the format they expect
+    """
+    messages = body.get("messages", [])
+    text = "\n".join(msg.get("content") for msg in messages if type(msg.get("content")) is str)
+    if "Respond only with the name of the agent" in text:
+        return MockReply(content=_agent_names(text)[0])
+    if "AGENT:Agent Name:Prompt" in text:
+        names = _agent_names(text)
+        responses = sum(text.count(f"[{name}]:\n") for name in names)
+        return MockReply(content=f"AGENT:{names[responses]}:Please continue" if responses < len(names) else "COMPLETE")
+    if "Your role is to build a step by step plan" in text:
+        return MockReply(content="\n".join([
+            json.dumps({ "step": "Lookup the value", "function": BENCH_FUNCTION, "args": { "key": "plan" }, "output": "$LOOKUP_RESULT" }),
+            json.dumps({ "step": "Respond to the user", "function": "generate_final_response", "args": { "original_prompt": "benchmark", "intent": "benchmark", "data": [ "LOOKUP_RESULT" ] } }),
+            "##END##",
+        ]))
+    return words_reply(50)
+
+def _agent_names(text:str) -> list[str]:
+    agent_list = text[text.find("[START AGENT LIST]"):text.find("[END AGENT LIST]")]
+    return [ line[2:line.find(":")].strip() for line in agent_list.splitlines() if line.startswith("- ") and ":" in line ]
+
+
+## Benchmarks
+
+def _completions_proxy(name:str, **config) -> CompletionsProxy:
+    config_dict = { "name": name, "use-functions": False }
+    config_dict.update(config)
+    return GLOBAL_PROXIES_REGISTRY.load_proxy(ChatConfig.load(config_dict), CompletionsProxy)
+
+def bench_completions_single_step(server:MockAzureOpenAIServer, iterations:int) -> dict:
+    server.responder = lambda body: words_reply(50)
+    proxy = _completions_proxy("bench-single-step")
+    return measure(lambda: proxy.send_message("What is the capital of France?", ChatContext()), iterations)
+
+def bench_completions_multi_step(server:MockAzureOpenAIServer, iterations:int) -> dict:
+    server.responder = tool_then_answer_responder(1)
+    proxy = _completions_proxy("bench-multi-step", **{ "use-functions": True })
+    only_bench_function = lambda name, _: name == BENCH_FUNCTION
+    result = measure(lambda: proxy.send_message("Lookup the value for my key", ChatContext(function_filter=only_bench_function)), iterations)
+    result["steps-per-request"] = 2
+    return result
+
+def bench_streaming_throughput(server:MockAzureOpenAIServer, iterations:int) -> dict:
+    word_count = 500
+    server.responder = lambda body: words_reply(word_count)
+    proxy = _completions_proxy("bench-streaming", **{ "publish-frequency": 0.001, "adaptive-publishing": False })     ## (A fixed cadence, so every run measures the same number of publishes)
+    published = [ 0 ]
+    def count_message(msg):
+        published[0] += 1
+    streamer = FunctionStreamWriter(stream_function=count_message)
+    result = measure(lambda: proxy.send_message("Tell me a long story", ChatContext(stream=streamer)), iterations)
+    chunks = word_count + 2     ## + the role chunk and the finish chunk
+    result["chunks-per-request"] = chunks
+    result["chunks-per-sec"] = round(chunks / (result["median-ms"] / 1000), 1)
+    result["stream-messages-per-request"] = round(published[0] / (iterations + 2), 1)
+    return result
+
+def bench_tool_dispatch(server:MockAzureOpenAIServer, iterations:int) -> dict:
+    tool_call_count = 8
+    only_bench_function = lambda name, _: name == BENCH_FUNCTION
+    results = {}
+    server.responder = tool_then_answer_responder(1)
+    single = measure(lambda: _completions_proxy("bench-tool-single", **{ "use-functions": True }).send_message("Lookup my key", ChatContext(function_filter=only_bench_function)), iterations)
+    results["single-tool"] = single
+
+    server.responder = tool_then_answer_responder(tool_call_count)
+    for mode, max_parallel in [ ("serial", 1), ("parallel", 4) ]:
+        proxy = _completions_proxy(f"bench-tool-{mode}", **{ "use-functions": True, "max-parallel-tools": max_parallel })
+        result = measure(lambda: proxy.send_message("Lookup all my keys", ChatContext(function_filter=only_bench_function)), iterations)
+        ## The overhead of each additional tool call (compared to a turn with a single tool call)
+        result["per-tool-call-overhead-ms"] = round((result["median-ms"] - single["median-ms"]) / (tool_call_count - 1), 3)
+        results[f"{tool_call_count}-tools-{mode}"] = result
+    return results
+
+def _agents(count:int = 3) -> list[dict]:
+    return [ { "name": f"Agent {idx}", "description": f"Benchmark agent number {idx}", "type": "completion", "system-prompt": f"You are benchmark agent {idx}" } for idx in range(count) ]
+
+def bench_orchestrators(server:MockAzureOpenAIServer, iterations:int) -> dict:
+    server.responder = orchestration_responder
+    orchestrators = {
+        "agent-select": { "name": "bench-agent-select", "type": "agent-select", "agents": _agents() },
+        "multi-agent": { "name": "bench-multi-agent", "type": "multi-agent", "agents": _agents() },
+        "sequential": { "name": "bench-sequential", "type": "sequential", "agents": _agents() },
+        "consensus": { "name": "bench-consensus", "type": "consensus", "agents": _agents() },
+        "step-plan": { "name": "bench-step-plan", "type": "step-plan", "functions": [ BENCH_FUNCTION ] },
+    }
+    results = {}
+    for name, config in orchestrators.items():
+        orchestrator = orchestrator_factory(config)
+        results[name] = measure(lambda: orchestrator.send_message("What should we do today?", ChatContext()), iterations)
+        results[name]["model-calls-per-request"] = _count_model_calls(server, lambda: orchestrator.send_message("What should we do today?", ChatContext()))
+    return results
+
+def _count_model_calls(server:MockAzureOpenAIServer, fn:Callable[[], any]) -> int:
+    before = server.request_count
+    fn()
+    return server.request_count - before
+
+
+BENCHMARKS:dict[str, Callable[[MockAzureOpenAIServer, int], dict]] = {
+    "completions-single-step": bench_completions_single_step,
+    "completions-multi-step": bench_completions_multi_step,
+    "streaming-throughput": bench_streaming_throughput,
+    "tool-dispatch": bench_tool_dispatch,
+    "orchestrators": bench_orchestrators,
+}
@@ -0,0 +1,30 @@
+## Runs the tests that don't need a live endpoint (the proxy ones run against a local mock Azure OpenAI server)
+##
+## Usage: python test/offline.py
+
+## Load src into path
+import sys
+sys.path.insert(0, 'src')
+sys.path.insert(0, 'test')
+
+import os
+import logging
+
+## (So loading the configs doesn't look for them in Cosmos)
+os.environ.setdefault('CONFIGS_CHECK_COSMOS', 'false')
+
+logging.basicConfig(level=logging.ERROR)
+
+from tests.test_chat_context import run as run_chat_context
+from tests.test_lazy_history import run as run_lazy_history
+from tests.test_write_behind_buffer import run as run_write_behind_buffer
+from tests.test_stream_dispatcher import run as run_stream_dispatcher
+from tests.test_completions_proxy_mock import run as run_completions_proxy_mock
+from tests.test_async_completions_proxy_mock import run as run_async_completions_proxy_mock
+
+run_chat_context()
+run_lazy_history()
+run_write_behind_buffer()
+run_stream_dispatcher()
+run_completions_proxy_mock()
+run_async_completions_proxy_mock()
@@ -69,6 +69,11 @@ import tests
 # test_completions_proxy(streamer)
 # print("\n------------------------\n")
 
+# ## Test the Async Completions Proxy
+# from tests.test_async_completions_proxy import run as test_async_completions_proxy
+# test_async_completions_proxy(streamer)
+# print("\n------------------------\n")
+
 # ## Test the Assistants Proxy
 # from tests.test_assistant_proxy import run as test_assistants_proxy
 # test_assistants_proxy(streamer)
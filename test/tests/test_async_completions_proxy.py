@@ -0,0 +1,20 @@
+import asyncio
+
+from aiproxy import ChatContext
+from aiproxy.data import ChatConfig
+from aiproxy.proxy import AsyncCompletionsProxy
+from aiproxy.streaming import StreamWriter
+
+def run(streamer:StreamWriter):
+    print("Running a test using the Async Completions Proxy")
+
+    config = ChatConfig.load('test-completions')
+    comp = AsyncCompletionsProxy(config)     ## Not using the registry here, as the config name is shared with the Completions Proxy test
+    
+    ## Send a few prompts concurrently on the one event loop
+    async def ask_all():
+        questions = [ "What is the capital of France?", "What is the capital of Japan?", "What is the capital of Peru?" ]
+        return await asyncio.gather(*[ comp.send_message_async(q, ChatContext(None, stream=streamer)) for q in questions ])
+    
+    for resp in asyncio.run(ask_all()):
+        print(resp.message)
@@ -0,0 +1,113 @@
+import os
+import asyncio
+import tempfile
+import threading
+from typing import Annotated
+
+from aiproxy import ChatContext
+from aiproxy.data import ChatConfig
+from aiproxy.proxy import AsyncCompletionsProxy
+from aiproxy.streaming import FunctionStreamWriter, get_stream_dispatcher
+from aiproxy.functions import GLOBAL_FUNCTIONS_REGISTRY
+
+from benchmarks.mock_server import MockAzureOpenAIServer, MockReply
+
+MOCK_FUNCTION = "mock_lookup"
+_lookups = []
+
+def mock_lookup(key:Annotated[str, "The key to lookup"]) -> str:
+    _lookups.append(key)
+    return f"The value for {key}"
+
+def _responder(body:dict) -> MockReply:
+    ## Answers with the prompt (so each response can be matched to its request), or asks for the function to be called when the prompt mentions a key
+    last = body["messages"][-1]
+    if last.get("role") == "tool":
+        return MockReply(content=f"Found: {last.get('content')}")
+    if body.get("tools") and "key" in last.get("content", ""):
+        return MockReply(tool_calls=[ (MOCK_FUNCTION, { "key": "k1" }) ])
+    return MockReply(content=f"You asked: {last.get('content')}")
+
+def _proxy(server:MockAzureOpenAIServer, name:str, **config) -> AsyncCompletionsProxy:
+    config_dict = { "name": name, "oai-endpoint": server.endpoint, "oai-key": "mock-key", "oai-version": "2024-10-21", "oai-model": "mock-model", "use-functions": False }
+    config_dict.update(config)
+    return AsyncCompletionsProxy(ChatConfig.load(config_dict))
+
+def test_concurrent_prompts(server:MockAzureOpenAIServer):
+    ## Several prompts in flight at once on the one event loop each get their own answer
+    proxy = _proxy(server, "mock-async-concurrent")
+    questions = [ f"Question {idx}?" for idx in range(8) ]
+    async def ask_all():
+        return await asyncio.gather(*[ proxy.send_message_async(question, ChatContext()) for question in questions ])
+    for question, response in zip(questions, asyncio.run(ask_all())):
+        assert not response.failed, response.error
+        assert response.message == f"You asked: {question}", response.message
+
+def test_streaming(server:MockAzureOpenAIServer):
+    ## The streamed deltas add up to the final message (a writer that may block is handed to the stream dispatcher, rather than pushing from the event loop)
+    proxy = _proxy(server, "mock-async-streaming", **{ "publish-frequency": 0 })
+    received = []
+    streamer = FunctionStreamWriter(stream_function=lambda msg: received.append(msg.to_dict() if hasattr(msg, 'to_dict') else msg))
+    streamer._async = False
+    response = asyncio.run(proxy.send_message_async("Tell me a story", ChatContext(stream=streamer)))
+    assert not response.failed, response.error
+    assert streamer._dispatcher is get_stream_dispatcher() and get_stream_dispatcher().flush(5)
+    deltas = "".join(msg.get("delta") for msg in received if type(msg) is dict and msg.get("type") == "interim")
+    assert deltas == response.message == "You asked: Tell me a story", deltas
+
+def test_tool_calls(server:MockAzureOpenAIServer):
+    ## A requested function is called (off the event loop), and the answer is built from its result
+    GLOBAL_FUNCTIONS_REGISTRY.register_base_function(MOCK_FUNCTION, "Lookup the value for a key (mock function)", mock_lookup)
+    proxy = _proxy(server, "mock-async-tools", **{ "use-functions": True })
+    _lookups.clear()
+    context = ChatContext(function_filter=lambda name, _: name == MOCK_FUNCTION)
+    response = asyncio.run(proxy.send_message_async("Lookup my key", context))
+    assert not response.failed, response.error
+    assert _lookups == [ "k1" ]
+    assert response.message == "Found: The value for k1", response.message
+
+def test_response_cache(server:MockAzureOpenAIServer):
+    ## A repeated (deterministic) prompt is answered from the (SQLite) response cache, without calling the model again
+    with tempfile.TemporaryDirectory() as dir_path:
+        proxy = _proxy(server, "mock-async-cache", **{ "response-cache": "sqlite", "response-cache-path": os.path.join(dir_path, "cache.db"), "temperature": 0 })
+        requests = []
+        responder = server.responder
+        server.responder = lambda body: requests.append(body) or responder(body)
+        try:
+            for stream in [ False, True ]:
+                for _ in range(2):
+                    context = ChatContext(stream=FunctionStreamWriter(stream_function=lambda _: None)) if stream else ChatContext()
+                    prompt = "Cache me (streamed)" if stream else "Cache me"
+                    response = asyncio.run(proxy.send_message_async(prompt, context))
+                    assert not response.failed, response.error
+                    assert response.message == f"You asked: {prompt}", response.message
+        finally:
+            server.responder = responder
+        assert len(requests) == 2, f"Expected a call to the model for each of the streamed + non-streamed prompts, not {len(requests)}"
+
+def test_event_loops(server:MockAzureOpenAIServer):
+    ## The one proxy can be used from several event loops (eg. `asyncio.run` on several threads, one after another on the same thread)
+    proxy = _proxy(server, "mock-async-loops")
+    results, errors = [], []
+    def ask(idx:int):
+        try:
+            for turn in range(2):
+                response = asyncio.run(proxy.send_message_async(f"Loop {idx}.{turn}", ChatContext()))
+                results.append(response.message if not response.failed else response.error)
+        except Exception as e:
+            errors.append(e)
+    threads = [ threading.Thread(target=ask, args=(idx,)) for idx in range(4) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert len(errors) == 0, errors
+    assert sorted(results) == sorted(f"You asked: Loop {idx}.{turn}" for idx in range(4) for turn in range(2)), results
+
+def run():
+    print("Running the Async Completions Proxy tests (against the mock server)")
+    with MockAzureOpenAIServer(responder=_responder) as server:
+        test_concurrent_prompts(server)
+        test_streaming(server)
+        test_tool_calls(server)
+        test_response_cache(server)
+        test_event_loops(server)
+    print("Async Completions Proxy tests passed")
@@ -0,0 +1,70 @@
+from aiproxy import ChatContext
+from aiproxy.data import ChatMessage
+
+def _messages(count:int, prefix:str = "m") -> list[ChatMessage]:
+    return [ ChatMessage(message=f"{prefix}{idx}", role='user' if idx % 2 == 0 else 'assistant') for idx in range(count) ]
+
+def _converted(history:list[ChatMessage]) -> list[dict]:
+    return [ message.to_openid_message() for message in history ]
+
+def test_appends_extend_cache():
+    ## Messages appended to the history are converted + added to the cached list (the messages already converted aren't converted again)
+    context = ChatContext()
+    context.history = _messages(3)
+    messages = context.get_openai_messages()
+    assert messages == _converted(context.history)
+    first = list(messages)
+
+    context.add_message_to_history(ChatMessage(message="m3", role='assistant'))
+    context.history.append(ChatMessage(message="m4", role='user'))
+    extended = context.get_openai_messages()
+    assert extended is messages, "The cached list should have been extended"
+    assert extended == _converted(context.history)
+    assert all(cached is original for cached, original in zip(extended, first)), "The earlier messages should not have been converted again"
+
+def test_changed_history_rebuilds_cache():
+    ## Truncating the history, or replacing it (eg. when it's folded into a summary), rebuilds the cached list
+    context = ChatContext()
+    context.history = _messages(5)
+    messages = context.get_openai_messages()
+
+    del context.history[3:]
+    truncated = context.get_openai_messages()
+    assert truncated is not messages and truncated == _converted(context.history)
+
+    ## (The same length as before, but the last message has been replaced)
+    context.history[-1] = ChatMessage(message="replaced", role='user')
+    context.history.append(ChatMessage(message="m3", role='assistant'))
+    context.history.append(ChatMessage(message="m4", role='user'))
+    replaced_last = context.get_openai_messages()
+    assert replaced_last == _converted(context.history) and replaced_last[2]["content"] == "replaced", replaced_last
+
+    context.history = _messages(2, prefix="summary")
+    replaced = context.get_openai_messages()
+    assert replaced == _converted(context.history), replaced
+
+def test_smaller_start_adds_earlier_messages():
+    ## Asking for the messages from an earlier start (eg. a larger history window) converts just the earlier messages, adding them to the front of the cached list
+    context = ChatContext()
+    context.history = _messages(6)
+    window = context.get_openai_messages(4)
+    assert window == _converted(context.history[4:])
+    later = list(window)
+
+    wider = context.get_openai_messages(1)
+    assert wider == _converted(context.history[1:])
+    assert all(cached is original for cached, original in zip(wider[3:], later)), "The later messages should not have been converted again"
+    assert context.get_openai_messages(3) == _converted(context.history[3:])
+    assert context.get_openai_messages() == _converted(context.history)
+
+    ## (Appends still extend the list, whatever start it's read from)
+    context.history.append(ChatMessage(message="m6", role='assistant'))
+    assert context.get_openai_messages(5) == _converted(context.history[5:])
+    assert context.get_openai_messages() == _converted(context.history)
+
+def run():
+    print("Running the ChatContext tests")
+    test_appends_extend_cache()
+    test_changed_history_rebuilds_cache()
+    test_smaller_start_adds_earlier_messages()
+    print("ChatContext tests passed")
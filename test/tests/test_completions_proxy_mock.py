@@ -0,0 +1,68 @@
+from time import sleep, monotonic
+from typing import Annotated
+
+from aiproxy import ChatContext
+from aiproxy.data import ChatConfig
+from aiproxy.proxy import CompletionsProxy
+from aiproxy.functions import GLOBAL_FUNCTIONS_REGISTRY
+
+from benchmarks.mock_server import MockAzureOpenAIServer, MockReply
+
+MOCK_FUNCTION = "mock_slow_lookup"
+## The keys the model asks for (in the order it asks for them), with how long each lookup takes
+DELAYS = { "slow": 0.4, "fast": 0.1, "medium": 0.25 }
+
+def mock_slow_lookup(key:Annotated[str, "The key to lookup"]) -> str:
+    sleep(DELAYS[key])
+    return f"The value for {key}"
+
+def _responder(body:dict) -> MockReply:
+    ## Asks for all the keys to be looked up at once, then answers with the lookups' results (in the order they're in the history)
+    last = body["messages"][-1]
+    if last.get("role") == "tool":
+        results = [ message.get("content") for message in body["messages"] if message.get("role") == "tool" ]
+        return MockReply(content="; ".join(results))
+    return MockReply(tool_calls=[ (MOCK_FUNCTION, { "key": key }) for key in DELAYS ])
+
+def _proxy(server:MockAzureOpenAIServer, name:str, **config) -> CompletionsProxy:
+    config_dict = { "name": name, "oai-endpoint": server.endpoint, "oai-key": "mock-key", "oai-version": "2024-10-21", "oai-model": "mock-model", "use-functions": True }
+    config_dict.update(config)
+    return CompletionsProxy(ChatConfig.load(config_dict))
+
+def _lookup_all(proxy:CompletionsProxy) -> tuple[ChatContext, float]:
+    context = ChatContext(function_filter=lambda name, _: name == MOCK_FUNCTION)
+    start = monotonic()
+    response = proxy.send_message("Lookup all my keys", context)
+    elapsed = monotonic() - start
+    assert not response.failed, response.error
+    assert response.message == "; ".join(f"The value for {key}" for key in DELAYS), response.message
+    return context, elapsed
+
+def _assert_tool_results_in_order(context:ChatContext):
+    ## The results are in the history in the order the tool calls were requested (not the order the functions finished in)
+    tool_messages = [ message for message in context.history if message.role == 'tool' ]
+    assert [ message.tool_call_id for message in tool_messages ] == [ f"call_{idx}" for idx in range(len(DELAYS)) ], [ message.tool_call_id for message in tool_messages ]
+    assert [ message.message for message in tool_messages ] == [ f"The value for {key}" for key in DELAYS ], [ message.message for message in tool_messages ]
+
+def test_parallel_tool_calls(server:MockAzureOpenAIServer):
+    ## With `max-parallel-tools` > 1 the functions run at the same time, so the turn takes about as long as the slowest one
+    proxy = _proxy(server, "mock-parallel-tools", **{ "max-parallel-tools": len(DELAYS) })
+    context, elapsed = _lookup_all(proxy)
+    _assert_tool_results_in_order(context)
+    slowest, total = max(DELAYS.values()), sum(DELAYS.values())
+    assert slowest <= elapsed < slowest + (total - slowest) / 2, f"Took {elapsed:.2f}s, expected about {slowest}s (the slowest function)"
+
+def test_sequential_tool_calls(server:MockAzureOpenAIServer):
+    ## With `max-parallel-tools` of 1 the functions run one after another (in the same order)
+    proxy = _proxy(server, "mock-sequential-tools", **{ "max-parallel-tools": 1 })
+    context, elapsed = _lookup_all(proxy)
+    _assert_tool_results_in_order(context)
+    assert elapsed >= sum(DELAYS.values()), f"Took {elapsed:.2f}s, expected at least {sum(DELAYS.values())}s (all the functions)"
+
+def run():
+    print("Running the Completions Proxy tests (against the mock server)")
+    GLOBAL_FUNCTIONS_REGISTRY.register_base_function(MOCK_FUNCTION, "Lookup the value for a key, slowly (mock function)", mock_slow_lookup)
+    with MockAzureOpenAIServer(responder=_responder) as server:
+        test_parallel_tool_calls(server)
+        test_sequential_tool_calls(server)
+    print("Completions Proxy tests passed")
@@ -0,0 +1,152 @@
+import os
+import tempfile
+
+from aiproxy import ChatContext
+from aiproxy.data.chat_message import ChatMessage
+from aiproxy.data.lazy_history import LazyHistory, StaleHistoryError, as_list
+from aiproxy.history import FileHistoryProvider, SqliteHistoryProvider, MapHistoryProvider
+
+def _messages(start:int, end:int) -> list[ChatMessage]:
+    return [ ChatMessage(message=f"m{idx}", role="user") for idx in range(start, end) ]
+
+def _texts(history:list[ChatMessage]) -> list[str]:
+    return [ msg.message for msg in history ]
+
+def test_lazy_history():
+    reads = []
+    stored = { "count": 30 }
+    def load_range(start:int, end:int, count:int) -> list[ChatMessage]:
+        if count != stored["count"]: return None
+        reads.append((start, end))
+        return _messages(start, end)
+
+    ## Only the last 5 of the 30 messages are loaded
+    history = LazyHistory(_messages(25, 30), 30, load_range, page_size=10)
+    assert len(history) == 30 and history.loaded_from == 25
+    assert history[-1].message == "m29" and _texts(history[-3:]) == [ "m27", "m28", "m29" ]
+    assert reads == [], "Reading the loaded messages shouldn't load any more"
+
+    ## Reading a single older message only loads its page
+    assert history[3].message == "m3"
+    assert reads == [ (0, 10) ] and history.loaded_from == 25
+
+    ## A copy doesn't share the pages (or the loaded messages) with the original
+    clone = history.copy()
+    clone.append(ChatMessage(message="clone", role="user"))
+    assert len(history) == 30 and len(clone) == 31
+    assert clone._pages[0] is not history._pages[0]
+
+    ## Going through the whole thread loads the rest of it in a single read
+    reads.clear()
+    assert _texts(history) == _texts(_messages(0, 30))
+    assert reads == [ (0, 25) ] and history.loaded_from == 0
+
+    ## Once the stored thread has changed, its older messages aren't loaded (until the history has been saved over it)
+    history = LazyHistory(_messages(25, 30), 30, load_range, page_size=10)
+    stored["count"] = 12
+    try:
+        history[3]
+        assert False, "The older messages of a changed thread shouldn't be loaded"
+    except StaleHistoryError:
+        pass
+    assert history[-1].message == "m29"
+    history.mark_stored(12)
+    assert history[3].message == "m3"
+    stored["count"] = 10     ## (For the threads below)
+
+    ## It can be added to a list (from either side), and `as_list` returns a plain list
+    lazy = LazyHistory(_messages(8, 10), 10, load_range, page_size=4)
+    assert _texts([ ChatMessage(message="first", role="user") ] + lazy) == [ "first" ] + _texts(_messages(0, 10))
+    assert _texts(lazy + [ ChatMessage(message="last", role="user") ]) == _texts(_messages(0, 10)) + [ "last" ]
+    lazy = LazyHistory(_messages(8, 10), 10, load_range, page_size=4)
+    assert type(as_list(lazy)) is list and _texts(as_list(lazy)) == _texts(_messages(0, 10))
+
+def _providers(dir_path:str) -> dict:
+    os.makedirs(os.path.join(dir_path, "file"))
+    os.makedirs(os.path.join(dir_path, "gzip"))
+    return {
+        "file": lambda: FileHistoryProvider(os.path.join(dir_path, "file")),
+        "file-gzip": lambda: FileHistoryProvider(os.path.join(dir_path, "gzip"), compress="gzip"),
+        "sqlite": lambda: SqliteHistoryProvider(os.path.join(dir_path, "history.db")),
+        "map": lambda: MapHistoryProvider(),
+    }
+
+def _save_thread(provider, count:int) -> str:
+    context = ChatContext(history_provider=provider)
+    context.init_history(None, "system")
+    for idx in range(count):
+        context.add_prompt_to_history(f"m{idx}", "user")
+    context.save_history()
+    return context.thread_id
+
+def check_history_provider(name:str, provider):
+    ## A lazily loaded thread that's appended to only writes the new messages
+    thread_id = _save_thread(provider, 20)
+    context = ChatContext(thread_id=thread_id, history_provider=provider, history_page_size=5)
+    context.init_history()
+    assert type(context.history) is LazyHistory and len(context.history) == 21, f"{name}: the thread should be loaded lazily"
+    context.add_prompt_to_history("new", "user")
+    context.save_history()
+    assert context.history.loaded_from > 0, f"{name}: appending shouldn't load the older messages"
+    history, _ = provider.load_history(thread_id)
+    assert _texts(history) == [ "system" ] + [ f"m{idx}" for idx in range(20) ] + [ "new" ], f"{name}: append"
+    assert context.history[0].message == "system", f"{name}: the older messages can still be loaded after saving"
+
+    ## A re-arranged history (eg. folded into a summary) rewrites the whole thread
+    context = ChatContext(thread_id=thread_id, history_provider=provider, history_page_size=5)
+    context.init_history()
+    context.history = context.history[:1] + [ ChatMessage(message="summary", role="system") ] + context.history[-2:]
+    context.save_history()
+    history, _ = provider.load_history(thread_id)
+    assert _texts(history) == [ "system", "summary", "m19", "new" ], f"{name}: rewrite"
+
+    ## A fully loaded thread that has changed since it was loaded is rewritten (the last save wins)
+    thread_id = _save_thread(provider, 3)
+    stale = ChatContext(thread_id=thread_id, history_provider=provider)
+    stale.init_history()
+    other = ChatContext(thread_id=thread_id, history_provider=provider)
+    other.init_history()
+    other.add_prompt_to_history("other", "user")
+    other.save_history()
+    stale.add_prompt_to_history("stale", "user")
+    stale.save_history()
+    history, _ = provider.load_history(thread_id)
+    assert _texts(history) == [ "system", "m0", "m1", "m2", "stale" ], f"{name}: last save wins"
+
+    ## While a lazily loaded thread that has changed has the new messages added to it as it is (rather than mixing its older messages into the rewrite)
+    thread_id = _save_thread(provider, 12)
+    lazy = ChatContext(thread_id=thread_id, history_provider=provider, history_page_size=3)
+    lazy.init_history()
+    other = ChatContext(thread_id=thread_id, history_provider=provider)
+    other.init_history()
+    other.history = [ other.history[0], ChatMessage(message="folded", role="system") ]
+    other.save_history()
+    lazy.add_prompt_to_history("lazy", "user")
+    lazy.save_history()
+    history, _ = provider.load_history(thread_id)
+    assert _texts(history) == [ "system", "folded", "lazy" ], f"{name}: append to a changed thread"
+
+    ## The older messages of a lazily loaded thread that has changed since are never read from the changed thread
+    thread_id = _save_thread(provider, 12)
+    lazy = ChatContext(thread_id=thread_id, history_provider=provider, history_page_size=3)
+    lazy.init_history()
+    other = ChatContext(thread_id=thread_id, history_provider=provider)
+    other.init_history()
+    other.history = [ other.history[0], ChatMessage(message="folded", role="system") ]
+    other.save_history()
+    try:
+        lazy.history[1]
+        assert False, f"{name}: the older messages were read from the changed thread"
+    except StaleHistoryError:
+        pass
+
+def run():
+    print("Running the LazyHistory + history provider tests")
+    test_lazy_history()
+    with tempfile.TemporaryDirectory() as dir_path:
+        for name, create_provider in _providers(dir_path).items():
+            provider = create_provider()
+            check_history_provider(name, provider)
+            if hasattr(provider, 'close'): provider.close()
+            print(f"  {name}: ok")
+    print("LazyHistory + history provider tests passed")
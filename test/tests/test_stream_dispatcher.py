@@ -0,0 +1,110 @@
+import random
+import threading
+from time import sleep, perf_counter
+
+from aiproxy.streaming import FunctionStreamWriter, StreamDispatcher
+from aiproxy.telemetry.metrics import MetricsRegistry
+
+def _dispatcher(**kwargs) -> StreamDispatcher:
+    ## (A registry of its own, so the tests don't add to the process-wide metrics)
+    return StreamDispatcher(registry=MetricsRegistry(), **kwargs)
+
+def _writer(dispatcher:StreamDispatcher, stream_id:str, received:list, push_fn = None) -> FunctionStreamWriter:
+    def push(message):
+        if push_fn is not None: push_fn(message)
+        received.append(message)
+    writer = FunctionStreamWriter(stream_function=push, stream_id=stream_id)
+    writer._async = True
+    writer.set_dispatcher(dispatcher)
+    return writer
+
+def test_ordering():
+    ## Each stream's messages are delivered in the order they were pushed, however the workers interleave the streams
+    dispatcher = _dispatcher(max_workers=4)
+    rand = random.Random(0)
+    received = { f"s{idx}": [] for idx in range(6) }
+    writers = [ _writer(dispatcher, stream_id, messages, lambda _: sleep(rand.random() / 1000)) for stream_id, messages in received.items() ]
+    for step in range(50):
+        for writer in writers:
+            writer.push_message({ "type": "step", "step": step })
+            writer.push_message({ "type": "interim", "id": "msg", "delta": f"{step} " })
+    assert dispatcher.flush(10), "The messages weren't delivered in time"
+
+    for stream_id, messages in received.items():
+        steps = [ message["step"] for message in messages if message["type"] == "step" ]
+        assert steps == list(range(50)), f"{stream_id}: the steps are out of order"
+        deltas = "".join(message["delta"] for message in messages if message["type"] == "interim")
+        assert deltas == "".join(f"{step} " for step in range(50)), f"{stream_id}: the deltas are out of order"
+
+def test_coalescing():
+    ## The interim deltas that are waiting behind a slow push are coalesced into a single message, and the other streams aren't held up by it
+    dispatcher = _dispatcher(max_workers=2)
+    release = threading.Event()
+    slow_received, fast_received = [], []
+    slow = _writer(dispatcher, "slow", slow_received, lambda _: release.wait(5))
+    fast = _writer(dispatcher, "fast", fast_received)
+
+    slow.push_message({ "type": "progress", "message": "Thinking" })
+    sleep(0.05)     ## (So the first message is being pushed while the deltas are queued)
+    for idx in range(20):
+        slow.push_message({ "type": "interim", "id": "msg", "delta": str(idx % 10) })
+    slow.push_message({ "type": "info", "message": "done" })
+    slow.push_message({ "type": "interim", "id": "msg", "delta": "!" })
+
+    fast.push_message({ "type": "info", "message": "fast" })
+    for _ in range(100):
+        if len(fast_received) > 0: break
+        sleep(0.01)
+    assert len(fast_received) == 1, "The fast stream was held up by the slow one"
+
+    release.set()
+    assert dispatcher.flush(5)
+    assert [ message["type"] for message in slow_received ] == [ "progress", "interim", "info", "interim" ]
+    assert slow_received[1]["delta"] == "".join(str(idx % 10) for idx in range(20))
+    stats = dispatcher.stats()
+    assert stats["coalesced"] == 19 and stats["delivered"] == 5 and stats["dropped"] == 0, stats
+
+def test_full_queue():
+    ## Once a stream's queue is full, the oldest progress message is dropped to make room (and then, the push gives up after the timeout)
+    dispatcher = _dispatcher(max_workers=1, max_queue_size=2, put_timeout_secs=0.05)
+    release = threading.Event()
+    received = []
+    writer = _writer(dispatcher, "full", received, lambda _: release.wait(5))
+    writer.push_message({ "type": "info", "message": "first" })
+    sleep(0.05)
+    writer.push_message({ "type": "progress", "message": "stale" })
+    writer.push_message({ "type": "info", "message": "a" })
+    writer.push_message({ "type": "info", "message": "b" })     ## (Replaces the progress message)
+    writer.push_message({ "type": "info", "message": "c" })     ## (The queue is full of messages that can't be dropped, so this one is)
+    release.set()
+    assert dispatcher.flush(5)
+    assert [ message["message"] for message in received ] == [ "first", "a", "b" ]
+    assert dispatcher.stats()["dropped"] == 2
+
+def test_full_queue_no_block():
+    ## A push that mustn't block never waits for room, an interim delta is added to the newest one queued for its message instead (and any other message is dropped)
+    dispatcher = _dispatcher(max_workers=1, max_queue_size=2, put_timeout_secs=5)
+    release = threading.Event()
+    received = []
+    writer = _writer(dispatcher, "no-block", received, lambda _: release.wait(5))
+    writer.push_message({ "type": "info", "message": "first" })
+    sleep(0.05)
+    writer.push_message({ "type": "interim", "id": "msg", "delta": "a" })
+    writer.push_message({ "type": "info", "message": "b" })
+    start = perf_counter()
+    writer.push_message({ "type": "interim", "id": "msg", "delta": "c" }, block=False)
+    writer.push_message({ "type": "info", "message": "d" }, block=False)
+    assert perf_counter() - start < 1, "The push waited for room"
+    release.set()
+    assert dispatcher.flush(5)
+    assert [ message.get("delta", message.get("message")) for message in received ] == [ "first", "ac", "b" ]
+    stats = dispatcher.stats()
+    assert stats["coalesced"] == 1 and stats["dropped"] == 1, stats
+
+def run():
+    print("Running the StreamDispatcher tests")
+    test_ordering()
+    test_coalescing()
+    test_full_queue()
+    test_full_queue_no_block()
+    print("StreamDispatcher tests passed")
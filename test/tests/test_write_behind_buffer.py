@@ -0,0 +1,117 @@
+import threading
+from time import sleep, monotonic
+
+from aiproxy.history.write_behind_buffer import WriteBehindBuffer
+from aiproxy.history.cosmos_history_provider import _ThreadSave, _merge_saves
+
+class _Writes:
+    ## A fake `write_fn`, that records the writes (and can be held up, to see what the buffer does while a batch is being written)
+    def __init__(self, delay_secs:float = 0):
+        self.written = []
+        self.delay_secs = delay_secs
+        self.release = threading.Event()
+        self.release.set()
+        self.writing = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, key:str, item:any):
+        self.writing.set()
+        self.release.wait(5)
+        if self.delay_secs > 0: sleep(self.delay_secs)
+        with self._lock:
+            self.written.append((key, item))
+
+def test_coalescing():
+    ## The saves of a key that's still pending are merged, so only the latest version is written
+    writes = _Writes()
+    buffer = WriteBehindBuffer(writes, flush_interval_secs=60, max_workers=1, merge_fn=lambda pending, item: pending + item)
+    for idx in range(10):
+        buffer.put("thread", [ idx ])
+    assert buffer.get("thread") == list(range(10))
+    assert buffer.flush(5)
+    assert writes.written == [ ("thread", list(range(10))) ]
+    assert buffer.puts == 10 and buffer.coalesced == 9 and buffer.writes == 1
+    buffer.close()
+
+def test_flush_threshold():
+    ## Reaching the threshold writes the pending items straight away (rather than after the interval)
+    writes = _Writes()
+    buffer = WriteBehindBuffer(writes, flush_interval_secs=60, flush_threshold=5, max_workers=2)
+    for idx in range(4):
+        buffer.put(f"k{idx}", idx)
+    sleep(0.1)
+    assert len(writes.written) == 0, "Written before the threshold was reached"
+    buffer.put("k4", 4)
+    for _ in range(100):
+        if len(writes.written) == 5: break
+        sleep(0.01)
+    assert sorted(writes.written) == [ (f"k{idx}", idx) for idx in range(5) ]
+    buffer.close()
+
+def test_backpressure():
+    ## Once `max_pending` keys are pending, `put` waits for the next batch to be written (or gives up after its timeout)
+    writes = _Writes()
+    writes.release.clear()
+    buffer = WriteBehindBuffer(writes, flush_interval_secs=60, flush_threshold=2, max_pending=2, max_workers=1)
+    buffer.put("a", 1)
+    buffer.put("b", 2)      ## (Starts writing the batch, which is held up)
+    assert writes.writing.wait(5)
+    buffer.put("c", 3)
+    buffer.put("d", 4)
+    start = monotonic()
+    assert not buffer.put("e", 5, timeout_secs=0.1), "The buffer should be full"
+    assert monotonic() - start >= 0.1
+    assert buffer.put("d", 40, timeout_secs=0.1), "A pending key can always be replaced"
+
+    ## Once the held up batch has been written, there's room again
+    threading.Timer(0.1, writes.release.set).start()
+    assert buffer.put("e", 5, timeout_secs=5)
+    assert buffer.flush(5)
+    assert sorted(writes.written) == [ ("a", 1), ("b", 2), ("c", 3), ("d", 40), ("e", 5) ]
+    buffer.close()
+
+def test_put_while_writing():
+    ## A key that's being written is still visible to `get` (from the in-flight batch), and a new save of it is written after the one in flight
+    writes = _Writes()
+    writes.release.clear()
+    buffer = WriteBehindBuffer(writes, flush_interval_secs=60, max_workers=1, merge_fn=lambda pending, item: pending + item)
+    buffer.put("thread", [ 1 ])
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    assert writes.writing.wait(5)
+    assert buffer.get("thread") == [ 1 ], "The in-flight version should be returned"
+    assert buffer.pending_count() == 1
+    buffer.put("thread", [ 2 ])     ## (Not merged with the in-flight version, which is already being written)
+    assert buffer.get("thread") == [ 2 ]
+    writes.release.set()
+    flusher.join(5)
+    assert buffer.flush(5)
+    assert writes.written == [ ("thread", [ 1 ]), ("thread", [ 2 ]) ]
+    assert buffer.get("thread") is None and buffer.pending_count() == 0
+    buffer.close()
+
+def test_merged_saves():
+    ## The history saves are merged into the messages the document is missing: appends to an append are still an append...
+    writes = _Writes()
+    buffer = WriteBehindBuffer(writes, flush_interval_secs=60, max_workers=1, merge_fn=_merge_saves)
+    rows = [ { "role": "user", "content": f"m{idx}" } for idx in range(6) ]
+    buffer.put("append", _ThreadSave(rows[2:4], 2, None, 3))       ## (A lazily loaded history, holding the messages from 2, that added the 4th)
+    buffer.put("append", _ThreadSave(rows[3:6], 3, { "v": 2 }, 4))
+    ## ...while an append to a thread that has a full rewrite pending (eg. after it was folded into a summary) still needs the full rewrite
+    buffer.put("rewrite", _ThreadSave(rows[:2], 0, None))
+    buffer.put("rewrite", _ThreadSave(rows[1:3], 1, None, 2))
+    assert buffer.flush(5)
+
+    saves = dict(writes.written)
+    assert saves["append"].new_from == 3 and saves["append"].start == 2 and saves["append"].rows == rows[2:6] and saves["append"].metadata == { "v": 2 }
+    assert saves["rewrite"].new_from is None and saves["rewrite"].start == 0 and saves["rewrite"].rows == rows[:3]
+    buffer.close()
+
+def run():
+    print("Running the WriteBehindBuffer tests")
+    test_coalescing()
+    test_flush_threshold()
+    test_backpressure()
+    test_put_while_writing()
+    test_merged_saves()
+    print("WriteBehindBuffer tests passed")